@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from typing import Dict, List
+
+from config_project import BENCHMARK_DIR
+from llm_router import resolve_llm_config
+from rate_governor import reset_governors
+from resilience import reset_resilience
+from step2_kernel_llm_extractor import LLMExtractor
+from telemetry import MetricsRecorder, percentile, summarize
+
+
+def _synthetic_source(rng: random.Random, file_index: int) -> str:
+    lines = ["#include <cuda_runtime.h>"]
+    if rng.random() < 0.3:
+        lines.append('#include "common.h"')
+    lines.append(f"#define BLOCK_SIZE_{file_index} {rng.choice([128, 256, 512])}")
+    lines.append("")
+
+    helper = f"scale_{file_index}"
+    lines.append(f"__device__ __forceinline__ float {helper}(float x) {{")
+    lines.append(f"    return x * {rng.uniform(0.5, 2.0):.3f}f + {rng.uniform(-1, 1):.3f}f;")
+    lines.append("}")
+    lines.append("")
+
+    kernel_names = []
+    for k in range(rng.choice([1, 1, 2, 2, 3, 4, 6, 10])):
+        name = f"kernel_{file_index}_{k}"
+        templated = rng.random() < 0.2
+        kernel_names.append(f"{name}<float>" if templated else name)
+        if templated:
+            lines.append("template <typename T>")
+        value_type = "T" if templated else "float"
+        lines.append(f"__global__ void {name}(const {value_type}* __restrict__ in, {value_type}* out, int n) {{")
+        lines.append("    int idx = blockIdx.x * blockDim.x + threadIdx.x;")
+        lines.append("    if (idx >= n) return;")
+        lines.append("    float acc = static_cast<float>(in[idx]);")
+        for step in range(rng.randint(2, 60)):
+            lines.append(f"    acc = acc * {rng.uniform(0.9, 1.1):.4f}f + {step}.0f;")
+        lines.append(f"    out[idx] = static_cast<{value_type}>({helper}(acc));")
+        lines.append("}")
+        lines.append("")
+
+    lines.append(f"void launch_{file_index}(const float* in, float* out, int n) {{")
+    lines.append(f"    int blocks = (n + BLOCK_SIZE_{file_index} - 1) / BLOCK_SIZE_{file_index};")
+    for name in kernel_names:
+        lines.append(f"    {name}<<<blocks, BLOCK_SIZE_{file_index}>>>(in, out, n);")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def generate_corpus(corpus_dir: str, file_count: int, seed: int) -> List[str]:
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(seed)
+
+    file_paths = []
+    for i in range(file_count):
+        file_path = os.path.join(corpus_dir, f"synthetic_{i:05d}.cu")
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(_synthetic_source(rng, i))
+        file_paths.append(file_path)
+    return file_paths
+
+
+def _endpoints(llm_config: Dict) -> List[Dict]:
+    # A route is benchmarked across all of its endpoints
+    return llm_config.get("endpoints") or [llm_config]
+
+
+def _capped(endpoint: Dict, concurrency: int) -> Dict:
+    return dict(endpoint, rate_limits=dict(endpoint.get("rate_limits", {}),
+                                           initial_concurrency=concurrency, max_concurrency=concurrency))
+
+
+def run_level(llm_config: Dict, file_paths: List[str], mode: str, concurrency: int) -> Dict:
+    # Every level starts from fresh rate governors, each endpoint capped at the level under test
+    reset_governors()
+    reset_resilience()
+    if llm_config.get("endpoints"):
+        endpoints = [_capped(endpoint, concurrency) for endpoint in llm_config["endpoints"]]
+        level_config = dict(llm_config, endpoints=endpoints)
+    else:
+        level_config = _capped(llm_config, concurrency)
+
+    run_id = f"{mode}-c{concurrency}"
+    run_dir = os.path.join(BENCHMARK_DIR, "runs", run_id)
+    os.makedirs(run_dir, exist_ok=True)
+
+    metrics = MetricsRecorder(os.path.join(BENCHMARK_DIR, "benchmark_metrics.jsonl"), run_id=run_id)
+    extractor = LLMExtractor(level_config, metrics=metrics, cache_enabled=False, local_extraction=False,
+                             ledger_path=os.path.join(run_dir, "ledger.jsonl"))
+
+    started_at = time.perf_counter()
+    if mode == "async":
+        results = asyncio.run(extractor.aextract_batch(
+            file_paths, run_dir, resume=False, max_concurrency=concurrency
+        ))
+    else:
+        results = extractor.extract_batch(file_paths, run_dir, resume=False, max_workers=concurrency)
+    elapsed = time.perf_counter() - started_at
+
+    records = metrics.load()
+    summary = summarize(records)
+    file_times = [r['elapsed'] for r in records if r['kind'] == 'file']
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'files': len(file_paths),
+        'extracted': len(results),
+        'kernels': summary['kernels'],
+        'elapsed': round(elapsed, 2),
+        'files_per_sec': round(len(results) / elapsed, 2) if elapsed else 0.0,
+        'requests': summary['requests'],
+        'retries': summary['retries'],
+        'hedged': summary['hedged'],
+        'prefix_cache_hit_rate': round(summary['prefix_cache_hit_rate'], 3),
+        'errors': summary['errors'],
+        'throttles': sum(stats['throttle_count'] for stats in extractor.generator.endpoint_stats()),
+        'latency_p50': round(summary['latency_p50'], 3),
+        'latency_p95': round(summary['latency_p95'], 3),
+        'latency_p99': round(summary['latency_p99'], 3),
+        'queue_wait_p95': round(summary['queue_wait_p95'], 3),
+        'file_p99': round(percentile(file_times, 99), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark step 2 extraction throughput against a synthetic corpus')
+    parser.add_argument('--config-file', default='config_llm.json', help='LLM configuration file')
+    parser.add_argument('--provider', default='mock', help='Provider or route entry in the configuration file')
+    parser.add_argument('--files', type=int, default=200, help='Number of synthetic source files')
+    parser.add_argument('--seed', type=int, default=0, help='Corpus random seed')
+    parser.add_argument('--concurrency', default='1,4,16,64', help='Comma separated concurrency levels')
+    parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both', help='Batch engine to benchmark')
+    parser.add_argument('--time-scale', type=float, default=None, help='Override the mock provider time scale')
+    parser.add_argument('--verbose', action='store_true', help='Keep per-file extraction logs')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+    if not args.verbose:
+        logging.getLogger('step2_kernel_llm_extractor').setLevel(logging.WARNING)
+
+    with open(args.config_file, 'r', encoding='utf-8') as f:
+        llm_config = resolve_llm_config(json.load(f), args.provider)
+    for endpoint in _endpoints(llm_config):
+        if endpoint.get("provider") != "mock":
+            logger.warning(f"Benchmarking a real endpoint ({endpoint.get('model_id')}), this spends API quota")
+        if args.time_scale is not None:
+            endpoint["mock"] = dict(endpoint.get("mock", {}), time_scale=args.time_scale)
+            # The hedge delay floor is wall-clock time, so it shrinks with the simulated latencies
+            hedging = endpoint.get("hedging", {})
+            endpoint["hedging"] = dict(hedging, min_delay_seconds=hedging.get("min_delay_seconds", 2.0) * args.time_scale)
+
+    file_paths = generate_corpus(os.path.join(BENCHMARK_DIR, "corpus"), args.files, args.seed)
+    logger.info(f"Synthetic corpus: {len(file_paths)} files")
+
+    modes = ['sync', 'async'] if args.mode == 'both' else [args.mode]
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+
+    rows = []
+    for mode in modes:
+        for concurrency in levels:
+            row = run_level(llm_config, file_paths, mode, concurrency)
+            rows.append(row)
+            logger.info(f"✓ {mode:5s} c={concurrency:<4d} {row['files_per_sec']:7.2f} files/s, "
+                        f"latency p50/p95/p99 {row['latency_p50']:.2f}/{row['latency_p95']:.2f}/"
+                        f"{row['latency_p99']:.2f}s, file p99 {row['file_p99']:.2f}s, "
+                        f"retries {row['retries']}, hedged {row['hedged']}, throttles {row['throttles']}, "
+                        f"errors {row['errors']}, extracted {row['extracted']}/{row['files']}")
+
+    report_path = os.path.join(BENCHMARK_DIR, "benchmark_report.json")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({'config': args.provider, 'files': args.files, 'seed': args.seed, 'runs': rows},
+                  f, indent=2, ensure_ascii=False)
+    logger.info(f"Benchmark report saved: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
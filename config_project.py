@@ -7,16 +7,117 @@ SOURCE_DIRECTORY = r"/group/ossdphi_algo_scratch_15/puyuyang/cuda-kernel-extract
 OUTPUT_ROOT = os.path.join(PROJECT_ROOT, "output")
 
 FILE_INVENTORY_PATH = os.path.join(OUTPUT_ROOT, "cuda_files_inventory.json")
+# Step 1 --delta: last scanned commit per git checkout (plus size/mtime of files outside git), and the
+# inventory of added, changed, renamed and deleted files that steps 2 and 3 then process
+SCAN_STATE_PATH = os.path.join(OUTPUT_ROOT, "scan_state.json")
+DELTA_INVENTORY_PATH = os.path.join(OUTPUT_ROOT, "cuda_files_delta.json")
 EXTRACTION_RESULTS_DIR = os.path.join(OUTPUT_ROOT, "extraction_results")
+# SQLite result store inside the results directory (result_store.py)
+RESULT_STORE_NAME = "results.db"
+# Journal mode of the result store and the distributed work queue, chosen once when a database is created.
+# WAL needs shared memory, which does not work across hosts on NFS; "WAL" is only safe if every reader and
+# writer runs on one host
+SHARED_JOURNAL_MODE = "DELETE"
 EXTRACTED_KERNELS_DIR = os.path.join(OUTPUT_ROOT, "extracted_kernels")
+EXTRACTION_LEDGER_PATH = os.path.join(OUTPUT_ROOT, "extraction_ledger.jsonl")
+METRICS_PATH = os.path.join(OUTPUT_ROOT, "pipeline_metrics.jsonl")
+BENCHMARK_DIR = os.path.join(OUTPUT_ROOT, "benchmark")
 
 PROMPT_TEMPLATE_DIR = os.path.join(PROJECT_ROOT, "template", "EN", "v1")
 SYSTEM_PROMPT_PATH = os.path.join(PROMPT_TEMPLATE_DIR, "system_prompt.txt")
 TASK_PROMPT_PATH = os.path.join(PROMPT_TEMPLATE_DIR, "task_prompt.txt")
+PACKED_TASK_PROMPT_PATH = os.path.join(PROMPT_TEMPLATE_DIR, "packed_task_prompt.txt")
+CONTINUATION_PROMPT_PATH = os.path.join(PROMPT_TEMPLATE_DIR, "continuation_prompt.txt")
+# Bump when the prompt templates change so cached LLM responses are not reused
+PROMPT_TEMPLATE_VERSION = "EN/v1"
+# Move the static task instructions (everything before the marker) into the system message so every
+# request starts with the same prefix and providers can cache it; only per-file content follows
+PROMPT_CACHE_LAYOUT = True
+PROMPT_INPUT_MARKER = "【Input Code】"
+
+LLM_CACHE_ENABLED = True
+LLM_CACHE_DIR = os.path.join(OUTPUT_ROOT, "llm_cache")
+LLM_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
 
 CUDA_EXTENSIONS = [".cu", ".cuh"]
+IGNORED_DIRECTORIES = [".git", ".svn", ".hg", "build", "__pycache__", "node_modules", ".tox", ".venv"]
+SCAN_WORKERS = os.cpu_count() or 1
 
 MAX_WORKERS = 8
 
+# Try the deterministic local extractor first; only files it cannot handle go to the LLM
+LOCAL_EXTRACTION_ENABLED = True
+
+# Files above this size are split into one request per kernel (plus its dependencies)
+SLICE_THRESHOLD_CHARS = 32000
+SLICE_MAX_PARALLEL = 8
+
+# LLM results are checked locally (balanced code, kernel definitions, helpers, kernel count); missing or
+# broken kernels get one follow-up request each for their slice of the source
+VALIDATION_ENABLED = True
+
+# Small files that need the LLM are packed into one request up to these limits
+PACKING_ENABLED = True
+PACK_MAX_FILE_CHARS = 6000
+PACK_MAX_CHARS = 24000
+PACK_MAX_FILES = 12
+
+# Stream single-file responses and ask for the remaining kernels when output hits max_tokens
+STREAMING_ENABLED = True
+MAX_CONTINUATIONS = 3
+
+# Step 2 uses the asyncio engine; MAX_WORKERS only applies to the thread-pool path
+ASYNC_EXTRACTION = True
+MAX_CONCURRENT_REQUESTS = 200
+
+# Provider or route entry in config_llm.json; a route spreads requests over several endpoints
+LLM_PROVIDER = "openai"
+
+# Step 2 submits work longest-first (estimated from file size and __global__ count) so one large file
+# does not start last and set the batch makespan; each request's max_tokens is sized from a local
+# estimate of its answer (times the headroom) instead of the endpoint's fixed max_tokens
+LPT_SCHEDULING = True
+TOKEN_BUDGETING = True
+OUTPUT_TOKEN_HEADROOM = 1.5
+MIN_OUTPUT_TOKENS = 1024
+
+# Step 4 header rewrite rules; rule sets are applied in one combined pass over a process pool
+HEADER_RULES_PATH = os.path.join(PROJECT_ROOT, "header_rules.json")
+HEADER_RULE_SETS = ["pytorch"]
+HEADER_REWRITE_WORKERS = os.cpu_count() or 1
+
+# Estimated Jaccard similarity above which extracted kernels are grouped as near duplicates (dedup_index.py)
+DEDUP_THRESHOLD = 0.85
+# Step 2 sends duplicate source files to the LLM once and copies the result; 1.0 only merges copies
+# that are identical after dropping comments and whitespace
+SOURCE_DEDUP_ENABLED = True
+SOURCE_DEDUP_THRESHOLD = 1.0
+
+# Step 3 thread pool for loading extraction results and writing kernel files
+SAVE_WORKERS = 16
+
+# pipeline.py: bound on work items waiting for extraction and on results waiting to be saved
+PIPELINE_QUEUE_SIZE = 256
+
+# dataset_exporter.py: zstd-compressed JSONL shards of extracted kernels plus an offset index for lookups by name.
+# Each shard is a sequence of independent zstd frames of about DATASET_FRAME_BYTES, so a lookup decompresses one frame
+DATASET_DIR = os.path.join(OUTPUT_ROOT, "dataset")
+DATASET_SHARD_MAX_BYTES = 256 * 1024 * 1024
+DATASET_FRAME_BYTES = 256 * 1024
+DATASET_ZSTD_LEVEL = 10
+
+# distributed_worker.py: any number of step 2 workers, on one host or on several sharing this output directory,
+# claim batches of inventory entries from a SQLite queue. Each lease is renewed every heartbeat; once it expires
+# (crashed or hung worker) its entries are handed out again, so the hosts' clocks must agree well within the lease
+WORK_QUEUE_PATH = os.path.join(OUTPUT_ROOT, "work_queue.db")
+# Per-worker ledger and metrics files; appends from several hosts to one file are not safe on NFS
+WORKER_DIR = os.path.join(OUTPUT_ROOT, "workers")
+WORK_BATCH_SIZE = 64
+WORK_BATCHES_IN_FLIGHT = 2
+WORK_LEASE_SECONDS = 300
+WORK_HEARTBEAT_SECONDS = 30
+# Claims per entry before it is marked failed, so a file that keeps crashing workers does not loop forever
+WORK_MAX_ATTEMPTS = 3
+
 LOG_LEVEL = "INFO"
 LOG_FILE = os.path.join(OUTPUT_ROOT, "extractor.log")
@@ -0,0 +1,379 @@
+import io
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+from config_project import (
+    EXTRACTION_RESULTS_DIR, EXTRACTED_KERNELS_DIR, DATASET_DIR, DATASET_SHARD_MAX_BYTES, DATASET_FRAME_BYTES, DATASET_ZSTD_LEVEL,
+    METRICS_PATH
+)
+from kernel_index import KernelIndex, unique_name
+from result_store import ResultStore, result_store_path
+from step3_kernel_saver import render_kernel
+from step4_clean_pytorch_headers import clean_header_content
+from telemetry import MetricsRecorder
+
+
+MANIFEST_NAME = "manifest.json"
+INDEX_MAGIC = b"KIDX0001"
+INDEX_HEADER = struct.Struct("<8sQ")
+# name hash, shard, frame offset, frame size, record offset and size inside the decompressed frame
+INDEX_ENTRY = struct.Struct("<QIQIII")
+
+
+def name_key(name: str) -> int:
+    return int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _require_zstd() -> None:
+    if not ZSTD_AVAILABLE:
+        raise ImportError("Dataset export requires zstandard library: pip install zstandard")
+
+
+class ShardWriter:
+    # Appends JSONL records to size-bounded shards, compressing them in frames of about frame_bytes;
+    # concatenated frames are still a valid zstd stream, so `zstd -dc shard` gives plain JSONL. Every file
+    # name starts with prefix, so an export never writes over the files of another one
+
+    def __init__(self, output_dir: Path, prefix: str, shard_max_bytes: int, frame_bytes: int, level: int):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.index_path = output_dir / f"{prefix}.idx"
+        self.shard_max_bytes = shard_max_bytes
+        self.frame_bytes = frame_bytes
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.shards: List[Dict] = []
+        self.entries: List[Tuple[int, int, int, int, int, int]] = []
+        self._file = None
+        self._frame = bytearray()
+        self._pending: List[Tuple[int, int, int]] = []
+
+    def add(self, name: str, line: bytes) -> None:
+        self._pending.append((name_key(name), len(self._frame), len(line)))
+        self._frame += line
+        if len(self._frame) >= self.frame_bytes:
+            self._flush_frame()
+
+    def _shard_path(self, shard: int) -> Path:
+        return self.output_dir / f"{self.prefix}-{shard:05d}.jsonl.zst"
+
+    def _close_shard(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+
+    def _open_shard(self) -> None:
+        self._close_shard()
+        shard = len(self.shards)
+        self.shards.append({'file': self._shard_path(shard).name, 'records': 0, 'bytes': 0})
+        self._file = open(self._shard_path(shard), 'wb')
+
+    def _flush_frame(self) -> None:
+        if not self._pending:
+            return
+        if self._file is None or self.shards[-1]['bytes'] >= self.shard_max_bytes:
+            self._open_shard()
+
+        data = self.compressor.compress(bytes(self._frame))
+        shard, frame_offset = len(self.shards) - 1, self.shards[-1]['bytes']
+        self._file.write(data)
+        for key, record_offset, record_size in self._pending:
+            self.entries.append((key, shard, frame_offset, len(data), record_offset, record_size))
+        self.shards[-1]['bytes'] += len(data)
+        self.shards[-1]['records'] += len(self._pending)
+        self._frame, self._pending = bytearray(), []
+
+    def close(self) -> None:
+        self._flush_frame()
+        self._close_shard()
+
+    def abort(self) -> None:
+        # Nothing references a failed export's files yet
+        self._close_shard()
+        for shard in range(len(self.shards)):
+            self._shard_path(shard).unlink(missing_ok=True)
+        self.index_path.unlink(missing_ok=True)
+
+    def write_index(self) -> None:
+        self.entries.sort()
+        with open(self.index_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(self.entries)))
+            for entry in self.entries:
+                f.write(INDEX_ENTRY.pack(*entry))
+
+
+class DatasetExporter:
+    # Exports the kernels in the step 2 result store as a dataset for training and eval jobs: one JSONL
+    # record per kernel with its code and provenance, instead of one small .cu file per kernel
+
+    def __init__(self, results_dir: str, output_dir: str, shard_max_bytes: int = DATASET_SHARD_MAX_BYTES,
+                 frame_bytes: int = DATASET_FRAME_BYTES, level: int = DATASET_ZSTD_LEVEL,
+                 content_filter: Optional[Callable[[str], str]] = clean_header_content,
+                 kernels_dir: str = EXTRACTED_KERNELS_DIR, include_duplicates: bool = False):
+        _require_zstd()
+        self.store = ResultStore(result_store_path(results_dir))
+        self.output_dir = Path(output_dir)
+        self.shard_max_bytes = shard_max_bytes
+        self.frame_bytes = frame_bytes
+        self.level = level
+        self.content_filter = content_filter
+        self.kernels_dir = Path(kernels_dir)
+        self.include_duplicates = include_duplicates
+        self.skipped_duplicates = 0
+        self.logger = logging.getLogger(__name__)
+
+    def _unique_name(self, func_name: str, source_file: str, taken: Set[str]) -> str:
+        # Same scheme as step 3 file names
+        name = unique_name(func_name, source_file, taken.__contains__)
+        taken.add(name)
+        return name
+
+    def _pruned_kernels(self) -> Set[Tuple[str, str]]:
+        # (source, kernel name) of the copies dedup_index.py --prune marked in the step 3 manifest
+        index = KernelIndex(self.kernels_dir / "kernel_manifest.json")
+        return {
+            (source_file, kernel['func_name'])
+            for source_file, entry in index.sources.items() for kernel in entry['kernels'].values()
+            if kernel.get('duplicate_of')
+        }
+
+    def iter_records(self) -> Iterator[Dict]:
+        taken = set()
+        # Only canonical copies are exported: duplicate sources whose canonical file is in the store, and
+        # near-duplicate kernels pruned by dedup_index.py
+        sources = set() if self.include_duplicates else set(self.store.revisions())
+        pruned = set() if self.include_duplicates else self._pruned_kernels()
+        self.skipped_duplicates = 0
+        for row in self.store.iter_results():
+            result = row['result']
+            if result.get('duplicate_of') in sources:
+                self.skipped_duplicates += len(result.get('kernels', []))
+                continue
+            invalid = result.get('invalid_kernels', {})
+            for kernel in result.get('kernels', []):
+                func_name = kernel.get('func_name', '')
+                func_content = kernel.get('func_content', '')
+                if not func_name or not func_content or func_name in invalid:
+                    continue
+                if (row['source_path'], func_name) in pruned:
+                    self.skipped_duplicates += 1
+                    continue
+                content = render_kernel(func_content, self.content_filter)
+                yield {
+                    'name': self._unique_name(func_name, row['source_path'], taken),
+                    'func_name': func_name,
+                    'signature': kernel.get('func_signature', ''),
+                    'content': content,
+                    'sha256': hashlib.sha256(content.encode('utf-8')).hexdigest(),
+                    'source_file': row['source_path'],
+                    'source_sha256': row['content_hash'],
+                    'duplicate_of': result.get('duplicate_of'),
+                    'extraction_method': result.get('extraction_method'),
+                    'model': row['model'],
+                    'template_version': row['template_version']
+                }
+
+    def _load_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self.output_dir / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _manifest_files(manifest: Optional[Dict]) -> Set[str]:
+        if not manifest:
+            return set()
+        return {manifest['index']} | {shard['file'] for shard in manifest['shards']}
+
+    def export(self) -> Dict:
+        # Each export is a new generation of shard and index files; switching manifest.json publishes it
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        previous = self._load_manifest()
+        generation = (previous or {}).get('generation', 0) + 1
+        writer = ShardWriter(self.output_dir, f"kernels-g{generation:06d}", self.shard_max_bytes,
+                             self.frame_bytes, self.level)
+
+        raw_bytes = 0
+        try:
+            for record in self.iter_records():
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+                raw_bytes += len(line)
+                writer.add(record['name'], line)
+            writer.close()
+            writer.write_index()
+        except BaseException:
+            writer.abort()
+            raise
+
+        manifest = {
+            'format': 'jsonl+zstd',
+            'generation': generation,
+            'created': time.time(),
+            'records': len(writer.entries),
+            'skipped_duplicates': self.skipped_duplicates,
+            'raw_bytes': raw_bytes,
+            'frame_bytes': self.frame_bytes,
+            'zstd_level': self.level,
+            'index': writer.index_path.name,
+            'shards': writer.shards
+        }
+        tmp_path = self.output_dir / f"{MANIFEST_NAME}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.output_dir / MANIFEST_NAME)
+
+        # The previous generation stays for readers that opened it before the switch; older ones go
+        keep = self._manifest_files(manifest) | self._manifest_files(previous)
+        for pattern in ("kernels*.jsonl.zst", "kernels*.idx"):
+            for path in self.output_dir.glob(pattern):
+                if path.name not in keep:
+                    path.unlink(missing_ok=True)
+
+        self.logger.info(f"Dataset exported: {manifest['records']} kernels in {len(writer.shards)} shards "
+                         f"({self.skipped_duplicates} duplicates skipped), "
+                         f"{raw_bytes} -> {sum(s['bytes'] for s in writer.shards)} bytes")
+        return manifest
+
+
+class DatasetReader:
+    # Looks kernels up by name through the memory-mapped index; only the frame holding the record is read
+    # and decompressed. Safe to share between threads.
+
+    def __init__(self, dataset_dir: str):
+        _require_zstd()
+        self.dataset_dir = Path(dataset_dir)
+        with open(self.dataset_dir / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+
+        with open(self.dataset_dir / self.manifest['index'], 'rb') as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = INDEX_HEADER.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"Not a kernel dataset index: {self.dataset_dir / self.manifest['index']}")
+        self._shards: Dict[int, mmap.mmap] = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for shard in self._shards.values():
+            shard.close()
+        self._shards.clear()
+        self._index.close()
+
+    def _entry(self, i: int) -> Tuple[int, int, int, int, int, int]:
+        return INDEX_ENTRY.unpack_from(self._index, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+
+    def _lower_bound(self, key: int) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _shard(self, shard: int) -> mmap.mmap:
+        mapped = self._shards.get(shard)
+        if mapped is None:
+            with open(self.dataset_dir / self.manifest['shards'][shard]['file'], 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            mapped = self._shards.setdefault(shard, mapped)
+        return mapped
+
+    def _read(self, entry: Tuple[int, int, int, int, int, int]) -> Dict:
+        _, shard, frame_offset, frame_size, record_offset, record_size = entry
+        frame = zstandard.ZstdDecompressor().decompress(self._shard(shard)[frame_offset:frame_offset + frame_size])
+        return json.loads(frame[record_offset:record_offset + record_size])
+
+    def get(self, name: str) -> Optional[Dict]:
+        key = name_key(name)
+        i = self._lower_bound(key)
+        # Equal hashes sit next to each other; the record's own name settles a collision
+        while i < self.count:
+            entry = self._entry(i)
+            if entry[0] != key:
+                break
+            record = self._read(entry)
+            if record['name'] == name:
+                return record
+            i += 1
+        return None
+
+    def __iter__(self) -> Iterator[Dict]:
+        for shard in self.manifest['shards']:
+            with open(self.dataset_dir / shard['file'], 'rb') as f:
+                reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                for line in io.TextIOWrapper(reader, encoding='utf-8'):
+                    yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export extracted kernels as compressed JSONL shards with an offset index')
+    parser.add_argument('--results-dir', default=EXTRACTION_RESULTS_DIR, help='Extraction results directory (result store)')
+    parser.add_argument('--output-dir', default=DATASET_DIR, help='Dataset output directory')
+    parser.add_argument('--shard-max-mb', type=int, default=DATASET_SHARD_MAX_BYTES // (1024 * 1024),
+                        help='Compressed size at which a new shard is started')
+    parser.add_argument('--level', type=int, default=DATASET_ZSTD_LEVEL, help='zstd compression level')
+    parser.add_argument('--no-header-cleanup', action='store_true', help='Export kernels without the step 4 header rewrite')
+    parser.add_argument('--kernels-dir', default=EXTRACTED_KERNELS_DIR,
+                        help='Step 3 output directory whose manifest marks pruned duplicate kernels')
+    parser.add_argument('--include-duplicates', action='store_true',
+                        help='Also export duplicate sources and kernels pruned by dedup_index.py')
+    parser.add_argument('--get', metavar='NAME', help='Print one kernel of an existing dataset instead of exporting')
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    logger = logging.getLogger(__name__)
+
+    if args.get:
+        with DatasetReader(args.output_dir) as reader:
+            record = reader.get(args.get)
+        if record is None:
+            logger.error(f"✗ No kernel named {args.get} in {args.output_dir}")
+        else:
+            print(json.dumps(record, indent=2, ensure_ascii=False))
+        return
+
+    try:
+        exporter = DatasetExporter(
+            args.results_dir, args.output_dir, shard_max_bytes=args.shard_max_mb * 1024 * 1024, level=args.level,
+            content_filter=None if args.no_header_cleanup else clean_header_content,
+            kernels_dir=args.kernels_dir, include_duplicates=args.include_duplicates
+        )
+        with MetricsRecorder(METRICS_PATH).stage_timer("dataset_export"):
+            manifest = exporter.export()
+        logger.info(f"✓ Dataset export completed: {manifest['records']} kernels, "
+                    f"{len(manifest['shards'])} shards in {args.output_dir}")
+    except Exception as e:
+        logger.error(f"✗ Dataset export failed: {e}", exc_info=True)
+        raise
+
+
+if __name__ == "__main__":
+    main()
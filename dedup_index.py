@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import argparse
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config_project import EXTRACTED_KERNELS_DIR, DEDUP_THRESHOLD
+from kernel_index import KernelIndex
+
+
+COMMENT_OR_LITERAL_RE = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+TOKEN_RE = re.compile(r'[A-Za-z_]\w*|\d[\w.]*|\S')
+MAX_HASH = (1 << 64) - 1
+DENSIFY_OFFSET = 1 << 58
+
+
+def code_tokens(code: str, name: Optional[str] = None) -> List[str]:
+    # Comments and whitespace do not count; the kernel's own name is a placeholder so renamed copies match
+    code = COMMENT_OR_LITERAL_RE.sub(lambda m: ' ' if m.group(0)[0] == '/' else m.group(0), code)
+    tokens = TOKEN_RE.findall(code)
+    if name:
+        tokens = ['$NAME' if token == name else token for token in tokens]
+    return tokens
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def minhash_signature(tokens: List[str], num_perm: int = 64, shingle_size: int = 5) -> Tuple[int, ...]:
+    # One-permutation hashing: one hash per shingle, the low bits pick the bin and each bin keeps its minimum
+    shingle_count = max(1, len(tokens) - shingle_size + 1)
+    signature = [MAX_HASH] * num_perm
+    for i in range(shingle_count):
+        h = _hash64(' '.join(tokens[i:i + shingle_size]))
+        bin_index, value = h % num_perm, h // num_perm
+        if value < signature[bin_index]:
+            signature[bin_index] = value
+
+    # Empty bins borrow from the next filled bin (rotation densification) so short inputs stay comparable
+    if shingle_count < num_perm:
+        original = list(signature)
+        for i in range(num_perm):
+            if original[i] == MAX_HASH:
+                distance = 1
+                while original[(i + distance) % num_perm] == MAX_HASH:
+                    distance += 1
+                signature[i] = original[(i + distance) % num_perm] + distance * DENSIFY_OFFSET
+    return tuple(signature)
+
+
+def signature_similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class DedupIndex:
+    # Exact duplicates are found by a hash of the normalized token stream, near duplicates by
+    # MinHash signatures bucketed with LSH bands. Only canonical entries are indexed, so the first
+    # item added to a group becomes its canonical copy.
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = 64, bands: int = 8,
+                 shingle_size: int = 5):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self._lock = threading.Lock()
+        self._exact: Dict[str, str] = {}
+        self._signatures: Dict[str, Tuple[int, ...]] = {}
+        self._buckets: List[Dict[Tuple[int, ...], List[str]]] = [defaultdict(list) for _ in range(bands)]
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [signature[b * self.rows:(b + 1) * self.rows] for b in range(self.bands)]
+
+    def add(self, key: str, code: str, name: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        tokens = code_tokens(code, name)
+        fingerprint = hashlib.sha256(' '.join(tokens).encode('utf-8')).hexdigest()
+
+        with self._lock:
+            canonical = self._exact.get(fingerprint)
+            if canonical is not None:
+                return canonical, 1.0
+            if self.threshold >= 1.0:
+                self._exact[fingerprint] = key
+                return None
+
+        signature = minhash_signature(tokens, self.num_perm, self.shingle_size)
+        band_keys = self._band_keys(signature)
+
+        with self._lock:
+            canonical = self._exact.get(fingerprint)
+            if canonical is not None:
+                return canonical, 1.0
+
+            best, best_similarity = None, 0.0
+            seen = set()
+            for band, band_key in enumerate(band_keys):
+                for candidate in self._buckets[band].get(band_key, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    similarity = signature_similarity(signature, self._signatures[candidate])
+                    if similarity > best_similarity:
+                        best, best_similarity = candidate, similarity
+            if best is not None and best_similarity >= self.threshold:
+                return best, best_similarity
+
+            self._exact[fingerprint] = key
+            self._signatures[key] = signature
+            for band, band_key in enumerate(band_keys):
+                self._buckets[band][band_key].append(key)
+            return None
+
+
+def group_kernels(kernels_dir: str, threshold: float = DEDUP_THRESHOLD) -> Dict[str, List[Dict]]:
+    kernels_dir = Path(kernels_dir)
+    index = KernelIndex(kernels_dir / "kernel_manifest.json")
+
+    # Kernels that own their plain name come first so they become the canonical copies
+    entries = sorted(
+        (
+            (kernel.get('renamed', False), len(filename), filename, source_file, kernel)
+            for source_file, source in index.sources.items()
+            for filename, kernel in source['kernels'].items()
+            if not kernel.get('duplicate_of')
+        ),
+        key=lambda e: e[:3]
+    )
+
+    dedup = DedupIndex(threshold)
+    groups = {}
+    for _, _, filename, source_file, kernel in entries:
+        output_path = kernels_dir / filename
+        if not output_path.exists():
+            continue
+        code = output_path.read_text(encoding='utf-8')
+        member = {'file': filename, 'source_file': source_file, 'func_name': kernel['func_name']}
+        match = dedup.add(filename, code, kernel['func_name'])
+        if match is None:
+            groups[filename] = [dict(member, similarity=1.0)]
+        else:
+            canonical, similarity = match
+            groups[canonical].append(dict(member, similarity=round(similarity, 3)))
+    return groups
+
+
+def prune_duplicates(kernels_dir: str, groups: Dict[str, List[Dict]]) -> int:
+    kernels_dir = Path(kernels_dir)
+    index = KernelIndex(kernels_dir / "kernel_manifest.json")
+    pruned = 0
+    for canonical, members in groups.items():
+        for member in members[1:]:
+            index.mark_duplicate(member['source_file'], member['file'], canonical)
+            (kernels_dir / member['file']).unlink(missing_ok=True)
+            pruned += 1
+    index.save()
+    return pruned
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Group exact and near-duplicate extracted kernels')
+    parser.add_argument('directory', nargs='?', default=EXTRACTED_KERNELS_DIR, help='Extracted kernels directory')
+    parser.add_argument('--threshold', type=float, default=DEDUP_THRESHOLD, help='Estimated Jaccard similarity for near duplicates')
+    parser.add_argument('--prune', action='store_true', help='Delete non-canonical copies and mark them in the manifest')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+
+    groups = group_kernels(args.directory, args.threshold)
+    duplicates = {canonical: members for canonical, members in groups.items() if len(members) > 1}
+
+    groups_path = os.path.join(args.directory, "kernel_groups.json")
+    with open(groups_path, 'w', encoding='utf-8') as f:
+        json.dump(duplicates, f, indent=2, ensure_ascii=False)
+
+    copies = sum(len(members) - 1 for members in duplicates.values())
+    logger.info(f"✓ {len(groups)} distinct kernels, {len(duplicates)} groups with {copies} duplicate copies")
+    logger.info(f"  - Groups saved to: {groups_path}")
+
+    if args.prune:
+        pruned = prune_duplicates(args.directory, duplicates)
+        logger.info(f"✓ Pruned {pruned} duplicate kernel files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import os
+import json
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from config_project import (
+    FILE_INVENTORY_PATH, EXTRACTION_RESULTS_DIR, MAX_CONCURRENT_REQUESTS, LLM_PROVIDER, PROMPT_TEMPLATE_VERSION,
+    WORK_QUEUE_PATH, WORKER_DIR, WORK_BATCH_SIZE, WORK_BATCHES_IN_FLIGHT, WORK_HEARTBEAT_SECONDS
+)
+from llm_router import resolve_llm_config
+from step1_cu_file_collector import FileCollector
+from step2_kernel_llm_extractor import LLMExtractor
+from telemetry import MetricsRecorder
+from work_queue import WorkQueue
+
+
+class DistributedWorker:
+    # One step 2 worker process. Any number of them, on one host or several, drain the same work queue and
+    # write to the same result store; a worker exits once no entry is pending or leased to anyone.
+
+    def __init__(self, llm_config: Dict, queue_path: str = WORK_QUEUE_PATH,
+                 results_dir: str = EXTRACTION_RESULTS_DIR, worker_id: Optional[str] = None,
+                 batch_size: int = WORK_BATCH_SIZE, batches_in_flight: int = WORK_BATCHES_IN_FLIGHT,
+                 max_concurrency: int = MAX_CONCURRENT_REQUESTS):
+        self.logger = logging.getLogger(__name__)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.results_dir = results_dir
+        self.batch_size = batch_size
+        self.batches_in_flight = batches_in_flight
+        self.max_concurrency = max_concurrency
+
+        os.makedirs(results_dir, exist_ok=True)
+        os.makedirs(WORKER_DIR, exist_ok=True)
+        self.queue = WorkQueue(queue_path)
+        self.extractor = LLMExtractor(
+            llm_config,
+            metrics=MetricsRecorder(os.path.join(WORKER_DIR, f"{self.worker_id}.metrics.jsonl")),
+            ledger_path=os.path.join(WORKER_DIR, f"{self.worker_id}.ledger.jsonl"),
+            # Every worker would walk the whole shared cache to size it; the next step 2 run trims it instead
+            cache_eviction=False
+        )
+
+        self.stats = Counter()
+        self._leases = set()
+        self._leases_lock = threading.Lock()
+
+    def load_inventory(self, inventory_path: str) -> None:
+        # Keyed by the inventory file's size and mtime, so only the first worker after a new step 1 run reads it
+        stat = os.stat(inventory_path)
+        inventory_key = f"{stat.st_size}:{stat.st_mtime_ns}"
+        extraction_key = f"{self.extractor.model_id}|{PROMPT_TEMPLATE_VERSION}"
+        if self.queue.inventory_loaded(inventory_key, extraction_key):
+            return
+        inventory = FileCollector.load_inventory(inventory_path)
+        loaded = self.queue.load_inventory(inventory.get('entries', []), inventory_key, extraction_key)
+        if loaded is not None:
+            self.logger.info(f"✓ Loaded inventory into the work queue: {loaded['added']} new, "
+                             f"{loaded['changed']} changed, {loaded['dropped']} dropped")
+
+    def _heartbeat(self, stop: threading.Event) -> None:
+        while not stop.wait(WORK_HEARTBEAT_SECONDS):
+            with self._leases_lock:
+                leases = list(self._leases)
+            try:
+                self.queue.heartbeat(leases)
+            except Exception as e:
+                # A missed beat is harmless while the lease still has time left
+                self.logger.warning(f"Heartbeat failed: {e}")
+
+    def _pending_hashes(self, entries: List[Dict]) -> Dict[str, str]:
+        # Ledger and result store lookups block, so the whole claimed batch is checked in one worker thread
+        return {
+            entry['path']: entry['sha256'] for entry in entries
+            if self.extractor.needs_extraction(entry['path'], entry['sha256'], output_dir=self.results_dir)
+        }
+
+    async def _run_batch(self, lease_id: str, entries: List[Dict], semaphore: asyncio.Semaphore) -> None:
+        # Entries arrive largest first; files whose current result is already in the store (a worker crashed after
+        # storing it) are not extracted again
+        hashes = await asyncio.to_thread(self._pending_hashes, entries)
+        done = [entry['path'] for entry in entries if entry['path'] not in hashes]
+        self.stats['up_to_date'] += len(done)
+        failed = {}
+
+        async def run_one(work_item: List[str]):
+            async with semaphore:
+                return await self.extractor.aprocess_work_item(work_item, hashes, self.results_dir)
+
+        sized_paths = [(entry['path'], entry['size']) for entry in entries if entry['path'] in hashes]
+        for item_results in await asyncio.gather(*[
+            run_one(work_item) for work_item in self.extractor.iter_work_items(sized_paths)
+        ]):
+            for file_path, result in item_results:
+                if result is None:
+                    failed[file_path] = "extraction failed"
+                    self.stats['failed'] += 1
+                else:
+                    done.append(file_path)
+                    self.stats['extracted'] += 1
+                    self.stats['kernels'] += len(result.get('kernels', []))
+
+        lost = await asyncio.to_thread(self.queue.complete, lease_id, done, failed)
+        with self._leases_lock:
+            self._leases.discard(lease_id)
+        if lost:
+            self.logger.warning(f"Lease {lease_id} expired before {lost} entries were completed; "
+                                f"another worker may have extracted them again")
+            self.stats['lost'] += lost
+
+    async def run(self) -> Dict:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop,), daemon=True)
+        heartbeat.start()
+        running = set()
+        try:
+            while True:
+                while len(running) < self.batches_in_flight:
+                    lease_id, entries = await asyncio.to_thread(self.queue.claim, self.worker_id, self.batch_size)
+                    if not entries:
+                        break
+                    with self._leases_lock:
+                        self._leases.add(lease_id)
+                    self.stats['claimed'] += len(entries)
+                    running.add(asyncio.create_task(self._run_batch(lease_id, entries, semaphore)))
+
+                if running:
+                    finished, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in finished:
+                        task.result()
+                    continue
+                # Nothing left to claim: wait while other workers hold leases, since a crashed one's entries
+                # come back once its lease expires
+                counts = await asyncio.to_thread(self.queue.counts)
+                if not counts[WorkQueue.STATE_LEASED] and not counts[WorkQueue.STATE_PENDING]:
+                    break
+                await asyncio.sleep(WORK_HEARTBEAT_SECONDS)
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            stop.set()
+            with self._leases_lock:
+                released = self.queue.release(self._leases)
+                self._leases.clear()
+            if released:
+                self.logger.info(f"Released {released} unfinished entries back to the queue")
+
+        return dict(self.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run one step 2 worker against the shared work queue')
+    parser.add_argument('--provider', default=LLM_PROVIDER, help='Provider or route entry in config_llm.json')
+    parser.add_argument('--inventory', default=FILE_INVENTORY_PATH, help='Step 1 inventory to load into the queue')
+    parser.add_argument('--queue', default=WORK_QUEUE_PATH, help='Work queue database on the shared mount')
+    parser.add_argument('--worker-id', default=None, help='Stable worker name (default: host-pid)')
+    parser.add_argument('--batch-size', type=int, default=WORK_BATCH_SIZE, help='Inventory entries per claim')
+    parser.add_argument('--max-concurrency', type=int, default=MAX_CONCURRENT_REQUESTS, help='Max in-flight work items')
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    logger = logging.getLogger(__name__)
+    logger.info("=" * 60)
+    logger.info("Step 2 (distributed): claim and extract batches from the shared work queue")
+    logger.info("=" * 60)
+
+    try:
+        with open("config_llm.json", "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        worker = DistributedWorker(
+            resolve_llm_config(config, args.provider), queue_path=args.queue, worker_id=args.worker_id,
+            batch_size=args.batch_size, max_concurrency=args.max_concurrency
+        )
+        worker.load_inventory(args.inventory)
+
+        with worker.extractor.metrics.stage_timer("distributed_worker", worker=worker.worker_id):
+            stats = asyncio.run(worker.run())
+
+        counts = worker.queue.counts()
+        logger.info("=" * 60)
+        logger.info(f"✓ Worker {worker.worker_id} finished!")
+        logger.info(f"  - Claimed: {stats.get('claimed', 0)}, extracted: {stats.get('extracted', 0)}, "
+                    f"failed: {stats.get('failed', 0)} ({stats.get('up_to_date', 0)} already up to date)")
+        logger.info(f"  - Total extracted kernels: {stats.get('kernels', 0)}")
+        logger.info(f"  - Queue: {counts['done']} done, {counts['failed']} failed, {counts['pending']} pending")
+        logger.info(f"  - Results saved to: {worker.results_dir}")
+        worker.extractor.metrics.log_summary(logger)
+        logger.info("=" * 60)
+
+    except Exception as e:
+        logger.error(f"✗ Worker failed: {e}", exc_info=True)
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def file_content_hash(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ExtractionLedger:
+
+    STATUS_SUCCESS = "success"
+    STATUS_PARTIAL = "partial"
+    STATUS_FAILED = "failed"
+    # Tombstone for a source that was deleted; dropped on load and compaction
+    STATUS_REMOVED = "removed"
+
+    def __init__(self, ledger_path: str):
+        self.ledger_path = Path(ledger_path)
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict] = {}
+
+        self.ledger_path.parent.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        if not self.ledger_path.exists():
+            return
+
+        line_count = 0
+        with open(self.ledger_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash mid-write can leave a truncated last line
+                    self.logger.warning(f"Skip corrupt ledger line in {self.ledger_path}")
+                    continue
+                if entry.get('status') == self.STATUS_REMOVED:
+                    self.entries.pop(entry['source_path'], None)
+                else:
+                    self.entries[entry['source_path']] = entry
+                line_count += 1
+
+        self.logger.info(f"Loaded extraction ledger: {len(self.entries)} files ({line_count} records)")
+
+        if line_count > 2 * len(self.entries) + 1000:
+            self.compact()
+
+    def compact(self) -> None:
+        with self._lock:
+            tmp_path = self.ledger_path.with_suffix(".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.ledger_path)
+
+        self.logger.info(f"Compacted extraction ledger: {self.ledger_path}")
+
+    def get(self, source_path: str) -> Optional[Dict]:
+        return self.entries.get(source_path)
+
+    def is_done(self, source_path: str, content_hash: str, model: str, template_version: str) -> bool:
+        entry = self.entries.get(source_path)
+        if entry is None or entry.get('status') != self.STATUS_SUCCESS:
+            return False
+        if (entry.get('content_hash') != content_hash or entry.get('model') != model
+                or entry.get('template_version') != template_version):
+            return False
+        output_path = entry.get('output_path')
+        return not output_path or os.path.exists(output_path)
+
+    def record(self, source_path: str, content_hash: str, model: str, template_version: str,
+               status: str, output_path: Optional[str] = None, error: Optional[str] = None) -> None:
+        entry = {
+            'source_path': source_path,
+            'content_hash': content_hash,
+            'model': model,
+            'template_version': template_version,
+            'status': status,
+            'output_path': output_path,
+            'error': error,
+            'timestamp': time.time()
+        }
+
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.entries[source_path] = entry
+            with open(self.ledger_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+
+    def remove(self, source_path: str) -> None:
+        line = json.dumps({'source_path': source_path, 'status': self.STATUS_REMOVED, 'timestamp': time.time()}) + "\n"
+        with self._lock:
+            if self.entries.pop(source_path, None) is None:
+                return
+            with open(self.ledger_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+INCLUDE_LINE_TEMPLATE = r'^[ \t]*#[ \t]*include[ \t]*[<"](?:{alternatives})[>"][^\n]*(?:\n|\Z)'
+ANY_INCLUDE_RE = re.compile(r'^[ \t]*#[ \t]*include\b[^\n]*(?:\n|\Z)', re.MULTILINE)
+
+
+@dataclass
+class HeaderRule:
+    name: str
+    action: str
+    header: Optional[str] = None
+    replacement: Optional[str] = None
+    shim: Optional[str] = None
+    ignore_case: bool = True
+
+
+class HeaderRewriter:
+
+    ACTIONS = ("strip", "replace", "inject")
+
+    def __init__(self, rules: List[HeaderRule]):
+        self.rules = rules
+
+        for rule in rules:
+            if rule.action not in self.ACTIONS:
+                raise ValueError(f"Unknown header rule action '{rule.action}' in rule {rule.name}")
+            if rule.action == "replace" and not (rule.header and rule.replacement):
+                raise ValueError(f"Replace rule {rule.name} needs 'header' and 'replacement'")
+            if rule.action == "inject" and not rule.shim:
+                raise ValueError(f"Inject rule {rule.name} needs 'shim'")
+            if rule.action == "strip" and not rule.header:
+                raise ValueError(f"Strip rule {rule.name} needs 'header'")
+
+        # One alternation over all rules; the named group that matched identifies the rule
+        matching = [(i, rule) for i, rule in enumerate(rules) if rule.header]
+        self.pattern = None
+        if matching:
+            alternatives = "|".join(
+                f"(?P<r{i}>(?i:{rule.header}))" if rule.ignore_case else f"(?P<r{i}>{rule.header})"
+                for i, rule in matching
+            )
+            self.pattern = re.compile(INCLUDE_LINE_TEMPLATE.format(alternatives=alternatives), re.MULTILINE)
+        self.unconditional_shims = [rule for rule in rules if rule.action == "inject" and not rule.header]
+
+    @classmethod
+    def from_rule_sets(cls, rule_sets: Dict, names: List[str]) -> "HeaderRewriter":
+        rules = []
+        for name in names:
+            if name not in rule_sets:
+                raise ValueError(f"Unknown header rule set: {name}. Available: {', '.join(rule_sets)}")
+            rule_set = rule_sets[name]
+            for rule in rule_set["rules"]:
+                rules.append(HeaderRule(**dict({'ignore_case': rule_set.get("ignore_case", True)}, **rule)))
+        return cls(rules)
+
+    @classmethod
+    def from_file(cls, rules_path: str, names: Optional[List[str]] = None) -> "HeaderRewriter":
+        # names=None loads every rule set in the file
+        with open(rules_path, 'r', encoding='utf-8') as f:
+            rule_sets = json.load(f)["rule_sets"]
+        return cls.from_rule_sets(rule_sets, list(rule_sets) if names is None else names)
+
+    def strip_unmatched(self, content: str) -> str:
+        # Drops every include no rule matches and leaves the matched ones for rewrite
+        return ANY_INCLUDE_RE.sub(
+            lambda m: m.group(0) if self.pattern is not None and self.pattern.match(m.group(0)) else "", content
+        )
+
+    def _substitute(self, match: re.Match, applied: Counter, shims: List[str]) -> str:
+        rule = self.rules[int(match.lastgroup[1:])]
+        applied[rule.name] += 1
+        line_end = "\n" if match.group(0).endswith("\n") else ""
+
+        if rule.action == "replace":
+            replacement = rule.replacement
+            if not replacement.startswith(("<", '"')):
+                replacement = f"<{replacement}>"
+            return f"#include {replacement}{line_end}"
+        if rule.action == "inject":
+            shims.append(rule.shim)
+        return ""
+
+    def rewrite(self, content: str, strip_unmatched: bool = False) -> Tuple[str, Counter]:
+        applied = Counter()
+        shims = []
+        if strip_unmatched:
+            content = self.strip_unmatched(content)
+        if self.pattern is not None:
+            content = self.pattern.sub(lambda m: self._substitute(m, applied, shims), content)
+
+        for rule in self.unconditional_shims:
+            shims.append(rule.shim)
+            applied[rule.name] += 1
+
+        header = ""
+        for shim in dict.fromkeys(shims):
+            if f'#include "{shim}"' not in content:
+                header += f'#include "{shim}"\n'
+        return header + content, applied
+
+    def rewrite_file(self, source_path: str, target_path: Optional[str] = None,
+                     dry_run: bool = False) -> Tuple[str, Dict[str, int], Optional[str]]:
+        try:
+            with open(source_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            new_content, applied = self.rewrite(content)
+
+            changed = new_content != content
+            if not changed:
+                applied = Counter()
+            target_path = target_path or source_path
+            if not dry_run and (changed or target_path != source_path):
+                Path(target_path).parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(new_content)
+                os.replace(tmp_path, target_path)
+            return source_path, dict(applied), None
+        except Exception as e:
+            return source_path, {}, str(e)
+
+    def rewrite_files(self, tasks: List[Tuple[str, str]], dry_run: bool = False,
+                      workers: int = 1) -> Iterator[Tuple[str, Dict[str, int], Optional[str]]]:
+        if workers <= 1 or len(tasks) < 2:
+            for source_path, target_path in tasks:
+                yield self.rewrite_file(source_path, target_path, dry_run)
+            return
+
+        initargs = ([asdict(rule) for rule in self.rules],)
+        chunksize = max(1, min(256, len(tasks) // (workers * 4)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            yield from executor.map(_rewrite_task, ((s, t, dry_run) for s, t in tasks), chunksize=chunksize)
+
+
+_worker_rewriter: Optional[HeaderRewriter] = None
+
+
+def _init_worker(rules: List[Dict]) -> None:
+    # Each worker compiles the combined pattern once
+    global _worker_rewriter
+    _worker_rewriter = HeaderRewriter([HeaderRule(**rule) for rule in rules])
+
+
+def _rewrite_task(task: Tuple[str, str, bool]) -> Tuple[str, Dict[str, int], Optional[str]]:
+    source_path, target_path, dry_run = task
+    return _worker_rewriter.rewrite_file(source_path, target_path, dry_run)
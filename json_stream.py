@@ -0,0 +1,162 @@
+import re
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+
+HEX4_RE = re.compile(r'[0-9a-fA-F]{4}')
+JSON_ESCAPES = '"\\/bfnrtu'
+CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+def _next_significant(text: str, i: int) -> str:
+    while i < len(text) and text[i] in ' \t\r\n':
+        i += 1
+    return text[i] if i < len(text) else ''
+
+
+def repair_json(text: str) -> str:
+    # Fixes what models typically get wrong in code-carrying JSON: raw newlines and tabs, stray
+    # backslashes (line continuations) and unescaped quotes inside strings, trailing commas outside
+    out = []
+    in_string = False
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if in_string:
+            if ch == '\\':
+                nxt = text[i + 1] if i + 1 < n else ''
+                if nxt and nxt in JSON_ESCAPES and (nxt != 'u' or HEX4_RE.match(text, i + 2)):
+                    out.append(ch + nxt)
+                    i += 2
+                    continue
+                out.append('\\\\')
+            elif ch == '"':
+                if _next_significant(text, i + 1) in (',', '}', ']', ':', ''):
+                    in_string = False
+                    out.append(ch)
+                else:
+                    out.append('\\"')
+            elif ch < ' ':
+                out.append(CONTROL_ESCAPES.get(ch, f'\\u{ord(ch):04x}'))
+            else:
+                out.append(ch)
+        elif ch == ',' and _next_significant(text, i + 1) in ('}', ']'):
+            pass
+        else:
+            if ch == '"':
+                in_string = True
+            out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+def loads_lenient(text: str) -> Any:
+    try:
+        return json.loads(text, strict=False)
+    except ValueError:
+        return json.loads(repair_json(text), strict=False)
+
+
+class IncrementalKernelParser:
+    # Also used on whole responses to recover the complete objects of a broken or truncated array
+
+    def __init__(self, array_key: str = 'kernels', required_key: str = 'func_name'):
+        self.array_key_re = re.compile(rf'"{array_key}"\s*:\s*\[')
+        self.required_key = required_key
+        self.reset()
+
+    def reset(self) -> None:
+        self.buffer = ''
+        self.kernels: List[Dict] = []
+        self.array_closed = False
+        self._pos = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start = None
+
+    @property
+    def array_found(self) -> bool:
+        return self._pos is not None
+
+    @property
+    def text(self) -> str:
+        return self.buffer
+
+    def feed(self, chunk: str) -> List[Dict]:
+        self.buffer += chunk
+        if self.array_closed:
+            return []
+
+        if self._pos is None:
+            m = self.array_key_re.search(self.buffer)
+            if not m:
+                return []
+            self._pos = m.end()
+
+        completed = []
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if self._depth == 0 and ch == '{':
+                    self._obj_start = i
+                self._depth += 1
+            elif ch in '}]':
+                if self._depth == 0 and ch == ']':
+                    self.array_closed = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and ch == '}' and self._obj_start is not None:
+                    kernel = self._decode(buf[self._obj_start:i + 1])
+                    if kernel is not None:
+                        self.kernels.append(kernel)
+                        completed.append(kernel)
+                    self._obj_start = None
+            i += 1
+
+        self._pos = i
+        return completed
+
+    def _decode(self, text: str) -> Optional[Dict]:
+        try:
+            obj = loads_lenient(text)
+        except ValueError:
+            return None
+        return obj if isinstance(obj, dict) and obj.get(self.required_key) else None
+
+
+class KernelStream:
+    # Stream handler for one streamed extraction (feed/reset, as LLMGenerator.complete_stream expects). Every
+    # kernel object the parser completes is handed to on_kernel right away, once per (name, signature) across
+    # retries, hedged attempts and continuation rounds; reset only restarts the parser for the next attempt
+
+    def __init__(self, on_kernel: Optional[Callable[[Dict], None]] = None):
+        self.parser = IncrementalKernelParser()
+        self.kernels: List[Dict] = []
+        self.on_kernel = on_kernel
+        self._seen = set()
+
+    def reset(self) -> None:
+        self.parser.reset()
+
+    def feed(self, chunk: str) -> None:
+        for kernel in self.parser.feed(chunk):
+            key = (kernel.get('func_name'), kernel.get('func_signature'))
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            self.kernels.append(kernel)
+            if self.on_kernel is not None:
+                self.on_kernel(kernel)
@@ -0,0 +1,180 @@
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def unique_name(func_name: str, source_file: str, is_taken: Callable[[str], bool]) -> str:
+    # The first source keeps the plain kernel name; later ones get the source stem, then a counter
+    stem = Path(source_file).stem
+    name = func_name
+    if is_taken(name):
+        name = f"{stem}_{func_name}"
+    suffix = 2
+    while is_taken(name):
+        name = f"{stem}_{func_name}_{suffix}"
+        suffix += 1
+    return name
+
+
+class KernelIndex:
+    # Persistent state behind kernel_manifest.json: which source owns each kernel name and each output
+    # file, and which output files (with content hashes) every source produced
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = Path(manifest_path)
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.names: Dict[str, str] = {}
+        self.sources: Dict[str, Dict] = {}
+        self.files: Dict[str, str] = {}
+        # Set by every change to the persisted state; save() skips the rewrite while it is clear
+        self._dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        if not self.manifest_path.exists():
+            self._dirty = True
+            return
+
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except ValueError:
+            self.logger.warning(f"Corrupt kernel manifest, rebuilding: {self.manifest_path}")
+            self._dirty = True
+            return
+
+        if 'sources' not in manifest:
+            self.logger.info(f"Kernel manifest has no index yet, rebuilding: {self.manifest_path}")
+            self._dirty = True
+            return
+
+        self.names = manifest.get('kernel_names', {})
+        self.sources = manifest['sources']
+        self.files = {
+            output_filename: source_file
+            for source_file, entry in self.sources.items() for output_filename in entry['kernels']
+        }
+        self.logger.info(f"Loaded kernel index: {len(self.sources)} sources, {len(self.names)} kernel names")
+
+    def claim_output(self, func_name: str, source_file: str,
+                     to_filename: Callable[[str], str]) -> Tuple[str, bool]:
+        # Returns (output file name, renamed). The first source to save a kernel name keeps it across runs;
+        # a file name another source owns is never handed out again
+        with self._lock:
+            if func_name not in self.names:
+                self.names[func_name] = source_file
+                self._dirty = True
+            owner = self.names[func_name] == source_file
+
+            def is_taken(name: str) -> bool:
+                if name == func_name and not owner:
+                    return True
+                return self.files.get(to_filename(name), source_file) != source_file
+
+            output_filename = to_filename(unique_name(func_name, source_file, is_taken))
+            self.files[output_filename] = source_file
+        return output_filename, output_filename != to_filename(func_name)
+
+    def release_output(self, output_filename: str, source_file: str, func_name: Optional[str] = None) -> None:
+        # func_name is also freed unless a recorded kernel of the source still uses it
+        with self._lock:
+            if self.files.get(output_filename) == source_file:
+                del self.files[output_filename]
+            recorded = self.sources.get(source_file, {}).get('kernels', {}).values()
+            if func_name is not None and self.names.get(func_name) == source_file and \
+                    not any(kernel['func_name'] == func_name for kernel in recorded):
+                del self.names[func_name]
+                self._dirty = True
+
+    def get_source(self, source_file: str) -> Optional[Dict]:
+        return self.sources.get(source_file)
+
+    def result_unchanged(self, source_file: str, revision: int) -> bool:
+        # Revision of the result store row this source's outputs were written from
+        entry = self.sources.get(source_file)
+        return entry is not None and entry.get('result_revision') == revision
+
+    def update_source(self, source_file: str, kernels: Dict[str, Dict], total_kernels: int,
+                      revision: Optional[int] = None) -> List[str]:
+        with self._lock:
+            previous = self.sources.get(source_file, {})
+            stale = [name for name in previous.get('kernels', {}) if name not in kernels]
+            for output_filename in stale:
+                if self.files.get(output_filename) == source_file:
+                    del self.files[output_filename]
+            for output_filename in kernels:
+                self.files[output_filename] = source_file
+
+            entry = {'kernels': kernels, 'total_kernels': total_kernels}
+            if revision is not None:
+                entry['result_revision'] = revision
+            self.sources[source_file] = entry
+            self._dirty = True
+
+            # Names this source no longer produces become free for other sources
+            live_names = {kernel['func_name'] for kernel in kernels.values()}
+            for kernel in previous.get('kernels', {}).values():
+                func_name = kernel['func_name']
+                if func_name not in live_names and self.names.get(func_name) == source_file:
+                    del self.names[func_name]
+
+        return stale
+
+    def remove_source(self, source_file: str) -> List[str]:
+        # Returns the output files the source owned; its kernel names become free
+        with self._lock:
+            previous = self.sources.pop(source_file, None)
+            if previous is None:
+                return []
+            self._dirty = True
+            for output_filename, kernel in previous['kernels'].items():
+                if self.names.get(kernel['func_name']) == source_file:
+                    del self.names[kernel['func_name']]
+                if self.files.get(output_filename) == source_file:
+                    del self.files[output_filename]
+        return list(previous['kernels'])
+
+    def summary(self, output_dir: Path) -> Dict:
+        saved_files = []
+        renamed = duplicates = 0
+        for entry in self.sources.values():
+            for filename, kernel in entry['kernels'].items():
+                renamed += kernel.get('renamed', False)
+                if kernel.get('duplicate_of'):
+                    duplicates += 1
+                else:
+                    saved_files.append(str(output_dir / filename))
+        return {
+            'total_source_files': len(self.sources),
+            'total_kernels_extracted': sum(entry.get('total_kernels', 0) for entry in self.sources.values()),
+            'successfully_saved': len(saved_files),
+            'conflicts_detected': renamed,
+            'duplicates_pruned': duplicates,
+            'saved_files': sorted(saved_files)
+        }
+
+    def mark_duplicate(self, source_file: str, output_filename: str, canonical: str) -> None:
+        with self._lock:
+            self.sources[source_file]['kernels'][output_filename]['duplicate_of'] = canonical
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                self.logger.info(f"Kernel manifest unchanged: {self.manifest_path}")
+                return
+            manifest = self.summary(self.manifest_path.parent)
+            manifest['kernel_names'] = self.names
+            manifest['sources'] = self.sources
+
+            tmp_path = self.manifest_path.with_suffix(".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_path)
+            self._dirty = False
+
+        self.logger.info(f"Kernel manifest saved: {self.manifest_path}")
@@ -0,0 +1,92 @@
+import re
+import logging
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from local_kernel_extractor import CudaSourceAnalyzer, IDENTIFIER_RE
+
+
+NON_TYPE_KEYWORDS = {'return', 'case', 'else', 'do', 'sizeof', 'throw', 'goto', 'new', 'delete', 'define'}
+
+
+class KernelValidator:
+    # Cheap structural checks on extracted kernels against the source they came from
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    def _balance_issues(self, masked: str) -> List[str]:
+        issues = []
+        for open_ch, close_ch in (('{', '}'), ('(', ')')):
+            depth = 0
+            for ch in masked:
+                if ch == open_ch:
+                    depth += 1
+                elif ch == close_ch:
+                    depth -= 1
+                    if depth < 0:
+                        break
+            if depth != 0:
+                issues.append(f"unbalanced '{open_ch}{close_ch}'")
+        return issues
+
+    def _is_local_name(self, masked: str, name: str) -> bool:
+        # Parameters and locals may reuse the name of a source macro or helper
+        # "T* x" and "T *x" declare, "a * b" (spaced on both sides) or "s.a*b" multiply
+        pattern = rf'(?<![.>\w])([A-Za-z_][\w:]*)(?:\s*<[^<>;{{}}]*>)?(?:\s+|[*&]+\s*|\s+[*&]+){re.escape(name)}\s*[,;=)\[]'
+        return any(m.group(1) not in NON_TYPE_KEYWORDS for m in re.finditer(pattern, masked))
+
+    def kernel_issues(self, kernel: Dict, source: CudaSourceAnalyzer) -> List[str]:
+        func_name = kernel.get('func_name', '')
+        func_content = kernel.get('func_content', '')
+        if not func_name or not func_content:
+            return ["empty func_name or func_content"]
+
+        unit = CudaSourceAnalyzer(func_content)
+        issues = self._balance_issues(unit.masked)
+        if not any(item.name == func_name for item in unit.kernels):
+            issues.append(f"no __global__ definition of {func_name}")
+
+        if source.structural_issues:
+            return issues
+
+        if source.kernels and not any(item.name == func_name for item in source.kernels):
+            issues.append(f"source has no kernel named {func_name}")
+
+        defined = set(unit.functions) | set(unit.macros) | set(unit.declarations)
+        for ref in sorted(set(IDENTIFIER_RE.findall(unit.masked)) - defined):
+            if ref in source.macros:
+                kind = "macro"
+            elif any(not item.is_kernel for item in source.functions.get(ref, ())):
+                kind = "helper"
+            else:
+                continue
+            if not self._is_local_name(unit.masked, ref):
+                issues.append(f"uses {kind} {ref} without defining it")
+        return issues
+
+    def validate(self, result: Dict, source: CudaSourceAnalyzer) -> Tuple[List[str], Dict[str, List[str]]]:
+        broken = {}
+        for kernel in result.get('kernels', []):
+            issues = self.kernel_issues(kernel, source)
+            if issues:
+                broken.setdefault(kernel.get('func_name') or '(unnamed)', []).extend(issues)
+
+        # Kernel spans in the source are only trusted when its structure parsed cleanly
+        missing = []
+        if not source.structural_issues:
+            expected = Counter(item.name for item in source.kernels)
+            extracted = Counter(kernel.get('func_name') for kernel in result.get('kernels', []))
+            missing = sorted((expected - extracted).keys())
+        return missing, broken
+
+    def repair_units(self, source: CudaSourceAnalyzer, names: List[str]) -> Dict[str, str]:
+        # One self-contained slice per kernel, the same shape the prompt slicer sends
+        units = {}
+        if source.structural_issues:
+            return units
+        for kernel in source.kernels:
+            if kernel.name in names and kernel.name not in units:
+                deps = source.dependency_closure(kernel)
+                units[kernel.name] = source.render_unit(kernel, deps, include_user_headers=True)
+        return units
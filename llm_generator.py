@@ -1,17 +1,372 @@
-from typing import Dict, Optional
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Dict, List, Optional
+from tenacity import Retrying, AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 from llm_providers import get_provider
+from llm_providers.base_provider import LLMProviderError, LLMResponse
+from rate_governor import get_governor, endpoint_name
+from resilience import get_circuit_breaker, get_hedge_policy
+from response_cache import ResponseCache
+
+
+def _is_retryable(e: BaseException) -> bool:
+    return isinstance(e, LLMProviderError) and e.is_retryable
+
+
+class StreamRace:
+    # The attempts of one streamed request (primary and hedge). The first attempt to produce text streams
+    # straight into the handler and the others stay silent; if a silent attempt wins, the handler is reset and
+    # gets the winner's full text. Once settled, late deltas of the loser are ignored.
+
+    def __init__(self, stream_handler):
+        self.stream_handler = stream_handler
+        self._leader = None
+        self._settled = False
+        self._finished: List = []
+        self._lock = threading.Lock()
+
+    def sink(self) -> Callable[[str], None]:
+        def on_delta(text: str) -> None:
+            with self._lock:
+                if self._leader is None:
+                    self._leader = on_delta
+                if self._leader is on_delta and not self._settled:
+                    self.stream_handler.feed(text)
+        return on_delta
+
+    def finished(self, on_delta: Callable[[str], None], response: LLMResponse) -> LLMResponse:
+        with self._lock:
+            self._finished.append((response, on_delta))
+        return response
+
+    def settle(self, response: LLMResponse) -> None:
+        with self._lock:
+            self._settled = True
+            winner = next(on_delta for finished, on_delta in self._finished if finished is response)
+            if winner is not self._leader:
+                self.stream_handler.reset()
+                if response.text:
+                    self.stream_handler.feed(response.text)
 
 
 class LLMGenerator:
 
-    def __init__(self, config: Dict):
+    CHARS_PER_TOKEN = 4
+    # Answers cut off at max_tokens are not cached; a retry would only replay the same truncation
+    TRUNCATED_FINISH_REASONS = ("length", "max_tokens")
+
+    def __init__(self, config: Dict, cache: Optional[ResponseCache] = None):
         self.config = config
+        self.logger = logging.getLogger(__name__)
         self.provider = get_provider(config)
+        self.cache = cache
+        self.governor = get_governor(config)
+        self.breaker = get_circuit_breaker(endpoint_name(config), config)
+        self.hedging = get_hedge_policy(endpoint_name(config), config)
+        self._backoff = wait_random_exponential(min=1, max=60)
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        self._hedge_pool_lock = threading.Lock()
+
+    def _cache_key(self, system_message: str, cache_content: Optional[str],
+                   max_tokens: Optional[int] = None, response_schema: Optional[Dict] = None) -> Optional[str]:
+        # Keyed by the output budget the request actually ran with, not the endpoint's configured ceiling
+        if self.cache is None or cache_content is None:
+            return None
+        # The schema only reaches the API in a structured output mode; a prompt-only answer fits any of them
+        response_format = None
+        mode = self.config.get("structured_output")
+        if mode and response_schema is not None:
+            schema_hash = hashlib.sha256(json.dumps(response_schema, sort_keys=True).encode('utf-8')).hexdigest()
+            response_format = f"{mode}:{schema_hash}"
+        return self.cache.make_key(
+            self.config.get("model_id", ""),
+            self.config.get("temperature", 0.1),
+            max_tokens or self.config.get("max_tokens", 4096),
+            system_message,
+            cache_content,
+            response_format
+        )
+
+    def _estimate_tokens(self, prompt: str, system_message: str, max_tokens: Optional[int] = None) -> int:
+        # Azure and Anthropic both count max_tokens against the TPM budget up front
+        input_tokens = (len(prompt) + len(system_message)) // self.CHARS_PER_TOKEN
+        return input_tokens + (max_tokens or self.config.get("max_tokens", 4096))
+
+    def _wait(self, retry_state) -> float:
+        e = retry_state.outcome.exception()
+        if isinstance(e, LLMProviderError) and e.is_throttle:
+            # The governor already pauses every caller for Retry-After
+            return 0
+        return self._backoff(retry_state)
+
+    def _retry_kwargs(self) -> Dict:
+        return dict(
+            retry=retry_if_exception(_is_retryable),
+            stop=stop_after_attempt(self.config.get("max_retries", 3)),
+            wait=self._wait,
+            reraise=True
+        )
+
+    def _release(self, reserved: int, response: Optional[LLMResponse], error: Optional[BaseException]) -> None:
+        used = response.input_tokens + response.output_tokens if response and response.input_tokens else None
+        if isinstance(error, LLMProviderError) and error.is_throttle:
+            self.governor.on_throttle(error.retry_after)
+        self.governor.release(reserved, used, success=error is None)
+        # A cancelled hedge loser (or an interrupted call) says nothing about the endpoint
+        if error is None or isinstance(error, Exception):
+            self.breaker.record(error)
+        else:
+            self.breaker.release_probe()
+        if response is not None:
+            self.hedging.observe(response.latency)
+
+    def _governed_call(self, reserved: int, call: Callable[[], LLMResponse],
+                       started: Optional[threading.Event] = None) -> LLMResponse:
+        # started is set once the request leaves the governor queue (or fails before that)
+        try:
+            self.breaker.before_call()
+            try:
+                queue_wait = self.governor.acquire(reserved)
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+        finally:
+            if started is not None:
+                started.set()
+        response, error = None, None
+        started_at = time.perf_counter()
+        try:
+            response = call()
+            response.queue_wait = queue_wait
+            response.latency = time.perf_counter() - started_at
+            return response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._release(reserved, response, error)
+
+    async def _agoverned_call(self, reserved: int, call: Callable[[], Awaitable[LLMResponse]],
+                              started: Optional[asyncio.Event] = None) -> LLMResponse:
+        try:
+            self.breaker.before_call()
+            try:
+                queue_wait = await self.governor.aacquire(reserved)
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+        finally:
+            if started is not None:
+                started.set()
+        response, error = None, None
+        started_at = time.perf_counter()
+        try:
+            response = await call()
+            response.queue_wait = queue_wait
+            response.latency = time.perf_counter() - started_at
+            return response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._release(reserved, response, error)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._hedge_pool_lock:
+            if self._hedge_pool is None:
+                max_workers = 2 * self.config.get("rate_limits", {}).get("max_concurrency", 64)
+                self._hedge_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+            return self._hedge_pool
+
+    def _hedge_won(self, response: LLMResponse, by_hedge: bool) -> LLMResponse:
+        response.hedged = True
+        if by_hedge:
+            self.hedging.on_hedge_win()
+        return response
+
+    def _hedged_call(self, reserved: int, call: Callable[[], LLMResponse]) -> LLMResponse:
+        delay = self.hedging.delay()
+        if delay is None:
+            return self._governed_call(reserved, call)
+
+        pool = self._pool()
+        started = threading.Event()
+        primary = pool.submit(self._governed_call, reserved, call, started)
+        started.wait()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.hedging.try_hedge():
+            return primary.result()
+
+        self.logger.debug(f"Request slower than {delay:.1f}s, sending a hedge")
+        # A synchronous loser cannot be cancelled; it finishes in the pool and is ignored
+        hedge = pool.submit(self._governed_call, reserved, call)
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return self._hedge_won(future.result(), future is hedge)
+                error = future.exception()
+        raise error
+
+    async def _ahedged_call(self, reserved: int, call: Callable[[], Awaitable[LLMResponse]]) -> LLMResponse:
+        delay = self.hedging.delay()
+        if delay is None:
+            return await self._agoverned_call(reserved, call)
 
-    def generate(self, prompt: str, system_message: str) -> Optional[str]:
+        started = asyncio.Event()
+        primary = asyncio.create_task(self._agoverned_call(reserved, call, started))
+        pending, error = {primary}, None
         try:
-            return self.provider.generate(prompt, system_message=system_message)
+            await started.wait()
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self.hedging.try_hedge():
+                return await primary
+
+            self.logger.debug(f"Request slower than {delay:.1f}s, sending a hedge")
+            hedge = asyncio.create_task(self._agoverned_call(reserved, call))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return self._hedge_won(task.result(), task is hedge)
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _cached_response(self, cache_key: Optional[str], stream_handler=None) -> Optional[LLMResponse]:
+        if cache_key is None:
+            return None
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return None
+        if stream_handler is not None:
+            stream_handler.reset()
+            stream_handler.feed(cached)
+        return LLMResponse(text=cached, cached=True)
+
+    def _store_cached(self, cache_key: Optional[str], response: LLMResponse) -> None:
+        if response.text and cache_key is not None and response.finish_reason not in self.TRUNCATED_FINISH_REASONS:
+            self.cache.put(cache_key, response.text, self.config.get("model_id", ""))
+
+    def complete(self, prompt: str, system_message: str, cache_content: Optional[str] = None,
+                 response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        cache_key = self._cache_key(system_message, cache_content, max_tokens, response_schema)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return cached
+
+        for attempt in Retrying(**self._retry_kwargs()):
+            with attempt:
+                response = self._hedged_call(
+                    self._estimate_tokens(prompt, system_message, max_tokens),
+                    lambda: self.provider.complete(prompt, system_message, response_schema, max_tokens)
+                )
+
+        response.retries = attempt.retry_state.attempt_number - 1
+        self._store_cached(cache_key, response)
+        return response
+
+    async def acomplete(self, prompt: str, system_message: str, cache_content: Optional[str] = None,
+                        response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        cache_key = self._cache_key(system_message, cache_content, max_tokens, response_schema)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return cached
+
+        async for attempt in AsyncRetrying(**self._retry_kwargs()):
+            with attempt:
+                response = await self._ahedged_call(
+                    self._estimate_tokens(prompt, system_message, max_tokens),
+                    lambda: self.provider.acomplete(prompt, system_message, response_schema, max_tokens)
+                )
+
+        response.retries = attempt.retry_state.attempt_number - 1
+        self._store_cached(cache_key, response)
+        return response
+
+    def complete_stream(self, prompt: str, system_message: str, stream_handler,
+                        cache_content: Optional[str] = None, response_schema: Optional[Dict] = None,
+                        max_tokens: Optional[int] = None) -> LLMResponse:
+        # stream_handler needs feed(text) and reset(); reset runs before every attempt
+        cache_key = self._cache_key(system_message, cache_content, max_tokens, response_schema)
+        cached = self._cached_response(cache_key, stream_handler)
+        if cached is not None:
+            return cached
+
+        def call(race: StreamRace) -> LLMResponse:
+            on_delta = race.sink()
+            return race.finished(on_delta, self.provider.complete_stream(
+                prompt, system_message, on_delta, response_schema, max_tokens
+            ))
+
+        for attempt in Retrying(**self._retry_kwargs()):
+            with attempt:
+                stream_handler.reset()
+                race = StreamRace(stream_handler)
+                response = self._hedged_call(
+                    self._estimate_tokens(prompt, system_message, max_tokens), lambda: call(race)
+                )
+                race.settle(response)
+
+        response.retries = attempt.retry_state.attempt_number - 1
+        self._store_cached(cache_key, response)
+        return response
+
+    async def acomplete_stream(self, prompt: str, system_message: str, stream_handler,
+                               cache_content: Optional[str] = None, response_schema: Optional[Dict] = None,
+                               max_tokens: Optional[int] = None) -> LLMResponse:
+        cache_key = self._cache_key(system_message, cache_content, max_tokens, response_schema)
+        cached = self._cached_response(cache_key, stream_handler)
+        if cached is not None:
+            return cached
+
+        async def call(race: StreamRace) -> LLMResponse:
+            on_delta = race.sink()
+            return race.finished(on_delta, await self.provider.acomplete_stream(
+                prompt, system_message, on_delta, response_schema, max_tokens
+            ))
+
+        async for attempt in AsyncRetrying(**self._retry_kwargs()):
+            with attempt:
+                stream_handler.reset()
+                race = StreamRace(stream_handler)
+                response = await self._ahedged_call(
+                    self._estimate_tokens(prompt, system_message, max_tokens), lambda: call(race)
+                )
+                race.settle(response)
+
+        response.retries = attempt.retry_state.attempt_number - 1
+        self._store_cached(cache_key, response)
+        return response
+
+    def generate(self, prompt: str, system_message: str,
+                 cache_content: Optional[str] = None) -> Optional[str]:
+        try:
+            return self.complete(prompt, system_message, cache_content=cache_content).text or None
+        except Exception as e:
+            return None
+
+    async def agenerate(self, prompt: str, system_message: str,
+                        cache_content: Optional[str] = None) -> Optional[str]:
+        try:
+            return (await self.acomplete(prompt, system_message, cache_content=cache_content)).text or None
         except Exception as e:
             return None
 
- 
\ No newline at end of file
+    def endpoint_stats(self) -> List[Dict]:
+        return [dict(self.governor.stats(), circuit=self.breaker.stats(), hedging=self.hedging.stats())]
+
+    def discard_cached(self, system_message: str, cache_content: Optional[str],
+                       max_tokens: Optional[int] = None, response_schema: Optional[Dict] = None) -> None:
+        cache_key = self._cache_key(system_message, cache_content, max_tokens, response_schema)
+        if cache_key is not None:
+            self.cache.delete(cache_key)
@@ -1,6 +1,7 @@
 from typing import Dict
 from .base_provider import BaseLLMProvider
 from .openai_provider import OpenAIProvider
+from .mock_provider import MockProvider
 
 try:
     from .anthropic_provider import AnthropicProvider
@@ -21,8 +22,10 @@ def get_provider(provider_config: Dict) -> BaseLLMProvider:
         if not ANTHROPIC_AVAILABLE:
             raise ValueError("Anthropic provider is not available, please install anthropic library: pip install anthropic")
         return AnthropicProvider(provider_config)
+    elif provider_name == "mock":
+        return MockProvider(provider_config)
     else:
-        supported_providers = ["openai"]
+        supported_providers = ["openai", "mock"]
         if ANTHROPIC_AVAILABLE:
             supported_providers.append("anthropic")
         raise ValueError(f"Unsupported provider: {provider_name}. Supported providers: {', '.join(supported_providers)}")
@@ -1,7 +1,7 @@
+import json
 import time
-from typing import Dict, Optional
-from .base_provider import BaseLLMProvider
-from tenacity import retry, wait_random_exponential, stop_after_attempt
+from typing import Callable, Dict, Optional
+from .base_provider import BaseLLMProvider, LLMProviderError, LLMResponse, parse_retry_after
 
 try:
     import anthropic
@@ -17,32 +17,139 @@ class AnthropicProvider(BaseLLMProvider):
             raise ImportError("Anthropic provider requires anthropic library: pip install anthropic")
         
         super().__init__(config)
+        # Retries are driven by LLMGenerator so the rate governor sees every 429
         self.client = anthropic.Anthropic(
             api_key=self.config["api_key"],
-            timeout=self.config.get("timeout_seconds", 120)
+            timeout=self.config.get("timeout_seconds", 120),
+            max_retries=0
         )
+        self.async_client = anthropic.AsyncAnthropic(
+            api_key=self.config["api_key"],
+            timeout=self.config.get("timeout_seconds", 120),
+            max_retries=0
+        )
+
+    def _system_blocks(self, system_message: str):
+        if not self.config.get("prompt_caching", False):
+            return system_message
+        # Breakpoint after the static system prefix; tools (structured output) sit before it and are cached too
+        return [{"type": "text", "text": system_message, "cache_control": {"type": "ephemeral"}}]
+
+    def _request_kwargs(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                        max_tokens: Optional[int] = None) -> Dict:
+        kwargs = dict(
+            model=self.config["model_id"],
+            max_tokens=max_tokens or self.config.get("max_tokens", 4096),
+            temperature=self.config.get("temperature", 0.1),
+            system=self._system_blocks(system_message),
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        )
+
+        mode = self.config.get("structured_output")
+        if response_schema is not None and mode:
+            if mode != "tool":
+                raise ValueError(f"Unsupported structured_output mode for anthropic: {mode}")
+            kwargs["tools"] = [{
+                "name": self.STRUCTURED_OUTPUT_NAME,
+                "description": "Submit the extracted CUDA kernels",
+                "input_schema": response_schema
+            }]
+            kwargs["tool_choice"] = {"type": "tool", "name": self.STRUCTURED_OUTPUT_NAME}
+        return kwargs
 
-    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
-    def generate(self, prompt: str, system_message: str) -> Optional[str]:
+    def _response_text(self, content) -> Optional[str]:
+        for block in content or ():
+            if block.type == "tool_use":
+                return json.dumps(block.input, ensure_ascii=False)
+        texts = [block.text for block in content or () if block.type == "text"]
+        return ''.join(texts) if texts else None
+
+    def _to_response(self, response) -> LLMResponse:
+        usage = response.usage
+        # input_tokens excludes cache reads and writes; count the whole prompt like the other providers
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+        return LLMResponse(
+            text=self._response_text(response.content),
+            input_tokens=usage.input_tokens + cache_read + cache_write,
+            output_tokens=usage.output_tokens,
+            cached_input_tokens=cache_read,
+            finish_reason=response.stop_reason
+        )
+
+    def _to_error(self, e: Exception) -> LLMProviderError:
+        if isinstance(e, anthropic.APIStatusError):
+            # Anthropic reports overload as 529
+            status_code = 503 if e.status_code == 529 else e.status_code
+            return LLMProviderError(str(e), status_code=status_code,
+                                    retry_after=parse_retry_after(e.response.headers))
+        if isinstance(e, (anthropic.APITimeoutError, anthropic.APIConnectionError)):
+            return LLMProviderError(str(e))
+        return LLMProviderError(str(e), status_code=-1)
+
+    def complete(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                 max_tokens: Optional[int] = None) -> LLMResponse:
         try:
             response = self.client.messages.create(
-                model=self.config["model_id"],
-                max_tokens=self.config.get("max_tokens", 4096),
-                temperature=self.config.get("temperature", 0.1),
-                system=system_message,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
+                **self._request_kwargs(prompt, system_message, response_schema, max_tokens)
+            )
+        except Exception as e:
+            raise self._to_error(e) from e
+
+        return self._to_response(response)
+
+    async def acomplete(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                        max_tokens: Optional[int] = None) -> LLMResponse:
+        try:
+            response = await self.async_client.messages.create(
+                **self._request_kwargs(prompt, system_message, response_schema, max_tokens)
             )
-            
-            response_text = response.content[0].text
-            if not response_text:
-                return None
-            
-            return response_text
-            
-        except Exception:
-            return None 
\ No newline at end of file
+        except Exception as e:
+            raise self._to_error(e) from e
+
+        return self._to_response(response)
+
+    def _stream_delta(self, event) -> Optional[str]:
+        # Tool input arrives as partial JSON, plain answers as text
+        if event.type == "text":
+            return event.text
+        if event.type == "input_json":
+            return event.partial_json
+        return None
+
+    def complete_stream(self, prompt: str, system_message: str, on_delta: Callable[[str], None],
+                        response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        try:
+            with self.client.messages.stream(
+                **self._request_kwargs(prompt, system_message, response_schema, max_tokens)
+            ) as stream:
+                for event in stream:
+                    delta = self._stream_delta(event)
+                    if delta:
+                        on_delta(delta)
+                final_message = stream.get_final_message()
+        except Exception as e:
+            raise self._to_error(e) from e
+
+        return self._to_response(final_message)
+
+    async def acomplete_stream(self, prompt: str, system_message: str, on_delta: Callable[[str], None],
+                               response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        try:
+            async with self.async_client.messages.stream(
+                **self._request_kwargs(prompt, system_message, response_schema, max_tokens)
+            ) as stream:
+                async for event in stream:
+                    delta = self._stream_delta(event)
+                    if delta:
+                        on_delta(delta)
+                final_message = await stream.get_final_message()
+        except Exception as e:
+            raise self._to_error(e) from e
+
+        return self._to_response(final_message)
@@ -1,17 +1,122 @@
 import json
 import re
+import time
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Dict, Optional
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+
+
+@dataclass
+class LLMResponse:
+    text: Optional[str]
+    input_tokens: int = 0
+    output_tokens: int = 0
+    # Part of input_tokens served from the provider's prompt prefix cache
+    cached_input_tokens: int = 0
+    finish_reason: Optional[str] = None
+    cached: bool = False
+    queue_wait: float = 0.0
+    latency: float = 0.0
+    retries: int = 0
+    hedged: bool = False
+    endpoint: Optional[str] = None
+
+
+class LLMProviderError(Exception):
+
+    THROTTLE_STATUS_CODES = (429, 503)
+    RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def is_throttle(self) -> bool:
+        return self.status_code in self.THROTTLE_STATUS_CODES
+
+    @property
+    def is_retryable(self) -> bool:
+        # status_code is None for timeouts and connection errors
+        return self.status_code is None or self.status_code in self.RETRYABLE_STATUS_CODES
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
 
 class BaseLLMProvider(ABC):
+    # response_schema is the JSON schema of the expected answer; providers only enforce it through the
+    # API when config["structured_output"] selects a mode they support, otherwise the prompt alone does.
+    # max_tokens overrides config["max_tokens"] for one request.
+
+    STRUCTURED_OUTPUT_NAME = "submit_kernels"
+    # Rough token estimate for responses that report no usage
+    CHARS_PER_TOKEN = 4
 
     def __init__(self, config: Dict):
         self.config = config
 
     @abstractmethod
-    def generate(self, prompt: str, system_message: str) -> Optional[str]:
+    def complete(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                 max_tokens: Optional[int] = None) -> LLMResponse:
         pass
 
+    async def acomplete(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                        max_tokens: Optional[int] = None) -> LLMResponse:
+        # Providers without an async SDK client fall back to a worker thread
+        return await asyncio.to_thread(self.complete, prompt, system_message, response_schema, max_tokens)
+
+    def complete_stream(self, prompt: str, system_message: str, on_delta: Callable[[str], None],
+                        response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        # Providers without streaming deliver the whole response as a single delta
+        response = self.complete(prompt, system_message, response_schema, max_tokens)
+        if response.text:
+            on_delta(response.text)
+        return response
+
+    async def acomplete_stream(self, prompt: str, system_message: str, on_delta: Callable[[str], None],
+                               response_schema: Optional[Dict] = None,
+                               max_tokens: Optional[int] = None) -> LLMResponse:
+        response = await self.acomplete(prompt, system_message, response_schema, max_tokens)
+        if response.text:
+            on_delta(response.text)
+        return response
+
+    def generate(self, prompt: str, system_message: str) -> Optional[str]:
+        try:
+            return self.complete(prompt, system_message).text or None
+        except LLMProviderError:
+            return None
+
+    async def agenerate(self, prompt: str, system_message: str) -> Optional[str]:
+        try:
+            return (await self.acomplete(prompt, system_message)).text or None
+        except LLMProviderError:
+            return None
+
 
- 
\ No newline at end of file
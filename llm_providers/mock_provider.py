@@ -0,0 +1,199 @@
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from local_kernel_extractor import CudaSourceAnalyzer
+from .base_provider import BaseLLMProvider, LLMProviderError, LLMResponse
+
+
+CODE_BLOCK_RE = re.compile(r'(File path|File id):[ \t]*(.+?)[ \t]*\n\s*```cuda\n(.*?)\n```(?=\s*(?:\n|$))', re.DOTALL)
+EXTRACTED_NAME_RE = re.compile(r'^- ([A-Za-z_]\w*)$', re.MULTILINE)
+
+
+class MockProvider(BaseLLMProvider):
+    # Offline stand-in for a chat endpoint: answers are built locally from the prompt's CUDA code,
+    # latency and failures are drawn from the distributions in config["mock"]
+
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        self.settings = config.get("mock", {})
+        self.time_scale = self.settings.get("time_scale", 1.0)
+        self.random = random.Random(self.settings.get("seed"))
+        self._lock = threading.Lock()
+        self._request_times = deque()
+        self._cached_prefixes: Set[str] = set()
+
+    def _kernels(self, code: str, skip: Set[str]) -> List[Dict]:
+        analyzer = CudaSourceAnalyzer(code)
+        kernels = []
+        for kernel in analyzer.kernels:
+            if kernel.name in skip:
+                continue
+            if self.random.random() < self.settings.get("drop_kernel_rate", 0.0):
+                continue
+            deps = analyzer.dependency_closure(kernel)
+            if self.random.random() < self.settings.get("broken_kernel_rate", 0.0):
+                # Typical model slips: a helper left out, or the closing brace cut off
+                deps = deps[1:] if deps else deps
+                func_content = analyzer.render_unit(kernel, deps).rstrip().rstrip('}')
+            else:
+                func_content = analyzer.render_unit(kernel, deps)
+            kernels.append({
+                'func_name': kernel.name,
+                'func_signature': kernel.signature,
+                'func_content': func_content
+            })
+        return kernels
+
+    def _answer(self, prompt: str) -> str:
+        blocks = CODE_BLOCK_RE.findall(prompt)
+        if not blocks:
+            return "I could not find any CUDA code in the request."
+
+        # Continuation prompts list the kernels that were already returned before the code
+        skip = set(EXTRACTED_NAME_RE.findall(prompt.split("```cuda", 1)[0]))
+
+        if blocks[0][0] == "File id":
+            answer = {'results': [
+                {'source_file': file_id, 'kernels': self._kernels(code, skip)}
+                for _, file_id, code in blocks
+            ]}
+        else:
+            _, file_path, code = blocks[-1]
+            answer = {'source_file': file_path, 'kernels': self._kernels(code, skip)}
+        return json.dumps(answer, ensure_ascii=False, indent=2)
+
+    def _server_throttled(self) -> bool:
+        server_rpm = self.settings.get("server_requests_per_minute")
+        if not server_rpm:
+            return False
+
+        window = 60.0 * self.time_scale
+        with self._lock:
+            now = time.monotonic()
+            while self._request_times and now - self._request_times[0] > window:
+                self._request_times.popleft()
+            if len(self._request_times) >= server_rpm:
+                return True
+            self._request_times.append(now)
+            return False
+
+    def _cached_prefix_tokens(self, system_message: str) -> int:
+        # The system message stands in for the cacheable prefix: free after its first request
+        if not self.config.get("prompt_caching", False):
+            return 0
+        with self._lock:
+            if system_message in self._cached_prefixes:
+                return len(system_message) // self.CHARS_PER_TOKEN
+            self._cached_prefixes.add(system_message)
+            return 0
+
+    def _malform(self, text: str) -> str:
+        # Chatty preamble plus trailing commas, the usual ways a free-form answer misses strict JSON
+        text = re.sub(r'\}(\s*)\]', r'},\1]', text, count=1)
+        return "Here are the extracted kernels:\n" + text + "\nLet me know if you need anything else."
+
+    def _plan(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+              max_tokens: Optional[int] = None) -> Tuple[float, float, Optional[LLMResponse], Optional[LLMProviderError]]:
+        s = self.settings
+        # With an enforced schema the answer is always bare, well-formed JSON (truncation still happens)
+        structured = response_schema is not None and self.config.get("structured_output")
+        median = s.get("latency_median_seconds", 1.5)
+        first_token = self.random.lognormvariate(math.log(median), s.get("latency_sigma", 0.5)) * self.time_scale
+
+        if self._server_throttled() or self.random.random() < s.get("throttle_rate", 0.0):
+            retry_after = s.get("retry_after_seconds", 1.0) * self.time_scale
+            return 0.05 * self.time_scale, 0.0, None, LLMProviderError(
+                "Mock rate limit exceeded", status_code=429, retry_after=retry_after
+            )
+
+        draw = self.random.random()
+        if draw < s.get("timeout_rate", 0.0):
+            return s.get("timeout_delay_seconds", 10.0) * self.time_scale, 0.0, None, \
+                LLMProviderError("Mock request timed out")
+        if draw < s.get("timeout_rate", 0.0) + s.get("server_error_rate", 0.0):
+            return first_token, 0.0, None, LLMProviderError("Mock internal server error", status_code=500)
+
+        input_tokens = (len(prompt) + len(system_message)) // self.CHARS_PER_TOKEN
+        cached_input_tokens = self._cached_prefix_tokens(system_message)
+        if s.get("input_tokens_per_second"):
+            first_token += (input_tokens - cached_input_tokens) / s["input_tokens_per_second"] * self.time_scale
+
+        text = self._answer(prompt)
+        finish_reason = "stop"
+
+        max_chars = (max_tokens or self.config.get("max_tokens", 4096)) * self.CHARS_PER_TOKEN
+        if len(text) > max_chars:
+            text, finish_reason = text[:max_chars], "length"
+        elif self.random.random() < s.get("truncate_rate", 0.0):
+            text, finish_reason = text[:int(len(text) * self.random.uniform(0.3, 0.9))], "length"
+
+        if finish_reason == "stop" and not structured:
+            if self.random.random() < s.get("malformed_rate", 0.0):
+                text = self._malform(text)
+            elif self.random.random() < s.get("fence_rate", 0.0):
+                text = f"```json\n{text}\n```"
+
+        output_tokens = max(1, len(text) // self.CHARS_PER_TOKEN)
+        generation = output_tokens / s.get("output_tokens_per_second", 80.0) * self.time_scale
+        response = LLMResponse(
+            text=text,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cached_input_tokens=cached_input_tokens,
+            finish_reason=finish_reason
+        )
+        return first_token, generation, response, None
+
+    def _chunks(self, text: str) -> List[str]:
+        size = self.settings.get("stream_chunk_chars", 64)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def complete(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                 max_tokens: Optional[int] = None) -> LLMResponse:
+        first_token, generation, response, error = self._plan(prompt, system_message, response_schema, max_tokens)
+        time.sleep(first_token + generation)
+        if error is not None:
+            raise error
+        return response
+
+    async def acomplete(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                        max_tokens: Optional[int] = None) -> LLMResponse:
+        first_token, generation, response, error = self._plan(prompt, system_message, response_schema, max_tokens)
+        await asyncio.sleep(first_token + generation)
+        if error is not None:
+            raise error
+        return response
+
+    def complete_stream(self, prompt: str, system_message: str, on_delta: Callable[[str], None],
+                        response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        first_token, generation, response, error = self._plan(prompt, system_message, response_schema, max_tokens)
+        time.sleep(first_token)
+        if error is not None:
+            raise error
+
+        chunks = self._chunks(response.text)
+        for chunk in chunks:
+            time.sleep(generation / len(chunks))
+            on_delta(chunk)
+        return response
+
+    async def acomplete_stream(self, prompt: str, system_message: str, on_delta: Callable[[str], None],
+                               response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        first_token, generation, response, error = self._plan(prompt, system_message, response_schema, max_tokens)
+        await asyncio.sleep(first_token)
+        if error is not None:
+            raise error
+
+        chunks = self._chunks(response.text)
+        for chunk in chunks:
+            await asyncio.sleep(generation / len(chunks))
+            on_delta(chunk)
+        return response
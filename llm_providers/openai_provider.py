@@ -1,8 +1,9 @@
 import time
-from typing import Dict, Optional
-from openai import AzureOpenAI
-from tenacity import retry, stop_after_attempt, wait_random_exponential
-from .base_provider import BaseLLMProvider
+import logging
+from typing import Callable, Dict, List, Optional
+import openai
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from .base_provider import BaseLLMProvider, LLMProviderError, LLMResponse, parse_retry_after
 
 
 class OpenAIProvider(BaseLLMProvider):
@@ -16,50 +17,217 @@ class OpenAIProvider(BaseLLMProvider):
             'Ocp-Apim-Subscription-Key': self.config["api_key"] 
         }
 
+        # Retries are driven by LLMGenerator so the rate governor sees every 429
         self.client = AzureOpenAI(
             api_key='dummy',   
             api_version=api_version,
             base_url=base_url,
             default_headers=headers,
-            timeout=self.config.get("timeout_seconds", 120)
+            timeout=self.config.get("timeout_seconds", 120),
+            max_retries=0
         )
         
         self.client.base_url = f'{base_url}/openai/deployments/{self.config["model_id"]}'
 
-    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
-    def generate(self, prompt: str, system_message: str) -> Optional[str]:
-        try:
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_message
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
+        self.async_client = AsyncAzureOpenAI(
+            api_key='dummy',
+            api_version=api_version,
+            base_url=base_url,
+            default_headers=headers,
+            timeout=self.config.get("timeout_seconds", 120),
+            max_retries=0
+        )
+
+        self.async_client.base_url = f'{base_url}/openai/deployments/{self.config["model_id"]}'
+
+        self.logger = logging.getLogger(__name__)
+        # Cleared for the rest of the run once the API version turns stream_options down
+        self.stream_include_usage = self.config.get("stream_include_usage", True)
+
+    def _structured_kwargs(self, response_schema: Optional[Dict]) -> Dict:
+        mode = self.config.get("structured_output")
+        if response_schema is None or not mode:
+            return {}
+        if mode == "json_object":
+            return dict(response_format={"type": "json_object"})
+        if mode == "json_schema":
+            # Needs api_version 2024-08-01-preview or later on Azure
+            return dict(response_format={
+                "type": "json_schema",
+                "json_schema": {"name": self.STRUCTURED_OUTPUT_NAME, "schema": response_schema, "strict": True}
+            })
+        if mode == "tool":
+            return dict(
+                tools=[{
+                    "type": "function",
+                    "function": {
+                        "name": self.STRUCTURED_OUTPUT_NAME,
+                        "description": "Submit the extracted CUDA kernels",
+                        "parameters": response_schema
+                    }
+                }],
+                tool_choice={"type": "function", "function": {"name": self.STRUCTURED_OUTPUT_NAME}}
+            )
+        raise ValueError(f"Unsupported structured_output mode for openai: {mode}")
+
+    def _request_kwargs(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                        max_tokens: Optional[int] = None) -> Dict:
+        messages = [
+            {
+                "role": "system",
+                "content": system_message
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+
+        return dict(
+            model=self.config["model_id"],
+            messages=messages,
+            temperature=self.config.get("temperature", 0.1),
+            max_tokens=max_tokens or self.config.get("max_tokens", 4096),
+            n=1,
+            stream=False,
+            stop=None,
+            presence_penalty=0,
+            frequency_penalty=0,
+            logit_bias=None,
+            user=None,
+            **self._structured_kwargs(response_schema)
+        )
+
+    def _cached_tokens(self, usage) -> int:
+        # Prompts over 1024 tokens are prefix-cached automatically; the hit shows up in the usage details
+        details = getattr(usage, "prompt_tokens_details", None)
+        return (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+    def _to_response(self, response) -> LLMResponse:
+        usage = response.usage
+        message = response.choices[0].message
+        # Tool mode answers with the call's JSON arguments instead of message content
+        text = message.tool_calls[0].function.arguments if message.tool_calls else message.content
+        return LLMResponse(
+            text=text,
+            input_tokens=usage.prompt_tokens if usage else 0,
+            output_tokens=usage.completion_tokens if usage else 0,
+            cached_input_tokens=self._cached_tokens(usage) if usage else 0,
+            finish_reason=response.choices[0].finish_reason
+        )
+
+    def _to_error(self, e: Exception) -> LLMProviderError:
+        if isinstance(e, openai.APIStatusError):
+            return LLMProviderError(str(e), status_code=e.status_code,
+                                    retry_after=parse_retry_after(e.response.headers))
+        if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError)):
+            return LLMProviderError(str(e))
+        return LLMProviderError(str(e), status_code=-1)
 
+    def complete(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                 max_tokens: Optional[int] = None) -> LLMResponse:
+        try:
             response = self.client.chat.completions.create(
-                model=self.config["model_id"],
-                messages=messages,
-                temperature=self.config.get("temperature", 0.1),
-                max_tokens=self.config.get("max_tokens", 4096),
-                n=1,
-                stream=False,
-                stop=None,
-                presence_penalty=0,
-                frequency_penalty=0,
-                logit_bias=None,
-                user=None
+                **self._request_kwargs(prompt, system_message, response_schema, max_tokens)
+            )
+        except Exception as e:
+            raise self._to_error(e) from e
+
+        return self._to_response(response)
+
+    async def acomplete(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                        max_tokens: Optional[int] = None) -> LLMResponse:
+        try:
+            response = await self.async_client.chat.completions.create(
+                **self._request_kwargs(prompt, system_message, response_schema, max_tokens)
             )
-            
-            response_text = response.choices[0].message.content
-            if not response_text:
-                return None
-
-            # print(f"response_text=======>{response_text}")
-            return response_text
-            
-        except Exception:
-            return None 
\ No newline at end of file
+        except Exception as e:
+            raise self._to_error(e) from e
+
+        return self._to_response(response)
+
+    def _stream_kwargs(self, prompt: str, system_message: str, response_schema: Optional[Dict] = None,
+                       max_tokens: Optional[int] = None) -> Dict:
+        kwargs = self._request_kwargs(prompt, system_message, response_schema, max_tokens)
+        kwargs["stream"] = True
+        if self.stream_include_usage:
+            kwargs["stream_options"] = {"include_usage": True}
+        return kwargs
+
+    def _usage_rejected(self, e: Exception) -> bool:
+        # Older Azure API versions answer stream_options with a 400
+        if self.stream_include_usage and isinstance(e, openai.BadRequestError) and "stream_options" in str(e):
+            self.stream_include_usage = False
+            self.logger.warning(f"API version {self.config.get('api_version')} rejects stream_options, "
+                                f"streamed token usage is estimated from the text")
+            return True
+        return False
+
+    def _stream_response(self, prompt: str, system_message: str, parts: List[str], state: Dict) -> LLMResponse:
+        text = ''.join(parts)
+        if "input_tokens" not in state:
+            # No usage chunk: the governor and telemetry still need a token count
+            state["input_tokens"] = (len(prompt) + len(system_message)) // self.CHARS_PER_TOKEN
+            state["output_tokens"] = len(text) // self.CHARS_PER_TOKEN
+        return LLMResponse(text=text, **state)
+
+    def _consume_chunk(self, chunk, parts: List[str], state: Dict, on_delta: Callable[[str], None]) -> None:
+        if chunk.usage:
+            state["input_tokens"] = chunk.usage.prompt_tokens
+            state["output_tokens"] = chunk.usage.completion_tokens
+            state["cached_input_tokens"] = self._cached_tokens(chunk.usage)
+        if not chunk.choices:
+            return
+        choice = chunk.choices[0]
+        if choice.delta and choice.delta.content:
+            parts.append(choice.delta.content)
+            on_delta(choice.delta.content)
+        elif choice.delta and choice.delta.tool_calls:
+            arguments = choice.delta.tool_calls[0].function.arguments if choice.delta.tool_calls[0].function else None
+            if arguments:
+                parts.append(arguments)
+                on_delta(arguments)
+        if choice.finish_reason:
+            state["finish_reason"] = choice.finish_reason
+
+    def complete_stream(self, prompt: str, system_message: str, on_delta: Callable[[str], None],
+                        response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        parts, state = [], {}
+        try:
+            try:
+                stream = self.client.chat.completions.create(
+                    **self._stream_kwargs(prompt, system_message, response_schema, max_tokens)
+                )
+            except openai.BadRequestError as e:
+                if not self._usage_rejected(e):
+                    raise
+                stream = self.client.chat.completions.create(
+                    **self._stream_kwargs(prompt, system_message, response_schema, max_tokens)
+                )
+            for chunk in stream:
+                self._consume_chunk(chunk, parts, state, on_delta)
+        except Exception as e:
+            raise self._to_error(e) from e
+
+        return self._stream_response(prompt, system_message, parts, state)
+
+    async def acomplete_stream(self, prompt: str, system_message: str, on_delta: Callable[[str], None],
+                               response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        parts, state = [], {}
+        try:
+            try:
+                stream = await self.async_client.chat.completions.create(
+                    **self._stream_kwargs(prompt, system_message, response_schema, max_tokens)
+                )
+            except openai.BadRequestError as e:
+                if not self._usage_rejected(e):
+                    raise
+                stream = await self.async_client.chat.completions.create(
+                    **self._stream_kwargs(prompt, system_message, response_schema, max_tokens)
+                )
+            async for chunk in stream:
+                self._consume_chunk(chunk, parts, state, on_delta)
+        except Exception as e:
+            raise self._to_error(e) from e
+
+        return self._stream_response(prompt, system_message, parts, state)
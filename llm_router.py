@@ -0,0 +1,201 @@
+import random
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+from llm_generator import LLMGenerator
+from llm_providers.base_provider import LLMProviderError, LLMResponse
+from resilience import CircuitOpenError
+from response_cache import ResponseCache
+
+
+def _resolve_entry(config: Dict, name: str) -> Dict:
+    if name in config.get("providers", {}):
+        return dict(config["providers"][name])
+    if name not in config.get("routes", {}):
+        raise KeyError(f"No provider or route named {name} in LLM config")
+
+    route = config["routes"][name]
+    endpoints = []
+    for entry in route["endpoints"]:
+        # Entry keys other than provider/weight override the provider config, e.g. another deployment
+        endpoint = dict(config["providers"][entry["provider"]])
+        endpoint.pop("large_context", None)
+        endpoint.update({k: v for k, v in entry.items() if k not in ("provider", "weight", "name")})
+        endpoint["route_name"] = entry.get("name", f"{entry['provider']}:{endpoint.get('model_id', '')}")
+        endpoint["route_weight"] = entry.get("weight", 1.0)
+        if "retries_per_endpoint" in route:
+            endpoint["max_retries"] = route["retries_per_endpoint"]
+        endpoints.append(endpoint)
+
+    return dict(
+        {k: v for k, v in route.items() if k != "endpoints"},
+        provider="router",
+        model_id="+".join(sorted({endpoint.get("model_id", "") for endpoint in endpoints})),
+        max_tokens=min(endpoint.get("max_tokens", 4096) for endpoint in endpoints),
+        endpoints=endpoints
+    )
+
+
+def resolve_llm_config(config: Dict, name: str) -> Dict:
+    # name is either a provider entry or a route over several of them in config_llm.json
+    resolved = _resolve_entry(config, name)
+    large_context = resolved.get("large_context")
+    if large_context:
+        # {"provider": ..., "threshold_tokens": N, ...overrides} names the provider or route that takes
+        # requests estimated above N tokens
+        target = _resolve_entry(config, large_context["provider"])
+        target.pop("large_context", None)
+        target.update({k: v for k, v in large_context.items() if k != "provider"})
+        resolved["large_context"] = target
+    return resolved
+
+
+class Route:
+
+    def __init__(self, name: str, weight: float, generator: LLMGenerator):
+        self.name = name
+        self.weight = weight
+        self.generator = generator
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.routed = 0
+        self.failed_over = 0
+
+
+class LLMRouter:
+    # Spreads requests over several endpoints, each with its own rate governor, circuit breaker and
+    # hedging. An endpoint's share is its weight scaled by free quota, recent error rate and latency;
+    # a request that fails on one endpoint with a retryable error moves on to the next.
+
+    EWMA_ALPHA = 0.1
+    # Saturated endpoints keep a small share so their latency and error estimates stay current
+    MIN_AVAILABILITY = 0.05
+
+    def __init__(self, config: Dict, cache: Optional[ResponseCache] = None):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self.random = random.Random(config.get("seed"))
+        self._lock = threading.Lock()
+        self.routes = [
+            Route(endpoint["route_name"], float(endpoint["route_weight"]), LLMGenerator(endpoint, cache=cache))
+            for endpoint in config["endpoints"]
+        ]
+        if not self.routes:
+            raise ValueError("Route has no endpoints")
+        self.logger.info(f"LLM router over {len(self.routes)} endpoints: "
+                         f"{', '.join(f'{r.name} (weight {r.weight:g})' for r in self.routes)}")
+
+    def _score(self, route: Route, fastest: Optional[float]) -> float:
+        if not route.generator.breaker.allows_requests():
+            return 0.0
+        availability = max(self.MIN_AVAILABILITY, route.generator.governor.availability())
+        speed = fastest / route.latency if fastest and route.latency else 1.0
+        return route.weight * availability * (1.0 - route.error_rate) * speed
+
+    def _pick(self, tried: List[Route]) -> Route:
+        with self._lock:
+            candidates = [route for route in self.routes if route not in tried]
+            latencies = [route.latency for route in candidates if route.latency]
+            fastest = min(latencies) if latencies else None
+            scores = [self._score(route, fastest) for route in candidates]
+            if not any(scores):
+                # Every remaining endpoint is open or failing; fall back to the configured weights
+                scores = [route.weight for route in candidates]
+            route = self.random.choices(candidates, weights=scores)[0]
+            route.routed += 1
+            return route
+
+    def _observe(self, route: Route, response: Optional[LLMResponse] = None, failed: bool = False) -> None:
+        with self._lock:
+            route.error_rate += self.EWMA_ALPHA * (float(failed) - route.error_rate)
+            if response is not None and not response.cached:
+                route.latency = response.latency if route.latency is None else \
+                    route.latency + self.EWMA_ALPHA * (response.latency - route.latency)
+
+    def _should_fail_over(self, e: LLMProviderError, route: Route, tried: List[Route]) -> bool:
+        if len(tried) >= len(self.routes) or not (e.is_retryable or isinstance(e, CircuitOpenError)):
+            return False
+        with self._lock:
+            route.failed_over += 1
+        self.logger.warning(f"✗ {route.name} failed (status: {e.status_code}), failing over: {e}")
+        return True
+
+    def _route(self, call: Callable[[LLMGenerator], LLMResponse]) -> LLMResponse:
+        tried = []
+        while True:
+            route = self._pick(tried)
+            tried.append(route)
+            try:
+                response = call(route.generator)
+            except LLMProviderError as e:
+                self._observe(route, failed=True)
+                if self._should_fail_over(e, route, tried):
+                    continue
+                raise
+            self._observe(route, response)
+            response.endpoint = route.name
+            return response
+
+    async def _aroute(self, call: Callable[[LLMGenerator], Awaitable[LLMResponse]]) -> LLMResponse:
+        tried = []
+        while True:
+            route = self._pick(tried)
+            tried.append(route)
+            try:
+                response = await call(route.generator)
+            except LLMProviderError as e:
+                self._observe(route, failed=True)
+                if self._should_fail_over(e, route, tried):
+                    continue
+                raise
+            self._observe(route, response)
+            response.endpoint = route.name
+            return response
+
+    def complete(self, prompt: str, system_message: str, cache_content: Optional[str] = None,
+                 response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        return self._route(lambda generator: generator.complete(
+            prompt, system_message, cache_content=cache_content, response_schema=response_schema,
+            max_tokens=max_tokens))
+
+    async def acomplete(self, prompt: str, system_message: str, cache_content: Optional[str] = None,
+                        response_schema: Optional[Dict] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        return await self._aroute(lambda generator: generator.acomplete(
+            prompt, system_message, cache_content=cache_content, response_schema=response_schema,
+            max_tokens=max_tokens))
+
+    def complete_stream(self, prompt: str, system_message: str, stream_handler,
+                        cache_content: Optional[str] = None, response_schema: Optional[Dict] = None,
+                        max_tokens: Optional[int] = None) -> LLMResponse:
+        # Each endpoint resets the handler before its own attempts, so a failed-over stream starts clean
+        return self._route(lambda generator: generator.complete_stream(
+            prompt, system_message, stream_handler, cache_content=cache_content, response_schema=response_schema,
+            max_tokens=max_tokens))
+
+    async def acomplete_stream(self, prompt: str, system_message: str, stream_handler,
+                               cache_content: Optional[str] = None, response_schema: Optional[Dict] = None,
+                               max_tokens: Optional[int] = None) -> LLMResponse:
+        return await self._aroute(lambda generator: generator.acomplete_stream(
+            prompt, system_message, stream_handler, cache_content=cache_content, response_schema=response_schema,
+            max_tokens=max_tokens))
+
+    def discard_cached(self, system_message: str, cache_content: Optional[str],
+                       max_tokens: Optional[int] = None, response_schema: Optional[Dict] = None) -> None:
+        for route in self.routes:
+            route.generator.discard_cached(system_message, cache_content, max_tokens, response_schema)
+
+    def endpoint_stats(self) -> List[Dict]:
+        stats = []
+        for route in self.routes:
+            for endpoint in route.generator.endpoint_stats():
+                stats.append(dict(endpoint, route=route.name, weight=route.weight, routed=route.routed,
+                                  failed_over=route.failed_over, error_rate=round(route.error_rate, 3),
+                                  latency=round(route.latency, 3) if route.latency else None))
+        return stats
+
+
+def create_generator(llm_config: Dict, cache: Optional[ResponseCache] = None) -> Union[LLMGenerator, LLMRouter]:
+    if llm_config.get("endpoints"):
+        return LLMRouter(llm_config, cache=cache)
+    return LLMGenerator(llm_config, cache=cache)
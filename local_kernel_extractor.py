@@ -0,0 +1,401 @@
+import re
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+
+IDENTIFIER_RE = re.compile(r'\b[A-Za-z_]\w*\b')
+DIRECTIVE_RE = re.compile(r'^[ \t]*#[ \t]*(\w+)', re.MULTILINE)
+DEFINE_RE = re.compile(r'#[ \t]*define[ \t]+([A-Za-z_]\w*)')
+INCLUDE_RE = re.compile(r'#[ \t]*include[ \t]*([<"])([^>"]+)[>"]')
+TRAILING_QUALIFIERS_RE = re.compile(r'\)\s*(?:const|volatile|noexcept|override|final|&|&&|\s)*(?:->[^;{}()]*)?$')
+DECL_KEYWORD_RE = re.compile(r'^\s*(?:template\s*<[^{};]*>\s*)?(?:typedef\b|using\b|struct\b|class\b|union\b|enum\b)')
+TYPE_NAME_RE = re.compile(r'\b(?:struct|class|union|enum(?:\s+class)?)\s+(?:__align__\s*\([^)]*\)\s*)?([A-Za-z_]\w*)')
+ATTRIBUTE_CALL_RE = re.compile(r'\b(?:__launch_bounds__|__attribute__|__align__|alignas|__declspec)\s*\([^()]*(?:\([^()]*\)[^()]*)*\)')
+TEMPLATE_PREFIX_RE = re.compile(r'^\s*template\s*<[^{};]*?>(?=\s*(?:__|[A-Za-z_]))')
+TRANSPARENT_SCOPE_RE = re.compile(r'(?:\bnamespace(?:\s+[A-Za-z_][\w:]*)?|\bextern\s*"\s*")\s*$')
+
+
+def mask_source(source: str) -> str:
+    # Same length as source: comments and literal contents become spaces, newlines survive
+    out = list(source)
+    i, n = 0, len(source)
+    while i < n:
+        c = source[i]
+        if c == '/' and i + 1 < n and source[i + 1] == '/':
+            j = source.find('\n', i)
+            j = n if j == -1 else j
+            for k in range(i, j):
+                out[k] = ' '
+            i = j
+        elif c == '/' and i + 1 < n and source[i + 1] == '*':
+            j = source.find('*/', i + 2)
+            j = n if j == -1 else j + 2
+            for k in range(i, j):
+                if source[k] != '\n':
+                    out[k] = ' '
+            i = j
+        elif c == '"' or c == "'":
+            j = i + 1
+            while j < n and source[j] != c and source[j] != '\n':
+                if source[j] == '\\':
+                    out[j] = ' '
+                    j += 1
+                    if j < n and source[j] != '\n':
+                        out[j] = ' '
+                    j += 1
+                    continue
+                out[j] = ' '
+                j += 1
+            i = j + 1
+        else:
+            i += 1
+    return ''.join(out)
+
+
+def _logical_line_end(text: str, start: int) -> int:
+    end = text.find('\n', start)
+    while end != -1 and text[end - 1] == '\\':
+        end = text.find('\n', end + 1)
+    return len(text) if end == -1 else end
+
+
+def _match_close(text: str, open_pos: int, open_ch: str, close_ch: str) -> int:
+    depth = 0
+    for i in range(open_pos, len(text)):
+        ch = text[i]
+        if ch == open_ch:
+            depth += 1
+        elif ch == close_ch:
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def _normalize_ws(text: str) -> str:
+    return ' '.join(text.split())
+
+
+class SourceItem:
+
+    def __init__(self, kind: str, name: str, start: int, end: int, text: str, references: Set[str]):
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.end = end
+        self.text = text
+        self.references = references
+        self.signature = ''
+        self.is_kernel = False
+        self.is_prototype = False
+
+
+class CudaSourceAnalyzer:
+
+    def __init__(self, source: str):
+        self.source = source.replace('\r\n', '\n')
+        self.masked = mask_source(self.source)
+        self.issues: List[str] = []
+        # Issues that make kernel spans themselves unreliable, not just the rendered units
+        self.structural_issues: List[str] = []
+
+        self.includes: List[Tuple[str, str, str]] = []
+        self.macros: Dict[str, List[SourceItem]] = {}
+        self.functions: Dict[str, List[SourceItem]] = {}
+        self.declarations: Dict[str, List[SourceItem]] = {}
+        self.kernels: List[SourceItem] = []
+        self.conditional_regions: List[Tuple[int, int]] = []
+        self.global_declarations = 0
+
+        self._parse_preprocessor()
+        self._parse_top_level()
+
+    def _structural_issue(self, message: str) -> None:
+        self.issues.append(message)
+        self.structural_issues.append(message)
+
+    def _parse_preprocessor(self) -> None:
+        text = self.masked
+        structural = list(text)
+        stack = []
+
+        for m in DIRECTIVE_RE.finditer(text):
+            start = m.start()
+            end = _logical_line_end(text, start)
+            directive = m.group(1)
+            line = self.source[start:end]
+
+            if directive == 'include':
+                inc = INCLUDE_RE.search(line)
+                if inc:
+                    self.includes.append(('system' if inc.group(1) == '<' else 'user', inc.group(2), line.strip()))
+            elif directive == 'define':
+                d = DEFINE_RE.search(text[start:end])
+                if d:
+                    name = d.group(1)
+                    body = text[start + d.end():end]
+                    refs = set(IDENTIFIER_RE.findall(body)) - {name}
+                    item = SourceItem('macro', name, start, end, line, refs)
+                    if '##' in body or re.search(r'#\s*[A-Za-z_]', body):
+                        item.kind = 'macro_metaprogramming'
+                    if '__global__' in body or '__device__' in body:
+                        self.issues.append(f"macro {name} defines CUDA functions")
+                    self.macros.setdefault(name, []).append(item)
+            elif directive in ('if', 'ifdef', 'ifndef'):
+                stack.append((start, directive, line))
+            elif directive == 'endif':
+                if not stack:
+                    self._structural_issue("unbalanced #endif")
+                else:
+                    open_start, open_directive, open_line = stack.pop()
+                    self.conditional_regions.append((open_start, end))
+            elif directive in ('elif', 'else') and not stack:
+                self._structural_issue(f"#{directive} outside conditional")
+
+            for k in range(start, end):
+                if structural[k] != '\n':
+                    structural[k] = ' '
+
+        if stack:
+            self._structural_issue("unbalanced #if/#endif")
+
+        self._drop_include_guard()
+        self.structural = ''.join(structural)
+
+    def _drop_include_guard(self) -> None:
+        stripped = self.masked.strip()
+        guard = re.match(r'#[ \t]*ifndef[ \t]+(\w+)\s*\n\s*#[ \t]*define[ \t]+(\w+)', stripped)
+        if not guard or guard.group(1) != guard.group(2):
+            return
+        outer = [r for r in self.conditional_regions
+                 if self.masked[:r[0]].strip() == '' and self.masked[r[1]:].strip() == '']
+        for region in outer:
+            self.conditional_regions.remove(region)
+
+    def _parse_top_level(self) -> None:
+        text = self.structural
+        n = len(text)
+        transparent_depth = 0
+        stmt_start = 0
+        i = 0
+
+        while i < n:
+            ch = text[i]
+            if ch == ';':
+                self._add_statement(stmt_start, i + 1)
+                stmt_start = i + 1
+            elif ch == '}':
+                if transparent_depth > 0:
+                    transparent_depth -= 1
+                else:
+                    self._structural_issue("unbalanced braces")
+                stmt_start = i + 1
+            elif ch == '{':
+                header = text[stmt_start:i]
+                if TRANSPARENT_SCOPE_RE.search(header):
+                    transparent_depth += 1
+                    stmt_start = i + 1
+                else:
+                    close = _match_close(text, i, '{', '}')
+                    if close == -1:
+                        self._structural_issue("unbalanced braces")
+                        return
+                    if self._is_function_header(header):
+                        self._add_function(stmt_start, i, close + 1)
+                        stmt_start = close + 1
+                    else:
+                        # struct/class/enum/initializer: the statement runs on to its ';'
+                        semi = text.find(';', close)
+                        end = n if semi == -1 else semi + 1
+                        self._add_statement(stmt_start, end)
+                        stmt_start = end
+                    i = stmt_start
+                    continue
+            i += 1
+
+        if transparent_depth != 0:
+            self._structural_issue("unbalanced namespace braces")
+        if text.count('(') != text.count(')'):
+            self._structural_issue("unbalanced parentheses")
+
+        global_total = len(re.findall(r'\b__global__\b', self.masked))
+        if global_total != len(self.kernels) + self.global_declarations:
+            self._structural_issue("__global__ appears outside plain definitions (macro generated kernels?)")
+
+    def _is_function_header(self, header: str) -> bool:
+        header = ATTRIBUTE_CALL_RE.sub(' ', TEMPLATE_PREFIX_RE.sub('', header))
+        if '(' not in header or '=' in header.split('(')[0]:
+            return False
+        if DECL_KEYWORD_RE.match(header):
+            return False
+        return bool(TRAILING_QUALIFIERS_RE.search(header.rstrip()))
+
+    def _param_list_open(self, header: str) -> int:
+        stripped = header.rstrip()
+        m = TRAILING_QUALIFIERS_RE.search(stripped)
+        close = m.start() if m else stripped.rfind(')')
+        depth = 0
+        for k in range(close, -1, -1):
+            if header[k] == ')':
+                depth += 1
+            elif header[k] == '(':
+                depth -= 1
+                if depth == 0:
+                    return k
+        return -1
+
+    def _add_function(self, start: int, brace: int, end: int) -> None:
+        header = self.structural[start:brace]
+        offset = len(header) - len(header.lstrip())
+        start += offset
+        header = header.lstrip()
+
+        open_paren = self._param_list_open(header)
+        if open_paren == -1:
+            self._structural_issue(f"cannot parse function header at offset {start}")
+            return
+
+        name_match = re.search(r'([A-Za-z_~][\w:]*)\s*(<[^()]*>)?\s*$', header[:open_paren])
+        if not name_match:
+            self._structural_issue(f"cannot find function name at offset {start}")
+            return
+        name = name_match.group(1).split('::')[-1]
+
+        prefix = ATTRIBUTE_CALL_RE.sub('', TEMPLATE_PREFIX_RE.sub('', header[:name_match.start()]))
+        if '(' in prefix:
+            self.issues.append(f"unexpanded macro call before function {name}")
+
+        refs = set(IDENTIFIER_RE.findall(self.masked[start:end])) - {name}
+        item = SourceItem('function', name, start, end, self.source[start:end], refs)
+        item.signature = _normalize_ws(self.source[start:brace])
+        item.is_kernel = bool(re.search(r'\b__global__\b', header))
+
+        self.functions.setdefault(name, []).append(item)
+        if item.is_kernel:
+            if name_match.group(2):
+                self.issues.append(f"kernel {name} is an explicit specialization")
+            self.kernels.append(item)
+
+    def _add_statement(self, start: int, end: int) -> None:
+        stmt = self.structural[start:end]
+        if not stmt.strip():
+            return
+        offset = len(stmt) - len(stmt.lstrip())
+        start += offset
+        stmt = stmt.strip()
+
+        if re.search(r'\b__global__\b', stmt):
+            # Prototypes and explicit template instantiations of kernels
+            self.global_declarations += 1
+            return
+
+        refs = set(IDENTIFIER_RE.findall(stmt))
+        names = set(TYPE_NAME_RE.findall(stmt))
+        enum_body = re.match(r'enum\b[^{]*\{([^}]*)\}', stmt)
+        if enum_body:
+            names.update(re.findall(r'([A-Za-z_]\w*)\s*(?:=[^,]*)?(?:,|$)', enum_body.group(1).strip()))
+        if stmt.startswith('using'):
+            m = re.match(r'using\s+(?:namespace\s+)?([A-Za-z_][\w:]*)', stmt)
+            if m:
+                names.add(m.group(1).split('::')[-1])
+        elif stmt.startswith('typedef') or not names:
+            head = re.sub(r'\{.*\}', ' ', stmt, flags=re.DOTALL)
+            if '(' in head and not head.startswith('typedef') and '=' not in head.split('(')[0]:
+                # Function prototype without a body in this file
+                m = re.search(r'([A-Za-z_]\w*)\s*\(', head)
+                if m:
+                    proto = SourceItem('prototype', m.group(1), start, end, self.source[start:end], refs)
+                    proto.is_prototype = True
+                    self.declarations.setdefault(proto.name, []).append(proto)
+                return
+            m = re.search(r'([A-Za-z_]\w*)\s*(?:\[[^\]]*\]\s*)*(?:=[^;]*)?;$', head)
+            if m:
+                names.add(m.group(1))
+
+        for name in names:
+            item = SourceItem('declaration', name, start, end, self.source[start:end], refs - {name})
+            self.declarations.setdefault(name, []).append(item)
+
+    def dependency_closure(self, kernel: SourceItem) -> List[SourceItem]:
+        seen: Dict[int, SourceItem] = {}
+        pending = [kernel]
+        while pending:
+            item = pending.pop()
+            for ref in item.references:
+                for table in (self.functions, self.macros, self.declarations):
+                    for dep in table.get(ref, ()):
+                        if dep is kernel or id(dep) in seen or self._contains(kernel, dep):
+                            continue
+                        seen[id(dep)] = dep
+                        pending.append(dep)
+        return sorted(seen.values(), key=lambda d: d.start)
+
+    def _contains(self, outer: SourceItem, inner: SourceItem) -> bool:
+        return outer.start <= inner.start and inner.end <= outer.end
+
+    def unit_issues(self, kernel: SourceItem, deps: List[SourceItem]) -> List[str]:
+        issues = []
+        for item in [kernel] + deps:
+            if item.kind == 'macro_metaprogramming':
+                issues.append(f"macro {item.name} uses token pasting or stringizing")
+            if item.is_prototype and not any(f for f in self.functions.get(item.name, ())):
+                issues.append(f"{item.name} is declared but not defined in this file")
+            for region_start, region_end in self.conditional_regions:
+                inside = item.start <= region_start and region_end <= item.end
+                disjoint = region_end <= item.start or item.end <= region_start
+                if not inside and not disjoint:
+                    issues.append(f"{item.name} is under a preprocessor conditional")
+                    break
+        return issues
+
+    def render_unit(self, kernel: SourceItem, deps: List[SourceItem], include_user_headers: bool = False) -> str:
+        parts = []
+        for kind, _, line in self.includes:
+            if kind == 'system' or include_user_headers:
+                if line not in parts:
+                    parts.append(line)
+        if parts:
+            parts.append('')
+
+        emitted = []
+        for item in deps + [kernel]:
+            # Nested items (e.g. a #define inside a helper) are already part of the outer text
+            if any(self._contains(other, item) for other in emitted if other is not item):
+                continue
+            if item.is_prototype:
+                continue
+            emitted.append(item)
+        for item in sorted(emitted, key=lambda d: d.start):
+            parts.append(item.text.rstrip())
+            parts.append('')
+
+        return '\n'.join(parts).rstrip() + '\n'
+
+
+class LocalKernelExtractor:
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    def extract(self, file_path: str, code_content: str) -> Tuple[Optional[Dict], List[str]]:
+        analyzer = CudaSourceAnalyzer(code_content)
+        issues = list(analyzer.issues)
+
+        kernels = []
+        for kernel in analyzer.kernels:
+            deps = analyzer.dependency_closure(kernel)
+            issues.extend(analyzer.unit_issues(kernel, deps))
+            kernels.append({
+                'func_name': kernel.name,
+                'func_signature': kernel.signature,
+                'func_content': analyzer.render_unit(kernel, deps)
+            })
+
+        if issues:
+            return None, issues
+
+        return {
+            'source_file': file_path,
+            'kernels': kernels,
+            'extraction_method': 'local'
+        }, []
@@ -0,0 +1,231 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+import argparse
+from collections import Counter
+from typing import Dict, Iterator, List, Set, Tuple
+
+from config_project import (
+    SOURCE_DIRECTORY, FILE_INVENTORY_PATH, DELTA_INVENTORY_PATH, EXTRACTION_RESULTS_DIR, EXTRACTED_KERNELS_DIR,
+    MAX_CONCURRENT_REQUESTS, PIPELINE_QUEUE_SIZE, LLM_PROVIDER
+)
+from llm_router import resolve_llm_config
+from step1_cu_file_collector import FileCollector
+from step2_kernel_llm_extractor import LLMExtractor
+from step3_kernel_saver import KernelSaver
+from step4_clean_pytorch_headers import clean_header_content
+
+
+class StreamingPipeline:
+
+    def __init__(self, llm_config: Dict, source_dir: str = SOURCE_DIRECTORY,
+                 results_dir: str = EXTRACTION_RESULTS_DIR, kernels_dir: str = EXTRACTED_KERNELS_DIR,
+                 max_concurrency: int = MAX_CONCURRENT_REQUESTS, queue_size: int = PIPELINE_QUEUE_SIZE,
+                 resume: bool = True):
+        self.logger = logging.getLogger(__name__)
+        self.results_dir = results_dir
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.resume = resume
+
+        os.makedirs(results_dir, exist_ok=True)
+        self.collector = FileCollector(source_dir, FILE_INVENTORY_PATH)
+        self.extractor = LLMExtractor(llm_config, on_kernel=self._on_streamed_kernel)
+        self.saver = KernelSaver(results_dir, kernels_dir, content_filter=clean_header_content)
+        # Early writes of streamed kernels, awaited before their file's result is saved or discarded
+        self._streamed_saves: Dict[str, List[asyncio.Task]] = {}
+
+        self.stats = Counter()
+        # Every scanned entry, up to date or not; written as the step 1 inventory once the run is done
+        self._scanned_entries: List[Dict] = []
+        # Hashes are only held for files that are queued or in flight
+        self._content_hashes: Dict[str, str] = {}
+        # Duplicate sources ride along with a canonical file that is still queued or in flight
+        self._source_dedup = self.extractor.new_source_dedup_index()
+        self._in_flight: Dict[str, List[str]] = {}
+        self._dedup_lock = threading.Lock()
+
+    def _pending_files(self) -> Iterator[Tuple[str, int]]:
+        for entry in self.collector.iter_cuda_entries():
+            self.stats['scanned'] += 1
+            self._scanned_entries.append(entry)
+            if not self.extractor.needs_extraction(entry['path'], entry['sha256'], self.resume,
+                                                   self.results_dir):
+                self.stats['up_to_date'] += 1
+                continue
+            self._content_hashes[entry['path']] = entry['sha256']
+            
+            canonical = self.extractor.match_duplicate_source(self._source_dedup, entry['path'])
+            with self._dedup_lock:
+                if canonical in self._in_flight:
+                    self._in_flight[canonical].append(entry['path'])
+                    self.stats['deduplicated'] += 1
+                    continue
+                self._in_flight[entry['path']] = []
+            yield entry['path'], entry['size']
+    
+    def _claim_duplicates(self, work_item: List[str], hashes: Dict[str, str]) -> Dict[str, List[str]]:
+        # Once claimed, later copies of these files are dispatched on their own (exact copies hit the cache)
+        with self._dedup_lock:
+            duplicates = {file_path: self._in_flight.pop(file_path, []) for file_path in work_item}
+        for duplicate_paths in duplicates.values():
+            for duplicate_path in duplicate_paths:
+                hashes[duplicate_path] = self._content_hashes.pop(duplicate_path)
+        return duplicates
+
+    def _produce(self, loop: asyncio.AbstractEventLoop, work_queue: asyncio.Queue) -> None:
+        # Runs in a worker thread; blocking on the bounded queue is what holds the scanner back
+        for work_item in self.extractor.iter_work_items(self._pending_files()):
+            asyncio.run_coroutine_threadsafe(work_queue.put(work_item), loop).result()
+
+    def _on_streamed_kernel(self, file_path: str, kernel: Dict) -> None:
+        # Called on the event loop while the file's response is still streaming
+        task = asyncio.get_running_loop().create_task(
+            asyncio.to_thread(self.saver.save_streamed_kernel, file_path, kernel)
+        )
+        self._streamed_saves.setdefault(file_path, []).append(task)
+
+    async def _wait_streamed(self, file_path: str) -> None:
+        for saved in await asyncio.gather(*self._streamed_saves.pop(file_path, []), return_exceptions=True):
+            if isinstance(saved, Exception):
+                self.logger.warning(f"Streamed kernel of {file_path} was not saved: {saved}")
+            elif saved is not None:
+                self.stats['streamed_kernels'] += 1
+
+    async def _extract_worker(self, work_queue: asyncio.Queue, save_queue: asyncio.Queue) -> None:
+        while True:
+            work_item = await work_queue.get()
+            if work_item is None:
+                return
+
+            hashes = {file_path: self._content_hashes.pop(file_path) for file_path in work_item}
+            item_results = await self.extractor.aprocess_work_item(
+                work_item, hashes, self.results_dir,
+                claim_duplicates=lambda file_paths: self._claim_duplicates(file_paths, hashes)
+            )
+            for file_path, result in item_results:
+                if result is None:
+                    self.stats['failed'] += 1
+                    await self._wait_streamed(file_path)
+                    await asyncio.to_thread(self.saver.discard_streamed, file_path)
+                    continue
+                self.stats['extracted'] += 1
+                self.stats['kernels'] += len(result.get('kernels', []))
+                await save_queue.put(result)
+
+    async def _save_worker(self, save_queue: asyncio.Queue) -> None:
+        while True:
+            result = await save_queue.get()
+            if result is None:
+                return
+            await self._wait_streamed(result['source_file'])
+            saved = await asyncio.to_thread(self.saver.save_result, result)
+            self.stats['saved_kernels'] += len(saved)
+
+    def _known_sources(self) -> Set[str]:
+        # Sources of the last scan, plus deletions (renamed-away paths included) of a step 1 --delta that step 2
+        # has not processed yet
+        known = set()
+        if os.path.exists(FILE_INVENTORY_PATH):
+            known.update(FileCollector.load_inventory(FILE_INVENTORY_PATH).get('files', []))
+        pending = FileCollector.pending_delta(DELTA_INVENTORY_PATH)
+        if pending is not None:
+            known.update(pending['deleted'])
+        return known
+
+    def _finish_scan(self, known_sources: Set[str]) -> None:
+        # Runs in a worker thread once every file is extracted: the same bookkeeping as steps 1-3 run one by one
+        scanned = {entry['path'] for entry in self._scanned_entries}
+        deleted = sorted(known_sources - scanned - self.collector.scan_errors)
+        if deleted:
+            self.stats['deleted'] = self.extractor.remove_sources(deleted, self.results_dir)
+
+        # Removes the kernels of deleted sources and saves stored results no earlier run of step 3 has saved yet
+        # (files that were up to date here); sources saved above are skipped by their revision
+        saved = self.saver.save_kernels()
+        self.stats['saved_kernels'] += saved['saved_kernels']
+
+        self._scanned_entries.sort(key=lambda entry: entry['path'])
+        self.collector.save_inventory(self._scanned_entries)
+        if FileCollector.pending_delta(DELTA_INVENTORY_PATH) is not None:
+            FileCollector.mark_delta_consumed(DELTA_INVENTORY_PATH)
+
+    async def run(self) -> Dict:
+        loop = asyncio.get_running_loop()
+        known_sources = self._known_sources()
+        work_queue = asyncio.Queue(maxsize=self.queue_size)
+        save_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        extract_workers = [
+            asyncio.create_task(self._extract_worker(work_queue, save_queue))
+            for _ in range(self.max_concurrency)
+        ]
+        save_worker = asyncio.create_task(self._save_worker(save_queue))
+
+        try:
+            await asyncio.to_thread(self._produce, loop, work_queue)
+        finally:
+            for _ in extract_workers:
+                await work_queue.put(None)
+            await asyncio.gather(*extract_workers)
+            await save_queue.put(None)
+            await save_worker
+
+        await asyncio.to_thread(self._finish_scan, known_sources)
+        self.stats['renamed_kernels'] = self.saver.index.summary(self.saver.output_dir)['conflicts_detected']
+        return dict(self.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run collection, extraction, saving and header cleanup as one streaming pass')
+    parser.add_argument('--provider', default=LLM_PROVIDER, help='Provider or route entry in config_llm.json')
+    parser.add_argument('--source-dir', default=SOURCE_DIRECTORY, help='Source directory to scan')
+    parser.add_argument('--max-concurrency', type=int, default=MAX_CONCURRENT_REQUESTS, help='Max in-flight work items')
+    parser.add_argument('--no-resume', action='store_true', help='Re-extract files the ledger marks as done')
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    logger = logging.getLogger(__name__)
+    logger.info("=" * 60)
+    logger.info("Pipeline: collect -> extract -> save -> clean")
+    logger.info("=" * 60)
+
+    try:
+        with open("config_llm.json", "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        pipeline = StreamingPipeline(
+            resolve_llm_config(config, args.provider), source_dir=args.source_dir,
+            max_concurrency=args.max_concurrency, resume=not args.no_resume
+        )
+
+        with pipeline.extractor.metrics.stage_timer("pipeline"):
+            stats = asyncio.run(pipeline.run())
+
+        logger.info("=" * 60)
+        logger.info("✓ Pipeline completed!")
+        logger.info(f"  - Scanned files with kernels: {stats.get('scanned', 0)} "
+                    f"({stats.get('up_to_date', 0)} already up to date)")
+        logger.info(f"  - Extracted: {stats.get('extracted', 0)}, failed: {stats.get('failed', 0)} "
+                    f"({stats.get('deduplicated', 0)} duplicate sources shared a request), "
+                    f"results of deleted sources removed: {stats.get('deleted', 0)}")
+        logger.info(f"  - Saved kernels: {stats.get('saved_kernels', 0)} "
+                    f"({stats.get('streamed_kernels', 0)} written while their response was streaming, "
+                    f"{stats.get('renamed_kernels', 0)} renamed for name conflicts)")
+        logger.info(f"  - Output directory: {EXTRACTED_KERNELS_DIR}")
+        pipeline.extractor.metrics.log_summary(logger)
+        logger.info("=" * 60)
+
+    except Exception as e:
+        logger.error(f"✗ Pipeline failed: {e}", exc_info=True)
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import logging
+from typing import List, Optional, Tuple
+
+from local_kernel_extractor import CudaSourceAnalyzer
+
+
+class PromptSlicer:
+
+    def __init__(self, threshold_chars: int):
+        self.threshold_chars = threshold_chars
+        self.logger = logging.getLogger(__name__)
+
+    def slice(self, code_content: str) -> Optional[List[Tuple[str, str]]]:
+        if len(code_content) < self.threshold_chars:
+            return None
+
+        analyzer = CudaSourceAnalyzer(code_content)
+        if analyzer.structural_issues:
+            self.logger.debug(f"Cannot slice, source structure unclear: {'; '.join(analyzer.structural_issues[:3])}")
+            return None
+        if len(analyzer.kernels) < 2:
+            return None
+
+        units = []
+        for kernel in analyzer.kernels:
+            deps = analyzer.dependency_closure(kernel)
+            # User headers stay in the slice as context; the prompt tells the model to drop them
+            units.append((kernel.name, analyzer.render_unit(kernel, deps, include_user_headers=True)))
+
+        return units
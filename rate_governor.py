@@ -0,0 +1,180 @@
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+
+class TokenBucket:
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateGovernor:
+
+    SLOT_POLL_SECONDS = 0.05
+    DEFAULT_THROTTLE_PAUSE = 2.0
+
+    def __init__(self, name: str, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, initial_concurrency: int = 8,
+                 min_concurrency: int = 1, max_concurrency: int = 256,
+                 decrease_cooldown_seconds: float = 2.0):
+        self.name = name
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self.decrease_cooldown_seconds = decrease_cooldown_seconds
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease_at = 0.0
+        self.throttle_count = 0
+
+    def try_acquire(self, estimated_tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.in_flight >= int(self.concurrency_limit):
+                return self.SLOT_POLL_SECONDS
+
+            wait = 0.0
+            if self.request_bucket is not None:
+                wait = max(wait, self.request_bucket.wait_time(1, now))
+            if self.token_bucket is not None:
+                wait = max(wait, self.token_bucket.wait_time(estimated_tokens, now))
+            if wait > 0:
+                return wait
+
+            if self.request_bucket is not None:
+                self.request_bucket.take(1)
+            if self.token_bucket is not None:
+                self.token_bucket.take(estimated_tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def acquire(self, estimated_tokens: int) -> float:
+        started_at = time.monotonic()
+        while True:
+            wait = self.try_acquire(estimated_tokens)
+            if wait <= 0:
+                return time.monotonic() - started_at
+            time.sleep(min(wait, 1.0))
+
+    async def aacquire(self, estimated_tokens: int) -> float:
+        started_at = time.monotonic()
+        while True:
+            wait = self.try_acquire(estimated_tokens)
+            if wait <= 0:
+                return time.monotonic() - started_at
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, reserved_tokens: int, used_tokens: Optional[int] = None, success: bool = True) -> None:
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+            if self.token_bucket is not None and used_tokens is not None and used_tokens < reserved_tokens:
+                self.token_bucket.refund(reserved_tokens - used_tokens)
+
+            if success:
+                # Additive increase: roughly +1 slot per window of successful requests
+                self.concurrency_limit = min(float(self.max_concurrency),
+                                             self.concurrency_limit + 1.0 / self.concurrency_limit)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.throttle_count += 1
+
+            pause = retry_after if retry_after is not None else self.DEFAULT_THROTTLE_PAUSE
+            self.paused_until = max(self.paused_until, now + pause)
+
+            # One multiplicative decrease per burst of 429s, not one per failed request
+            if now - self.last_decrease_at >= self.decrease_cooldown_seconds:
+                self.concurrency_limit = max(float(self.min_concurrency), self.concurrency_limit / 2.0)
+                self.last_decrease_at = now
+                self.logger.warning(f"[{self.name}] Throttled, concurrency limit -> "
+                                    f"{int(self.concurrency_limit)}, pause {pause:.1f}s")
+
+    def availability(self) -> float:
+        # Share of free slots and remaining RPM/TPM budget, 0.0 while paused after a 429
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return 0.0
+            limit = int(self.concurrency_limit)
+            free = max(0.0, (limit - self.in_flight) / limit)
+            for bucket in (self.request_bucket, self.token_bucket):
+                if bucket is not None:
+                    bucket._refill(now)
+                    free = min(free, max(0.0, bucket.level / bucket.capacity))
+            return free
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'name': self.name,
+                'concurrency_limit': int(self.concurrency_limit),
+                'in_flight': self.in_flight,
+                'throttle_count': self.throttle_count
+            }
+
+
+_governors: Dict[str, RateGovernor] = {}
+_governors_lock = threading.Lock()
+
+
+def endpoint_name(provider_config: Dict) -> str:
+    return "|".join(str(provider_config.get(k, "")) for k in ("provider", "base_url", "model_id"))
+
+
+def get_governor(provider_config: Dict) -> RateGovernor:
+    name = endpoint_name(provider_config)
+
+    with _governors_lock:
+        governor = _governors.get(name)
+        if governor is None:
+            rate_limits = provider_config.get("rate_limits", {})
+            governor = RateGovernor(
+                name,
+                requests_per_minute=rate_limits.get("requests_per_minute"),
+                tokens_per_minute=rate_limits.get("tokens_per_minute"),
+                initial_concurrency=rate_limits.get("initial_concurrency", 8),
+                min_concurrency=rate_limits.get("min_concurrency", 1),
+                max_concurrency=rate_limits.get("max_concurrency", 256)
+            )
+            _governors[name] = governor
+
+    return governor
+
+
+def reset_governors() -> None:
+    with _governors_lock:
+        _governors.clear()
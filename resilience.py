@@ -0,0 +1,193 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from llm_providers.base_provider import LLMProviderError
+from telemetry import percentile
+
+
+class CircuitOpenError(LLMProviderError):
+    # Raised without calling the endpoint; retrying right away would only fail fast again
+
+    @property
+    def is_retryable(self) -> bool:
+        return False
+
+
+class CircuitBreaker:
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, enabled: bool = True, failure_threshold: int = 5,
+                 reset_timeout_seconds: float = 30.0):
+        self.name = name
+        self.enabled = enabled
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def before_call(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout_seconds - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"[{self.name}] circuit open, failing fast for another {remaining:.1f}s")
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+                self.logger.info(f"[{self.name}] Circuit half-open, sending a probe request")
+
+            if self.state == self.HALF_OPEN:
+                # Exactly one probe decides whether the endpoint is back
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"[{self.name}] circuit half-open, waiting for the probe request")
+                self._probe_in_flight = True
+
+    def release_probe(self) -> None:
+        # The call was cancelled (hedge loser, shutdown) before it said anything about the endpoint; without this
+        # a cancelled probe would leave the circuit half-open and rejecting every request
+        if not self.enabled:
+            return
+        with self._lock:
+            self._probe_in_flight = False
+
+    def allows_requests(self) -> bool:
+        with self._lock:
+            return not self.enabled or self.state != self.OPEN or \
+                time.monotonic() >= self.opened_at + self.reset_timeout_seconds
+
+    def _is_endpoint_failure(self, error: Exception) -> bool:
+        # Timeouts, connection errors and 5xx mean the endpoint is unhealthy; 429 and 4xx mean it answered
+        if not isinstance(error, LLMProviderError):
+            return False
+        return error.status_code is None or error.status_code >= 500
+
+    def record(self, error: Optional[Exception] = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._probe_in_flight = False
+            if error is None or not self._is_endpoint_failure(error):
+                if self.state != self.CLOSED:
+                    self.logger.info(f"[{self.name}] Circuit closed, endpoint recovered")
+                self.state = self.CLOSED
+                self.failures = 0
+                return
+
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.open_count += 1
+                    self.logger.warning(f"[{self.name}] Circuit open after {self.failures} consecutive failures, "
+                                        f"failing fast for {self.reset_timeout_seconds:.0f}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'state': self.state, 'open_count': self.open_count, 'rejected': self.rejected}
+
+
+class HedgePolicy:
+    # A duplicate request goes out once the original has run longer than the recent latency
+    # percentile; max_hedge_ratio caps the extra load
+
+    def __init__(self, name: str, enabled: bool = False, latency_percentile: float = 95.0, min_samples: int = 20,
+                 min_delay_seconds: float = 2.0, max_hedge_ratio: float = 0.05, window: int = 500):
+        self.name = name
+        self.enabled = enabled
+        self.latency_percentile = latency_percentile
+        self.min_samples = min_samples
+        self.min_delay_seconds = min_delay_seconds
+        self.max_hedge_ratio = max_hedge_ratio
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def observe(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            self.requests += 1
+            if len(self._latencies) < self.min_samples:
+                return None
+            return max(self.min_delay_seconds, percentile(list(self._latencies), self.latency_percentile))
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.max_hedge_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def on_hedge_win(self) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'requests': self.requests, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_hedge_policies: Dict[str, HedgePolicy] = {}
+_registry_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str, provider_config: Dict) -> CircuitBreaker:
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            settings = provider_config.get("circuit_breaker", {})
+            breaker = CircuitBreaker(
+                name,
+                enabled=settings.get("enabled", True),
+                failure_threshold=settings.get("failure_threshold", 5),
+                reset_timeout_seconds=settings.get("reset_timeout_seconds", 30.0)
+            )
+            _breakers[name] = breaker
+    return breaker
+
+
+def get_hedge_policy(name: str, provider_config: Dict) -> HedgePolicy:
+    with _registry_lock:
+        policy = _hedge_policies.get(name)
+        if policy is None:
+            settings = provider_config.get("hedging", {})
+            policy = HedgePolicy(
+                name,
+                enabled=settings.get("enabled", False),
+                latency_percentile=settings.get("percentile", 95.0),
+                min_samples=settings.get("min_samples", 20),
+                min_delay_seconds=settings.get("min_delay_seconds", 2.0),
+                max_hedge_ratio=settings.get("max_hedge_ratio", 0.05)
+            )
+            _hedge_policies[name] = policy
+    return policy
+
+
+def reset_resilience() -> None:
+    with _registry_lock:
+        _breakers.clear()
+        _hedge_policies.clear()
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def normalize_code(code_content: str) -> str:
+    lines = code_content.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip('\n')
+
+
+class ResponseCache:
+
+    def __init__(self, cache_dir: str, max_bytes: int, template_version: str, track_size: bool = True):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.template_version = template_version
+        # Without size tracking nothing is evicted; processes sharing the cache directory (distributed workers)
+        # leave that to the next step 2 or pipeline run
+        self.track_size = track_size
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Counted on the first write, so runs that only read cached responses never walk the directory
+        self._total_bytes: Optional[int] = None
+
+    def _iter_entries(self):
+        return self.cache_dir.glob("*/*.json")
+
+    def _size(self) -> int:
+        # Called with the lock held
+        if self._total_bytes is None:
+            self._total_bytes = sum(p.stat().st_size for p in self._iter_entries())
+        return self._total_bytes
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def make_key(self, model: str, temperature: float, max_tokens: int,
+                 system_message: str, code_content: str, response_format: Optional[str] = None) -> str:
+        fields = {
+            'model': model,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'template_version': self.template_version,
+            'system_message': system_message,
+            'code_sha256': hashlib.sha256(normalize_code(code_content).encode('utf-8')).hexdigest()
+        }
+        # Only present for structured output, so prompt-only keys stay as they were
+        if response_format is not None:
+            fields['response_format'] = response_format
+        payload = json.dumps(fields, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('template_version') != self.template_version:
+            return None
+
+        try:
+            # mtime doubles as the LRU timestamp
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+
+        return entry.get('response')
+
+    def put(self, key: str, response: str, model: str) -> None:
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+
+        entry = {
+            'key': key,
+            'model': model,
+            'template_version': self.template_version,
+            'created_at': time.time(),
+            'response': response
+        }
+
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+
+        with self._lock:
+            if not self.track_size:
+                os.replace(tmp_path, entry_path)
+                return
+            total_bytes = self._size()
+            old_size = entry_path.stat().st_size if entry_path.exists() else 0
+            os.replace(tmp_path, entry_path)
+            self._total_bytes = total_bytes + entry_path.stat().st_size - old_size
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key: str) -> None:
+        entry_path = self._entry_path(key)
+        with self._lock:
+            try:
+                size = entry_path.stat().st_size
+                entry_path.unlink()
+                if self._total_bytes is not None:
+                    self._total_bytes -= size
+            except OSError:
+                pass
+
+    def _evict(self) -> None:
+        entries = []
+        for p in self._iter_entries():
+            try:
+                stat = p.stat()
+                entries.append((stat.st_mtime, stat.st_size, p))
+            except OSError:
+                continue
+
+        entries.sort()
+        self._total_bytes = sum(size for _, size, _ in entries)
+        target_bytes = int(self.max_bytes * 0.9)
+
+        evicted = 0
+        for _, size, p in entries:
+            if self._total_bytes <= target_bytes:
+                break
+            try:
+                p.unlink()
+                self._total_bytes -= size
+                evicted += 1
+            except OSError:
+                continue
+
+        self.logger.info(f"Response cache evicted {evicted} entries, size now {self._total_bytes} bytes")
+
+    def invalidate(self, keep_version: Optional[str] = None) -> int:
+        removed = 0
+        with self._lock:
+            for p in list(self._iter_entries()):
+                try:
+                    if keep_version is not None:
+                        with open(p, 'r', encoding='utf-8') as f:
+                            if json.load(f).get('template_version') == keep_version:
+                                continue
+                    size = p.stat().st_size
+                    p.unlink()
+                    if self._total_bytes is not None:
+                        self._total_bytes -= size
+                    removed += 1
+                except (OSError, ValueError):
+                    continue
+
+        self.logger.info(f"Response cache invalidated {removed} entries")
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total_bytes = self._size()
+        return {
+            'cache_dir': str(self.cache_dir),
+            'total_bytes': total_bytes,
+            'max_bytes': self.max_bytes,
+            'template_version': self.template_version
+        }
+
+
+def main():
+    from config_project import LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, PROMPT_TEMPLATE_VERSION
+
+    parser = argparse.ArgumentParser(description='Manage the on-disk LLM response cache')
+    parser.add_argument('--clear', action='store_true', help='Remove every cached response')
+    parser.add_argument('--keep-version', default=PROMPT_TEMPLATE_VERSION,
+                        help='Remove cached responses from every other prompt template version')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    cache = ResponseCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, args.keep_version)
+    cache.invalidate(None if args.clear else args.keep_version)
+    print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import re
+import json
+from typing import Dict, List, Optional, Tuple
+
+from json_stream import IncrementalKernelParser, loads_lenient, repair_json
+
+
+FENCE_RE = re.compile(r'```[A-Za-z]*[ \t]*\n(.*?)(?:\n[ \t]*```|\Z)', re.DOTALL)
+
+KERNEL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "func_name": {"type": "string"},
+        "func_signature": {"type": "string"},
+        "func_content": {"type": "string"}
+    },
+    "required": ["func_name", "func_signature", "func_content"],
+    "additionalProperties": False
+}
+
+# Answer of a single-file, slice, continuation or repair request
+FILE_RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "source_file": {"type": "string"},
+        "kernels": {"type": "array", "items": KERNEL_SCHEMA}
+    },
+    "required": ["source_file", "kernels"],
+    "additionalProperties": False
+}
+
+# Answer of a packed request
+PACKED_RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {"type": "array", "items": FILE_RESULT_SCHEMA}
+    },
+    "required": ["results"],
+    "additionalProperties": False
+}
+
+
+def json_body(text: str) -> str:
+    # Drops code fences and any prose around the outermost object
+    fenced = FENCE_RE.search(text)
+    if fenced and '{' in fenced.group(1):
+        text = fenced.group(1)
+    start = text.find('{')
+    # A bare array of kernel objects keeps its brackets
+    array_start = text.find('[')
+    if array_start != -1 and (start == -1 or array_start < start) and \
+            text[array_start + 1:].lstrip().startswith(('{', ']')):
+        end = text.rfind(']')
+        return text[array_start:end + 1] if end > array_start else text[array_start:]
+    if start == -1:
+        return text.strip()
+    end = text.rfind('}')
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def _load(body: str) -> Tuple[Optional[object], str]:
+    try:
+        return json.loads(body), 'ok'
+    except ValueError:
+        pass
+    try:
+        return loads_lenient(body), 'repaired'
+    except ValueError:
+        return None, 'failed'
+
+
+def _recover(body: str, array_key: str, required_key: str) -> List[Dict]:
+    parser = IncrementalKernelParser(array_key, required_key)
+    parser.feed(body)
+    if not parser.kernels:
+        parser.reset()
+        parser.feed(repair_json(body))
+    return parser.kernels
+
+
+def parse_kernel_response(text: Optional[str]) -> Tuple[Optional[Dict], str]:
+    # Outcome is 'ok', 'repaired', 'recovered' (only the complete kernel objects survived) or 'failed'
+    if not text:
+        return None, 'failed'
+
+    body = json_body(text)
+    result, outcome = _load(body)
+    if isinstance(result, list):
+        result = {'kernels': result}
+    if isinstance(result, dict) and isinstance(result.get('kernels', []), list):
+        return result, outcome
+
+    kernels = _recover(body, 'kernels', 'func_name')
+    if kernels:
+        return {'kernels': kernels, 'recovered': True}, 'recovered'
+    return None, 'failed'
+
+
+def parse_packed_response(text: Optional[str]) -> Tuple[Optional[Dict], str]:
+    if not text:
+        return None, 'failed'
+
+    body = json_body(text)
+    packed, outcome = _load(body)
+    if isinstance(packed, dict) and isinstance(packed.get('results'), list):
+        return packed, outcome
+
+    entries = _recover(body, 'results', 'source_file')
+    if entries:
+        return {'results': entries}, 'recovered'
+    return None, 'failed'
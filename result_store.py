@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config_project import EXTRACTION_RESULTS_DIR, RESULT_STORE_NAME, SHARED_JOURNAL_MODE
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    source_path TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    model TEXT,
+    template_version TEXT,
+    extraction_method TEXT,
+    kernel_count INTEGER NOT NULL,
+    revision INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_content_hash ON results (content_hash);
+CREATE INDEX IF NOT EXISTS results_revision ON results (revision);
+CREATE TABLE IF NOT EXISTS kernels (
+    source_path TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    func_name TEXT NOT NULL,
+    signature TEXT,
+    content TEXT NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (source_path, position)
+);
+CREATE INDEX IF NOT EXISTS kernels_func_name ON kernels (func_name);
+CREATE INDEX IF NOT EXISTS kernels_signature ON kernels (signature);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+def init_journal_mode(conn: sqlite3.Connection, journal_mode: str, logger: logging.Logger) -> None:
+    # The journal mode is stored in the database file. It is only set on a new, empty database: switching a
+    # database that other hosts have open would change it under them
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        return
+    current = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if current.lower() != journal_mode.lower():
+        logger.warning(f"Database uses journal mode {current}, not {journal_mode}; left unchanged")
+
+
+# Kernel keys with their own column; anything else a result carries per kernel goes to extra as JSON
+KERNEL_COLUMNS = ('func_name', 'func_signature', 'func_content')
+
+
+class ResultStore:
+    # Step 2 results in one SQLite database keyed by source path, replacing one JSON file per source stem.
+    # Kernels live in their own table so they can be looked up by name or signature; every write gets a new
+    # revision so step 3 only loads results that changed since it last saw them.
+
+    BUSY_TIMEOUT_SECONDS = 60
+
+    def __init__(self, db_path: str, journal_mode: str = SHARED_JOURNAL_MODE):
+        self.db_path = Path(db_path)
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        init_journal_mode(conn, journal_mode, self.logger)
+        conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; other threads and processes write through their own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def put(self, source_path: str, content_hash: str, result: Dict, model: str = '',
+            template_version: str = '') -> int:
+        kernels = result.get('kernels', [])
+        body = {k: v for k, v in result.items() if k != 'kernels'}
+        rows = []
+        for position, kernel in enumerate(kernels):
+            extra = {k: v for k, v in kernel.items() if k not in KERNEL_COLUMNS}
+            rows.append((source_path, position, kernel.get('func_name', ''), kernel.get('func_signature'),
+                         kernel.get('func_content', ''), json.dumps(extra, ensure_ascii=False) if extra else None))
+
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front, so concurrent writers queue on busy_timeout instead of
+        # failing to upgrade a read transaction
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A counter rather than MAX(revision): a deleted source's revision must never be handed out again.
+            # Databases from before the counter start from their highest revision
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('revision', (SELECT COALESCE(MAX(revision), 0) + 1 FROM results)) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+            )
+            revision = conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO results (source_path, content_hash, model, template_version, "
+                "extraction_method, kernel_count, revision, updated_at, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source_path, content_hash, model, template_version, result.get('extraction_method'),
+                 len(kernels), revision, time.time(), json.dumps(body, ensure_ascii=False))
+            )
+            conn.execute("DELETE FROM kernels WHERE source_path = ?", (source_path,))
+            conn.executemany(
+                "INSERT INTO kernels (source_path, position, func_name, signature, content, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return revision
+
+    def delete(self, source_path: str) -> bool:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = conn.execute("DELETE FROM results WHERE source_path = ?", (source_path,)).rowcount
+            conn.execute("DELETE FROM kernels WHERE source_path = ?", (source_path,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted > 0
+
+    def revisions(self) -> Dict[str, int]:
+        # Primary key and revision only; no result is parsed
+        return dict(self._connection().execute("SELECT source_path, revision FROM results"))
+
+    def revision(self, source_path: str) -> Optional[int]:
+        row = self._connection().execute(
+            "SELECT revision FROM results WHERE source_path = ?", (source_path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_entry(self, source_path: str) -> Optional[Dict]:
+        # Row metadata and the result without its kernels
+        row = self._connection().execute(
+            "SELECT content_hash, model, template_version, revision, result FROM results WHERE source_path = ?",
+            (source_path,)
+        ).fetchone()
+        if row is None:
+            return None
+        content_hash, model, template_version, revision, body = row
+        return {'content_hash': content_hash, 'model': model, 'template_version': template_version,
+                'revision': revision, 'result': json.loads(body)}
+
+    def _kernels(self, conn: sqlite3.Connection, source_paths: List[str]) -> Dict[str, List[Dict]]:
+        placeholders = ','.join('?' * len(source_paths))
+        kernels = {}
+        for source_path, func_name, signature, content, extra in conn.execute(
+                f"SELECT source_path, func_name, signature, content, extra FROM kernels "
+                f"WHERE source_path IN ({placeholders}) ORDER BY source_path, position", source_paths):
+            kernel = {'func_name': func_name, 'func_signature': signature, 'func_content': content}
+            if signature is None:
+                del kernel['func_signature']
+            if extra:
+                kernel.update(json.loads(extra))
+            kernels.setdefault(source_path, []).append(kernel)
+        return kernels
+
+    def get_many(self, source_paths: Iterable[str]) -> List[Tuple[str, int, Dict]]:
+        # (source_path, revision, result) for the paths that have a result, read in one snapshot
+        source_paths = list(source_paths)
+        if not source_paths:
+            return []
+        conn = self._connection()
+        placeholders = ','.join('?' * len(source_paths))
+        conn.execute("BEGIN")
+        try:
+            rows = conn.execute(
+                f"SELECT source_path, revision, result FROM results WHERE source_path IN ({placeholders})",
+                source_paths
+            ).fetchall()
+            kernels = self._kernels(conn, source_paths)
+        finally:
+            conn.execute("COMMIT")
+
+        results = []
+        for source_path, revision, body in rows:
+            result = json.loads(body)
+            result['kernels'] = kernels.get(source_path, [])
+            results.append((source_path, revision, result))
+        return results
+
+    def iter_results(self, chunk_size: int = 256) -> Iterator[Dict]:
+        # All results in source path order, one chunk of rows (and their kernels) in memory at a time
+        conn = self._connection()
+        last = ''
+        while True:
+            rows = conn.execute(
+                "SELECT source_path, content_hash, model, template_version, revision, result FROM results "
+                "WHERE source_path > ? ORDER BY source_path LIMIT ?", (last, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            kernels = self._kernels(conn, [row[0] for row in rows])
+            for source_path, content_hash, model, template_version, revision, body in rows:
+                result = json.loads(body)
+                result['kernels'] = kernels.get(source_path, [])
+                yield {'source_path': source_path, 'content_hash': content_hash, 'model': model,
+                       'template_version': template_version, 'revision': revision, 'result': result}
+            last = rows[-1][0]
+
+    def get(self, source_path: str) -> Optional[Dict]:
+        found = self.get_many([source_path])
+        return found[0][2] if found else None
+
+    def find_kernels(self, func_name: Optional[str] = None, signature: Optional[str] = None) -> List[Dict]:
+        clauses, params = [], []
+        if func_name is not None:
+            clauses.append("func_name = ?")
+            params.append(func_name)
+        if signature is not None:
+            clauses.append("signature = ?")
+            params.append(signature)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connection().execute(
+            f"SELECT source_path, func_name, signature, content FROM kernels {where} ORDER BY source_path, position",
+            params
+        )
+        return [
+            {'source_file': source_path, 'func_name': name, 'func_signature': sig, 'func_content': content}
+            for source_path, name, sig, content in rows
+        ]
+
+    def count(self) -> Tuple[int, int]:
+        conn = self._connection()
+        return (conn.execute("SELECT COUNT(*) FROM results").fetchone()[0],
+                conn.execute("SELECT COUNT(*) FROM kernels").fetchone()[0])
+
+    def import_json_dir(self, results_dir: str) -> int:
+        # One-off migration of the per-file JSON results written before the store existed
+        imported = 0
+        with os.scandir(results_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        result = json.load(f)
+                except Exception as e:
+                    self.logger.warning(f"Cannot load result, skip: {entry.path}, error: {e}")
+                    continue
+                source_path = result.get('source_file')
+                if not source_path:
+                    continue
+                self.put(source_path, '', result)
+                imported += 1
+        return imported
+
+
+def result_store_path(results_dir: str) -> str:
+    return os.path.join(results_dir, RESULT_STORE_NAME)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or migrate the step 2 result store')
+    parser.add_argument('directory', nargs='?', default=EXTRACTION_RESULTS_DIR, help='Extraction results directory')
+    parser.add_argument('--import-json', action='store_true', help='Import per-file JSON results from the directory')
+    parser.add_argument('--kernel', help='Print the sources that produced a kernel of this name')
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    logger = logging.getLogger(__name__)
+
+    store = ResultStore(result_store_path(args.directory))
+    if args.import_json:
+        logger.info(f"✓ Imported {store.import_json_dir(args.directory)} JSON results into {store.db_path}")
+    if args.kernel:
+        for kernel in store.find_kernels(func_name=args.kernel):
+            logger.info(f"{kernel['func_name']}: {kernel['source_file']} ({kernel['func_signature']})")
+
+    results, kernels = store.count()
+    logger.info(f"Result store {store.db_path}: {results} sources, {kernels} kernels")
+
+
+if __name__ == "__main__":
+    main()
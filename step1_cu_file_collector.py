@@ -1,14 +1,71 @@
 import os
+import re
 import json
+import mmap
+import hashlib
+import argparse
+import subprocess
 from pathlib import Path
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict, Optional, Set, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import logging
 
-from config_project import SOURCE_DIRECTORY, FILE_INVENTORY_PATH, CUDA_EXTENSIONS, OUTPUT_ROOT
+from config_project import (
+    SOURCE_DIRECTORY, FILE_INVENTORY_PATH, CUDA_EXTENSIONS, OUTPUT_ROOT,
+    IGNORED_DIRECTORIES, SCAN_WORKERS, METRICS_PATH, SCAN_STATE_PATH, DELTA_INVENTORY_PATH
+)
+from telemetry import MetricsRecorder
+
+
+GLOBAL_KEYWORD_RE = re.compile(rb'\b__global__\b')
+
+
+def scan_cuda_file(file_path: str) -> Optional[Dict]:
+    stat = os.stat(file_path)
+    if stat.st_size == 0:
+        return None
+
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # ASCII keyword, so a byte search matches both UTF-8 and latin-1 sources
+            if mm.find(b'__global__') == -1:
+                return None
+            content_hash = hashlib.sha256(mm).hexdigest()
+            # Upper bound on the kernel count (comments and prototypes included), used to order step 2 work
+            kernels = sum(1 for _ in GLOBAL_KEYWORD_RE.finditer(mm))
+
+    return {
+        "path": file_path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": content_hash,
+        "kernels": kernels
+    }
+
+
+def _git(repo: str, *args: str) -> str:
+    result = subprocess.run(["git", "-C", repo, *args], capture_output=True, check=True)
+    return result.stdout.decode('utf-8', 'surrogateescape')
+
+
+def _scan_chunk(file_paths: List[str]) -> Tuple[List[Dict], List[Tuple[str, str]]]:
+    entries = []
+    errors = []
+    for file_path in file_paths:
+        try:
+            entry = scan_cuda_file(file_path)
+            if entry is not None:
+                entries.append(entry)
+        except Exception as e:
+            errors.append((file_path, str(e)))
+    return entries, errors
 
 
 class FileCollector:
     
+    SCAN_CHUNK_SIZE = 256
+    
     def __init__(self, source_dir: str, output_path: str):
         self.source_dir = Path(source_dir)
         self.output_path = Path(output_path)
@@ -16,67 +73,134 @@ class FileCollector:
         
         if not self.source_dir.exists():
             raise ValueError(f"Source directory does not exist: {self.source_dir}")
+        
+        # Git checkouts met during the last walk; their HEAD is the base of the next delta scan
+        self.git_repos: Set[str] = set()
+        self.scan_errors: Set[str] = set()
     
-    def collect_cuda_files(self) -> List[str]:
-        cuda_files = []
+    def iter_cuda_files(self) -> Iterator[str]:
+        extensions = tuple(CUDA_EXTENSIONS)
+        ignored = set(IGNORED_DIRECTORIES)
+        
+        stack = [str(self.source_dir.absolute())]
+        while stack:
+            current_dir = stack.pop()
+            try:
+                with os.scandir(current_dir) as it:
+                    for entry in it:
+                        try:
+                            if entry.name == '.git':
+                                self.git_repos.add(current_dir)
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in ignored:
+                                    stack.append(entry.path)
+                            elif entry.name.endswith(extensions) and entry.is_file():
+                                yield entry.path
+                        except OSError as e:
+                            self.logger.warning(f"Cannot stat entry, skip: {entry.path}, error: {e}")
+            except OSError as e:
+                self.logger.warning(f"Cannot scan directory, skip: {current_dir}, error: {e}")
+    
+    def walk_cuda_files(self) -> List[str]:
+        return sorted(self.iter_cuda_files())
+    
+    def _log_scan_errors(self, errors: List[Tuple[str, str]]) -> None:
+        for file_path, error in errors:
+            self.scan_errors.add(file_path)
+            self.logger.warning(f"Cannot read file, skip: {file_path}, error: {error}")
+    
+    def iter_cuda_entries(self) -> Iterator[Dict]:
+        # Streams entries in walk order while at most a few chunks are in flight
+        self.logger.info(f"Start streaming scan: {self.source_dir}")
+        
+        def chunks() -> Iterator[List[str]]:
+            chunk = []
+            for file_path in self.iter_cuda_files():
+                chunk.append(file_path)
+                if len(chunk) >= self.SCAN_CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        
+        if SCAN_WORKERS <= 1:
+            for chunk in chunks():
+                chunk_entries, errors = _scan_chunk(chunk)
+                self._log_scan_errors(errors)
+                yield from chunk_entries
+            return
         
+        with ProcessPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            in_flight = deque()
+            for chunk in chunks():
+                in_flight.append(executor.submit(_scan_chunk, chunk))
+                if len(in_flight) >= 2 * SCAN_WORKERS:
+                    chunk_entries, errors = in_flight.popleft().result()
+                    self._log_scan_errors(errors)
+                    yield from chunk_entries
+            while in_flight:
+                chunk_entries, errors = in_flight.popleft().result()
+                self._log_scan_errors(errors)
+                yield from chunk_entries
+    
+    def scan_files(self, file_paths: List[str]) -> List[Dict]:
+        chunks = [
+            file_paths[i:i + self.SCAN_CHUNK_SIZE]
+            for i in range(0, len(file_paths), self.SCAN_CHUNK_SIZE)
+        ]
+        
+        entries = []
+        if len(chunks) <= 1 or SCAN_WORKERS <= 1:
+            for chunk_entries, errors in map(_scan_chunk, chunks):
+                entries.extend(chunk_entries)
+                self._log_scan_errors(errors)
+        else:
+            with ProcessPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+                for chunk_entries, errors in executor.map(_scan_chunk, chunks):
+                    entries.extend(chunk_entries)
+                    self._log_scan_errors(errors)
+        
+        entries.sort(key=lambda e: e["path"])
+        return entries
+    
+    def collect_cuda_entries(self) -> List[Dict]:
         self.logger.info(f"Start scanning directory: {self.source_dir}")
         
-        all_cuda_files = []
-        for ext in CUDA_EXTENSIONS:
-            pattern = f"**/*{ext}"
-            files = list(self.source_dir.rglob(pattern))
-            
-            for file_path in files:
-                abs_path = str(file_path.absolute())
-                all_cuda_files.append(abs_path)
-                self.logger.debug(f"Found file: {abs_path}")
-        
-        all_cuda_files.sort()
+        all_cuda_files = self.walk_cuda_files()
         self.logger.info(f"Total found {len(all_cuda_files)} CUDA files")
         
-        for file_path in all_cuda_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    if '__global__' in content:
-                        cuda_files.append(file_path)
-                        self.logger.debug(f"Keep file with __global__: {file_path}")
-            except UnicodeDecodeError:
-                try:
-                    with open(file_path, 'r', encoding='latin-1') as f:
-                        content = f.read()
-                        if '__global__' in content:
-                            cuda_files.append(file_path)
-                            self.logger.debug(f"Keep file with __global__: {file_path}")
-                except Exception as e:
-                    self.logger.warning(f"Cannot read file, skip: {file_path}, error: {e}")
-            except Exception as e:
-                self.logger.warning(f"Cannot read file, skip: {file_path}, error: {e}")
-        
-        self.logger.info(f"After filtering, kept {len(cuda_files)}/{len(all_cuda_files)} CUDA files with __global__")
+        entries = self.scan_files(all_cuda_files)
+        self.logger.info(f"After filtering, kept {len(entries)}/{len(all_cuda_files)} CUDA files with __global__")
         
-        return cuda_files
+        return entries
     
-    def generate_inventory(self) -> Dict:
-        cuda_files = self.collect_cuda_files()
+    def collect_cuda_files(self) -> List[str]:
+        return [entry["path"] for entry in self.collect_cuda_entries()]
+    
+    def generate_inventory(self, entries: Optional[List[Dict]] = None) -> Dict:
+        if entries is None:
+            entries = self.collect_cuda_entries()
         
         inventory = {
             "source_directory": str(self.source_dir),
-            "total_files": len(cuda_files),
+            "total_files": len(entries),
             "filtered_by_global": True,
-            "files": cuda_files
+            "files": [entry["path"] for entry in entries],
+            "entries": entries
         }
         
         return inventory
     
-    def save_inventory(self) -> str:
+    def save_inventory(self, entries: Optional[List[Dict]] = None) -> str:
+        # entries: an already scanned list (the streaming pipeline), sorted by path like scan_files
         self.output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        inventory = self.generate_inventory()
+        inventory = self.generate_inventory(entries)
         
         with open(self.output_path, 'w', encoding='utf-8') as f:
             json.dump(inventory, f, indent=2, ensure_ascii=False)
+        # A later --delta scan diffs each checkout against the commit scanned now
+        self.save_scan_state({'repos': self._repo_heads(self.git_repos), 'files': {}})
         
         self.logger.info(f"File inventory saved to: {self.output_path}")
         self.logger.info(f"Total files: {inventory['total_files']}")
@@ -84,6 +208,293 @@ class FileCollector:
         
         return str(self.output_path)
     
+    @staticmethod
+    def load_scan_state() -> Dict:
+        if not os.path.exists(SCAN_STATE_PATH):
+            return {'repos': {}, 'files': {}}
+        with open(SCAN_STATE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    @staticmethod
+    def save_scan_state(state: Dict) -> None:
+        tmp_path = f"{SCAN_STATE_PATH}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, SCAN_STATE_PATH)
+    
+    def _repo_heads(self, repos: Iterable[str]) -> Dict[str, str]:
+        heads = {}
+        for repo in sorted(repos):
+            try:
+                heads[repo] = _git(repo, "rev-parse", "HEAD").strip()
+            except (OSError, subprocess.CalledProcessError) as e:
+                self.logger.warning(f"Cannot read git HEAD, compare by size/mtime: {repo}, error: {e}")
+        return heads
+    
+    def iter_scan_roots(self) -> Iterator[Tuple[str, str]]:
+        # ('repo', path) for each git checkout, which is not descended into, and ('file', path) for CUDA files outside
+        extensions = tuple(CUDA_EXTENSIONS)
+        ignored = set(IGNORED_DIRECTORIES)
+        
+        stack = [str(self.source_dir.absolute())]
+        while stack:
+            current_dir = stack.pop()
+            try:
+                with os.scandir(current_dir) as it:
+                    entries = list(it)
+            except OSError as e:
+                self.logger.warning(f"Cannot scan directory, skip: {current_dir}, error: {e}")
+                continue
+            if any(entry.name == '.git' for entry in entries):
+                yield 'repo', current_dir
+                # Submodule files are invisible to the parent's diff; each checked-out submodule is its own root
+                if any(entry.name == '.gitmodules' for entry in entries):
+                    stack.extend(self._submodule_dirs(current_dir))
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in ignored:
+                            stack.append(entry.path)
+                    elif entry.name.endswith(extensions) and entry.is_file():
+                        yield 'file', entry.path
+                except OSError as e:
+                    self.logger.warning(f"Cannot stat entry, skip: {entry.path}, error: {e}")
+    
+    def _submodule_dirs(self, repo: str) -> List[str]:
+        try:
+            output = _git(repo, "config", "-z", "-f", ".gitmodules", "--get-regexp", r"\.path$")
+        except (OSError, subprocess.CalledProcessError):
+            return []
+        dirs = []
+        for record in output.split('\0'):
+            if '\n' in record:
+                path = os.path.join(repo, record.split('\n', 1)[1])
+                if os.path.exists(os.path.join(path, '.git')):
+                    dirs.append(path)
+        return dirs
+    
+    def _in_ignored_directory(self, file_path: str) -> bool:
+        ignored = set(IGNORED_DIRECTORIES)
+        relative = os.path.relpath(file_path, self.source_dir.absolute())
+        return any(part in ignored for part in Path(relative).parts[:-1])
+    
+    def _git_paths(self, repo: str, names: Iterable[str]) -> List[str]:
+        paths = (os.path.normpath(os.path.join(repo, name)) for name in names if name)
+        return [path for path in paths if not self._in_ignored_directory(path)]
+    
+    def _git_list(self, repo: str, *args: str) -> List[str]:
+        pathspecs = [f"*{ext}" for ext in CUDA_EXTENSIONS]
+        return self._git_paths(repo, _git(repo, "ls-files", "-z", *args, "--", *pathspecs).split('\0'))
+    
+    def _git_delta(self, repo: str, base: Optional[str]) -> Optional[Tuple[List[str], Set[str], List[Tuple[str, str]]]]:
+        # (changed, deleted, renamed) between base and the working tree, or None when base is unknown or
+        # no longer exists (e.g. after a force push)
+        if not base:
+            return None
+        try:
+            _git(repo, "cat-file", "-e", f"{base}^{{commit}}")
+        except subprocess.CalledProcessError:
+            self.logger.warning(f"Last scanned commit {base[:12]} is gone, compare by size/mtime: {repo}")
+            return None
+        
+        pathspecs = [f"*{ext}" for ext in CUDA_EXTENSIONS]
+        fields = _git(repo, "diff", "--name-status", "-z", "-M", base, "--", *pathspecs).split('\0')
+        changed, deleted, renamed = [], set(), []
+        i = 0
+        while i < len(fields) - 1:
+            status = fields[i][:1]
+            if status in ('R', 'C'):
+                old_path, new_path = (os.path.normpath(os.path.join(repo, name)) for name in fields[i + 1:i + 3])
+                i += 3
+            else:
+                old_path, new_path = None, os.path.normpath(os.path.join(repo, fields[i + 1]))
+                i += 2
+            if status == 'R':
+                deleted.add(old_path)
+                renamed.append((old_path, new_path))
+            if status == 'D':
+                deleted.add(new_path)
+            else:
+                changed.append(new_path)
+        
+        changed = [path for path in changed if not self._in_ignored_directory(path)]
+        renamed = [(old_path, new_path) for old_path, new_path in renamed if not self._in_ignored_directory(new_path)]
+        return changed, deleted, renamed
+    
+    def _containing_repo(self, file_path: str, repos: Set[str]) -> Optional[str]:
+        root = str(self.source_dir.absolute())
+        current = os.path.dirname(file_path)
+        while current.startswith(root):
+            if current in repos:
+                return current
+            parent = os.path.dirname(current)
+            if parent == current:
+                break
+            current = parent
+        return None
+    
+    def generate_delta_inventory(self, previous_inventory: Dict) -> Tuple[Dict, Dict, Dict]:
+        # Returns (delta inventory, updated full inventory, scan state). Checkouts with a known base commit
+        # are diffed by git; everything else (non-git directories, untracked files, new checkouts) is
+        # compared with the size/mtime recorded by the previous scan
+        state = self.load_scan_state()
+        previous = {entry['path']: entry for entry in previous_inventory.get('entries', [])}
+        last_stats = state.get('files', {})
+        
+        repos, stat_checked = [], []
+        for kind, path in self.iter_scan_roots():
+            (repos if kind == 'repo' else stat_checked).append(path)
+        heads = self._repo_heads(repos)
+        
+        rescan, git_deleted, renamed, listed = set(), set(), [], []
+        diffed = set()
+        for repo in repos:
+            delta = None
+            try:
+                if repo in heads:
+                    delta = self._git_delta(repo, state.get('repos', {}).get(repo))
+                    if delta is None:
+                        # New checkout or lost base: its files are compared with the previous inventory
+                        listed.extend(self._git_list(repo, "--cached"))
+                    stat_checked.extend(self._git_list(repo, "--others", "--exclude-standard"))
+                    if delta is None:
+                        continue
+            except (OSError, subprocess.CalledProcessError) as e:
+                self.logger.warning(f"git failed, compare by size/mtime: {repo}, error: {e}")
+                delta = None
+            if delta is None:
+                stat_checked.extend(FileCollector(repo, self.output_path).iter_cuda_files())
+                continue
+            changed, deleted, moved = delta
+            rescan.update(changed)
+            git_deleted.update(deleted)
+            renamed.extend(moved)
+            diffed.add(repo)
+        
+        files = {}
+        tracked = set(listed)
+        for path in stat_checked + listed:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if path not in tracked:
+                files[path] = [stat.st_size, stat.st_mtime]
+            last = previous.get(path)
+            last_stat = [last['size'], last['mtime']] if last else last_stats.get(path)
+            if last_stat != [stat.st_size, stat.st_mtime]:
+                rescan.add(path)
+        seen = set(stat_checked) | tracked | rescan
+        
+        self.scan_errors = set()
+        scanned = {entry['path']: entry for entry in self.scan_files(sorted(rescan))}
+        
+        deleted = set()
+        for path in previous:
+            repo = self._containing_repo(path, diffed)
+            if repo is not None:
+                # Inside a diffed checkout git reports deletions; untracked files were tracked by size/mtime
+                gone = path in git_deleted or (path in last_stats and path not in seen)
+            else:
+                gone = path not in seen
+            if path in rescan and path not in scanned and path not in self.scan_errors:
+                gone = True  # no __global__ left, or removed after git listed it
+            if gone:
+                deleted.add(path)
+        
+        changed_entries = [
+            entry for path, entry in sorted(scanned.items())
+            if previous.get(path, {}).get('sha256') != entry['sha256']
+        ]
+        renamed = [
+            {'from': old_path, 'to': new_path} for old_path, new_path in renamed
+            if old_path in deleted and new_path in scanned
+        ]
+        
+        entries = {path: entry for path, entry in previous.items() if path not in deleted}
+        entries.update(scanned)
+        inventory = {
+            "source_directory": str(self.source_dir),
+            "total_files": len(entries),
+            "filtered_by_global": True,
+            "files": sorted(entries),
+            "entries": [entries[path] for path in sorted(entries)]
+        }
+        delta = {
+            "source_directory": str(self.source_dir),
+            "delta": True,
+            "total_files": len(changed_entries),
+            "files": [entry['path'] for entry in changed_entries],
+            "entries": changed_entries,
+            "deleted": sorted(deleted),
+            "renamed": renamed,
+            "git_repos": len(repos),
+            "diffed_repos": len(diffed)
+        }
+        return delta, inventory, {'repos': heads, 'files': files}
+    
+    @staticmethod
+    def merge_delta(pending: Dict, delta: Dict, inventory: Dict) -> Dict:
+        # Folds a delta that step 2 has not processed yet into the new one; a rename chain a -> b -> c becomes a -> c
+        entries = {entry['path']: entry for entry in inventory.get('entries', [])}
+        changed = sorted(path for path in set(pending.get('files', [])) | set(delta['files']) if path in entries)
+        deleted = (set(pending.get('deleted', [])) | set(delta['deleted'])) - set(entries)
+        moved_to = {}
+        for rename in pending.get('renamed', []) + delta['renamed']:
+            moved_to[rename['to']] = moved_to.pop(rename['from'], rename['from'])
+        changed_set = set(changed)
+        return dict(
+            delta,
+            total_files=len(changed),
+            files=changed,
+            entries=[entries[path] for path in changed],
+            deleted=sorted(deleted),
+            renamed=[{'from': old_path, 'to': new_path} for new_path, old_path in sorted(moved_to.items())
+                     if old_path in deleted and new_path in changed_set]
+        )
+    
+    @classmethod
+    def pending_delta(cls, delta_path: str) -> Optional[Dict]:
+        if not os.path.exists(delta_path):
+            return None
+        delta = cls.load_inventory(delta_path)
+        return None if delta.get('consumed') else delta
+    
+    @staticmethod
+    def mark_delta_consumed(delta_path: str) -> None:
+        # Called by step 2 --delta once it has processed the delta; until then step 1 --delta keeps merging into it
+        with open(delta_path, 'r', encoding='utf-8') as f:
+            delta = json.load(f)
+        delta['consumed'] = True
+        tmp_path = f"{delta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(delta, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, delta_path)
+    
+    def save_delta_inventory(self, delta_path: str = DELTA_INVENTORY_PATH) -> str:
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        previous_inventory = self.load_inventory(self.output_path) if self.output_path.exists() else {}
+        delta, inventory, state = self.generate_delta_inventory(previous_inventory)
+        pending = self.pending_delta(delta_path)
+        if pending is not None:
+            delta = self.merge_delta(pending, delta, inventory)
+            self.logger.info(f"Merged the delta inventory step 2 has not processed yet: {delta_path}")
+        
+        with open(delta_path, 'w', encoding='utf-8') as f:
+            json.dump(delta, f, indent=2, ensure_ascii=False)
+        with open(self.output_path, 'w', encoding='utf-8') as f:
+            json.dump(inventory, f, indent=2, ensure_ascii=False)
+        # Written last: if anything above fails, the next run diffs from the old base again
+        self.save_scan_state(state)
+        
+        self.logger.info(f"Delta inventory saved to: {delta_path}")
+        self.logger.info(f"Changed: {delta['total_files']}, deleted: {len(delta['deleted'])}, "
+                         f"renamed: {len(delta['renamed'])} ({delta['diffed_repos']}/{delta['git_repos']} "
+                         f"git checkouts diffed)")
+        return delta_path
+    
     @staticmethod
     def load_inventory(inventory_path: str) -> Dict:
         with open(inventory_path, 'r', encoding='utf-8') as f:
@@ -91,6 +502,11 @@ class FileCollector:
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Scan CUDA files and write the file inventory')
+    parser.add_argument('--delta', action='store_true',
+                        help='Only list files added, changed, renamed or deleted since the last scan')
+    
+    args = parser.parse_args()
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -104,7 +520,8 @@ def main():
     try:
         collector = FileCollector(SOURCE_DIRECTORY, FILE_INVENTORY_PATH)
         
-        output_path = collector.save_inventory()
+        with MetricsRecorder(METRICS_PATH).stage_timer("step1_collect", delta=args.delta):
+            output_path = collector.save_delta_inventory() if args.delta else collector.save_inventory()
         
         logger.info("=" * 60)
         logger.info(f"✓ Step 1 completed! File inventory saved: {output_path}")
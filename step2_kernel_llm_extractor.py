@@ -1,28 +1,92 @@
 import os
+import copy
 import json
 import time
+import asyncio
 import logging
-from pathlib import Path
-from typing import Dict, List, Optional
+import argparse
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from config_project import (
-    FILE_INVENTORY_PATH, EXTRACTION_RESULTS_DIR, MAX_WORKERS,
-    SYSTEM_PROMPT_PATH, TASK_PROMPT_PATH
+    FILE_INVENTORY_PATH, DELTA_INVENTORY_PATH, EXTRACTION_RESULTS_DIR, MAX_WORKERS,
+    ASYNC_EXTRACTION, MAX_CONCURRENT_REQUESTS,
+    SYSTEM_PROMPT_PATH, TASK_PROMPT_PATH, PROMPT_TEMPLATE_VERSION,
+    LLM_CACHE_ENABLED, LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, EXTRACTION_LEDGER_PATH,
+    LOCAL_EXTRACTION_ENABLED, SLICE_THRESHOLD_CHARS, SLICE_MAX_PARALLEL, VALIDATION_ENABLED,
+    PACKING_ENABLED, PACKED_TASK_PROMPT_PATH, PACK_MAX_FILE_CHARS, PACK_MAX_CHARS, PACK_MAX_FILES,
+    STREAMING_ENABLED, CONTINUATION_PROMPT_PATH, MAX_CONTINUATIONS, METRICS_PATH,
+    SOURCE_DEDUP_ENABLED, SOURCE_DEDUP_THRESHOLD, PROMPT_CACHE_LAYOUT, PROMPT_INPUT_MARKER, LLM_PROVIDER,
+    LPT_SCHEDULING, TOKEN_BUDGETING, OUTPUT_TOKEN_HEADROOM, MIN_OUTPUT_TOKENS
 )
 from template import prompt_loader
 from step1_cu_file_collector import FileCollector
+from llm_router import LLMRouter, create_generator, resolve_llm_config
 from llm_generator import LLMGenerator
+from llm_providers.base_provider import LLMProviderError, LLMResponse
+from response_cache import ResponseCache
+from extraction_ledger import ExtractionLedger, file_content_hash
+from result_store import ResultStore, result_store_path
+from local_kernel_extractor import LocalKernelExtractor, CudaSourceAnalyzer
+from kernel_validator import KernelValidator
+from prompt_slicer import PromptSlicer
+from json_stream import KernelStream
+from response_parser import parse_kernel_response, parse_packed_response, FILE_RESULT_SCHEMA, PACKED_RESULT_SCHEMA
+from telemetry import MetricsRecorder
+from dedup_index import DedupIndex
+from token_budget import TokenBudget
+
+
+def is_partial_result(result: Dict) -> bool:
+    return bool(result.get('incomplete_kernels') or result.get('invalid_kernels')
+                or result.get('truncated') or result.get('recovered'))
 
 
 class LLMExtractor:
     
-    def __init__(self, llm_config: Dict):
+    TRUNCATED_FINISH_REASONS = ("length", "max_tokens")
+    
+    def __init__(self, llm_config: Dict, metrics: Optional[MetricsRecorder] = None,
+                 cache_enabled: bool = LLM_CACHE_ENABLED, local_extraction: bool = LOCAL_EXTRACTION_ENABLED,
+                 ledger_path: str = EXTRACTION_LEDGER_PATH, source_dedup: bool = SOURCE_DEDUP_ENABLED,
+                 validation: bool = VALIDATION_ENABLED,
+                 on_kernel: Optional[Callable[[str, Dict], None]] = None, cache_eviction: bool = True):
         self.logger = logging.getLogger(__name__)
+        self.metrics = metrics or MetricsRecorder(METRICS_PATH)
+        self.source_dedup = source_dedup
+        
+        cache = None
+        if cache_enabled:
+            cache = ResponseCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, PROMPT_TEMPLATE_VERSION,
+                                  track_size=cache_eviction)
+            self.logger.info(f"LLM response cache enabled: {LLM_CACHE_DIR}")
         
-        self.generator = LLMGenerator(llm_config)
+        self.cache = cache
+        self.generator = create_generator(llm_config, cache=cache)
+        self.max_tokens = llm_config.get('max_tokens', 4096)
+        self.budget = TokenBudget(OUTPUT_TOKEN_HEADROOM, MIN_OUTPUT_TOKENS)
+        # Requests estimated above threshold_tokens (input + output) go to this endpoint instead
+        self.large_context = llm_config.get('large_context')
+        self._large_generator = None
+        self._large_generator_lock = threading.Lock()
+        self.model_id = llm_config.get('model_id', '')
+        self.ledger = ExtractionLedger(ledger_path)
+        self._result_stores: Dict[str, ResultStore] = {}
+        self._result_stores_lock = threading.Lock()
+        self.local_extractor = LocalKernelExtractor() if local_extraction else None
+        self.validator = KernelValidator() if validation else None
+        # Called with (file_path, kernel) for every streamed kernel as soon as its JSON object is complete
+        self.on_kernel = on_kernel
+        self.slicer = PromptSlicer(SLICE_THRESHOLD_CHARS)
         self.system_prompt = prompt_loader.load_prompt(SYSTEM_PROMPT_PATH)
         self.task_prompt_template = prompt_loader.load_prompt(TASK_PROMPT_PATH)
+        self.packed_prompt_template = prompt_loader.load_prompt(PACKED_TASK_PROMPT_PATH)
+        self.continuation_prompt_template = prompt_loader.load_prompt(CONTINUATION_PROMPT_PATH)
+        self.packed_system_prompt = self.system_prompt
+        if PROMPT_CACHE_LAYOUT:
+            self._use_prefix_cache_layout()
         
         self.logger.info(f"LLM extractor initialized, model: {llm_config.get('model_id')}")
     
@@ -48,94 +112,944 @@ class LLMExtractor:
         
         return filtered
     
+    def _use_prefix_cache_layout(self) -> None:
+        # Single-file, slice, repair and continuation requests share one system prefix, packed requests another
+        task_instructions, self.task_prompt_template = prompt_loader.split_prompt(
+            self.task_prompt_template, PROMPT_INPUT_MARKER)
+        packed_instructions, self.packed_prompt_template = prompt_loader.split_prompt(
+            self.packed_prompt_template, PROMPT_INPUT_MARKER)
+        base_system_prompt = self.system_prompt
+        if task_instructions:
+            self.system_prompt = f"{base_system_prompt}\n\n{task_instructions}"
+        if packed_instructions:
+            self.packed_system_prompt = f"{base_system_prompt}\n\n{packed_instructions}"
+    
+    def _build_prompt(self, file_path: str, code_content: str) -> str:
+        return self.task_prompt_template.format(
+            file_path=file_path,
+            code_content=code_content
+        )
+    
+    def _get_large_generator(self) -> Union[LLMGenerator, LLMRouter]:
+        with self._large_generator_lock:
+            if self._large_generator is None:
+                self._large_generator = create_generator(self.large_context, cache=self.cache)
+                self.logger.info(f"Large-context endpoint for requests above "
+                                 f"{self.large_context['threshold_tokens']} tokens: {self.large_context.get('model_id')}")
+            return self._large_generator
+    
+    def _request_plan(self, *codes: str) -> Tuple[Union[LLMGenerator, LLMRouter], Optional[int]]:
+        # Picks the endpoint and output budget for one request from local token estimates
+        if not TOKEN_BUDGETING and not self.large_context:
+            return self.generator, None
+        input_tokens, output_tokens = self.budget.estimate_all(codes)
+        generator, limit = self.generator, self.max_tokens
+        if self.large_context and input_tokens + output_tokens > self.large_context['threshold_tokens']:
+            generator, limit = self._get_large_generator(), self.large_context.get('max_tokens', self.max_tokens)
+        return generator, self.budget.max_tokens(output_tokens, limit) if TOKEN_BUDGETING else None
+    
+    def _discard_cached(self, system_message: str, cache_content: str, max_tokens: Optional[int] = None,
+                        response_schema: Dict = FILE_RESULT_SCHEMA) -> None:
+        self.generator.discard_cached(system_message, cache_content, max_tokens, response_schema)
+        if self._large_generator is not None:
+            self._large_generator.discard_cached(system_message, cache_content, max_tokens, response_schema)
+    
+    def _record_request(self, file_path: str, request_kind: str, response: Optional[LLMResponse] = None,
+                        parse_outcome: Optional[str] = None, kernels: int = 0,
+                        error: Optional[LLMProviderError] = None, max_tokens: Optional[int] = None) -> None:
+        fields = {'file': file_path, 'request_kind': request_kind, 'parse_outcome': parse_outcome, 'kernels': kernels}
+        if max_tokens is not None:
+            fields['max_tokens'] = max_tokens
+        if response is not None:
+            fields.update(
+                queue_wait=response.queue_wait, latency=response.latency, retries=response.retries,
+                input_tokens=response.input_tokens, output_tokens=response.output_tokens,
+                cached_input_tokens=response.cached_input_tokens, endpoint=response.endpoint,
+                finish_reason=response.finish_reason, cached=response.cached, hedged=response.hedged
+            )
+        if error is not None:
+            fields.update(error=str(error)[:200], status_code=error.status_code)
+        self.metrics.record('request', **fields)
+    
+    def _parse_response(self, file_path: str, result_text: Optional[str], cache_content: str,
+                        max_tokens: Optional[int] = None) -> Tuple[Optional[Dict], str]:
+        if not result_text:
+            self.logger.error(f"✗ Empty response: {file_path}")
+            return None, 'parse_failed'
+        
+        result, outcome = parse_kernel_response(result_text)
+        if result is None:
+            self.logger.error(f"✗ JSON parse failed: {file_path}")
+            self._discard_cached(self.system_prompt, cache_content, max_tokens)
+            self.logger.debug(f"Raw response: {result_text[:500]}...")
+            return None, 'parse_failed'
+        
+        if outcome == 'recovered':
+            # Only the complete kernel objects survived; the next run asks again
+            self._discard_cached(self.system_prompt, cache_content, max_tokens)
+            self.logger.warning(f"Broken JSON, recovered {len(result['kernels'])} complete kernels: {file_path}")
+        elif outcome == 'repaired':
+            self.logger.debug(f"Repaired malformed JSON response: {file_path}")
+        
+        result['source_file'] = file_path
+        result['extraction_method'] = 'llm'
+        
+        self.logger.info(f"✓ Successfully extracted {len(result.get('kernels', []))} kernels: {file_path}")
+        return result, outcome
+    
+    def _extract_locally(self, file_path: str, code_content: str) -> Optional[Dict]:
+        if self.local_extractor is None:
+            return None
+        
+        try:
+            result, issues = self.local_extractor.extract(file_path, code_content)
+        except Exception as e:
+            self.logger.warning(f"Local extraction crashed, fall back to LLM: {file_path}, error: {e}")
+            return None
+        
+        if result is None:
+            self.logger.debug(f"Local extraction not confident, fall back to LLM: {file_path}, "
+                              f"reasons: {'; '.join(issues[:3])}")
+            return None
+        
+        self.logger.info(f"✓ Locally extracted {len(result['kernels'])} kernels: {file_path}")
+        return result
+    
+    def _continuation_prompt(self, file_path: str, code_content: str, extracted: List[str]) -> Tuple[str, str]:
+        names = '\n'.join(f"- {name}" for name in extracted) or "- (none)"
+        prompt = self.continuation_prompt_template.format(extracted_kernels=names) + \
+            self._build_prompt(file_path, code_content)
+        # Continuations are cached separately from the first, truncated round
+        return prompt, code_content + "\n// continuation after: " + ",".join(extracted)
+    
+    def _stream_round_done(self, file_path: str, stream: KernelStream, response: LLMResponse) -> bool:
+        truncated = response.finish_reason in self.TRUNCATED_FINISH_REASONS or (
+            stream.parser.array_found and not stream.parser.array_closed
+        )
+        if truncated:
+            self.logger.warning(f"Response truncated after {len(stream.kernels)} kernels, "
+                                f"request continuation: {file_path}")
+        return not truncated
+    
+    def _streamed_result(self, file_path: str, kernels: List[Dict], complete: bool) -> Dict:
+        result = {
+            'source_file': file_path,
+            'kernels': kernels,
+            'extraction_method': 'llm'
+        }
+        if not complete:
+            result['truncated'] = True
+        self.logger.info(f"✓ Successfully extracted {len(kernels)} kernels (streamed): {file_path}")
+        return result
+    
+    def _kernel_sink(self, file_path: str, code_content: str) -> Optional[Callable[[Dict], None]]:
+        # Kernels that pass the structural checks go to on_kernel while their response is still streaming
+        if self.on_kernel is None:
+            return None
+        analyzer = []
+        
+        def on_kernel(kernel: Dict) -> None:
+            if self.validator is not None:
+                if not analyzer:
+                    analyzer.append(CudaSourceAnalyzer(code_content))
+                if self.validator.kernel_issues(kernel, analyzer[0]):
+                    return
+            try:
+                self.on_kernel(file_path, kernel)
+            except Exception as e:
+                self.logger.warning(f"Streamed kernel handler failed: {file_path}, error: {e}")
+        return on_kernel
+    
+    def _stream_rounds(self, file_path: str, code_content: str, request_kind: str):
+        # Round and continuation logic shared by the sync and async streaming requests. Yields
+        # (generator, prompt, stream, cache_content, max_tokens) for every round and expects the round's
+        # LLMResponse, or the LLMProviderError it raised, to be sent back; returns the result
+        stream = KernelStream(self._kernel_sink(file_path, code_content))
+        prompt, cache_content = self._build_prompt(file_path, code_content), code_content
+        # Continuations stay on the same endpoint; their size is unknown, so they get its full max_tokens
+        generator, max_tokens = self._request_plan(code_content)
+        
+        for round_index in range(MAX_CONTINUATIONS + 1):
+            kernels_before = len(stream.kernels)
+            response = yield generator, prompt, stream, cache_content, max_tokens
+            if isinstance(response, LLMProviderError):
+                self.logger.error(f"✗ LLM request failed: {file_path}, status: {response.status_code}, "
+                                  f"error: {response}")
+                self._record_request(file_path, request_kind, error=response, max_tokens=max_tokens)
+                return self._streamed_result(file_path, stream.kernels, False) if stream.kernels else None
+            
+            if round_index == 0 and not stream.parser.array_found:
+                # No kernels array in the stream at all: let the regular parser report it
+                result, outcome = self._parse_response(file_path, stream.parser.text, code_content, max_tokens)
+                self._record_request(file_path, request_kind, response, outcome,
+                                     len(result.get('kernels', [])) if result else 0, max_tokens=max_tokens)
+                return result
+            
+            complete = self._stream_round_done(file_path, stream, response)
+            new_kernels = len(stream.kernels) - kernels_before
+            if not complete:
+                # The array can stay open without a max_tokens finish reason; such a round must not be replayed
+                self._discard_cached(self.system_prompt, cache_content, max_tokens)
+            self._record_request(file_path, request_kind, response, 'ok' if complete else 'truncated', new_kernels,
+                                 max_tokens=max_tokens)
+            request_kind, max_tokens = 'continuation', None
+            if complete:
+                return self._streamed_result(file_path, stream.kernels, True)
+            if round_index > 0 and new_kernels == 0:
+                break
+            
+            prompt, cache_content = self._continuation_prompt(
+                file_path, code_content, [k.get('func_name', '') for k in stream.kernels]
+            )
+        
+        return self._streamed_result(file_path, stream.kernels, False) if stream.kernels else None
+    
+    def _request_kernels_streaming(self, file_path: str, code_content: str, request_kind: str = 'file') -> Optional[Dict]:
+        rounds = self._stream_rounds(file_path, code_content, request_kind)
+        request = next(rounds)
+        while True:
+            generator, prompt, stream, cache_content, max_tokens = request
+            try:
+                response = generator.complete_stream(
+                    prompt, self.system_prompt, stream, cache_content=cache_content, response_schema=FILE_RESULT_SCHEMA,
+                    max_tokens=max_tokens
+                )
+            except LLMProviderError as e:
+                response = e
+            try:
+                request = rounds.send(response)
+            except StopIteration as done:
+                return done.value
+    
+    async def _arequest_kernels_streaming(self, file_path: str, code_content: str,
+                                          request_kind: str = 'file') -> Optional[Dict]:
+        rounds = self._stream_rounds(file_path, code_content, request_kind)
+        request = next(rounds)
+        while True:
+            generator, prompt, stream, cache_content, max_tokens = request
+            try:
+                response = await generator.acomplete_stream(
+                    prompt, self.system_prompt, stream, cache_content=cache_content, response_schema=FILE_RESULT_SCHEMA,
+                    max_tokens=max_tokens
+                )
+            except LLMProviderError as e:
+                response = e
+            try:
+                request = rounds.send(response)
+            except StopIteration as done:
+                return done.value
+    
+    def _request_kernels(self, file_path: str, code_content: str, request_kind: str = 'file') -> Optional[Dict]:
+        if STREAMING_ENABLED:
+            return self._request_kernels_streaming(file_path, code_content, request_kind)
+        
+        prompt = self._build_prompt(file_path, code_content)
+        
+        self.logger.debug(f"Call LLM API, file: {file_path}")
+        
+        generator, max_tokens = self._request_plan(code_content)
+        try:
+            # Cache on the code alone: vendored copies of one file share a cached response
+            response = generator.complete(prompt, self.system_prompt, cache_content=code_content,
+                                          response_schema=FILE_RESULT_SCHEMA, max_tokens=max_tokens)
+        except LLMProviderError as e:
+            self.logger.error(f"✗ LLM request failed: {file_path}, status: {e.status_code}, error: {e}")
+            self._record_request(file_path, request_kind, error=e, max_tokens=max_tokens)
+            return None
+        
+        result, outcome = self._parse_response(file_path, response.text, code_content, max_tokens)
+        self._record_request(file_path, request_kind, response, outcome,
+                             len(result.get('kernels', [])) if result else 0, max_tokens=max_tokens)
+        return result
+    
+    async def _arequest_kernels(self, file_path: str, code_content: str, request_kind: str = 'file') -> Optional[Dict]:
+        if STREAMING_ENABLED:
+            return await self._arequest_kernels_streaming(file_path, code_content, request_kind)
+        
+        prompt = self._build_prompt(file_path, code_content)
+        
+        self.logger.debug(f"Call LLM API (async), file: {file_path}")
+        
+        generator, max_tokens = self._request_plan(code_content)
+        try:
+            response = await generator.acomplete(prompt, self.system_prompt, cache_content=code_content,
+                                                 response_schema=FILE_RESULT_SCHEMA, max_tokens=max_tokens)
+        except LLMProviderError as e:
+            self.logger.error(f"✗ LLM request failed: {file_path}, status: {e.status_code}, error: {e}")
+            self._record_request(file_path, request_kind, error=e, max_tokens=max_tokens)
+            return None
+        
+        result, outcome = self._parse_response(file_path, response.text, code_content, max_tokens)
+        self._record_request(file_path, request_kind, response, outcome,
+                             len(result.get('kernels', [])) if result else 0, max_tokens=max_tokens)
+        return result
+    
+    def _merge_unit_results(self, file_path: str, units: List[Tuple[str, str]],
+                            unit_results: List[Optional[Dict]]) -> Optional[Dict]:
+        kernels = []
+        seen = set()
+        incomplete = []
+        
+        for (kernel_name, _), unit_result in zip(units, unit_results):
+            if unit_result is None:
+                incomplete.append(kernel_name)
+                continue
+            for kernel in unit_result.get('kernels', []):
+                key = (kernel.get('func_name'), kernel.get('func_signature'))
+                if key not in seen:
+                    seen.add(key)
+                    kernels.append(kernel)
+        
+        if len(incomplete) == len(units):
+            return None
+        
+        result = {
+            'source_file': file_path,
+            'kernels': kernels,
+            'extraction_method': 'llm_sliced'
+        }
+        if incomplete:
+            result['incomplete_kernels'] = incomplete
+            self.logger.warning(f"Sliced extraction incomplete: {file_path}, failed kernels: {incomplete}")
+        
+        self.logger.info(f"✓ Merged {len(kernels)} kernels from {len(units)} slices: {file_path}")
+        return result
+    
+    def _slice(self, file_path: str, code_content: str) -> Optional[List[Tuple[str, str]]]:
+        units = self.slicer.slice(code_content)
+        if units:
+            self.logger.info(f"Sliced large file into {len(units)} kernel units: {file_path}")
+        return units
+    
     def extract_kernels_from_file(self, file_path: str) -> Optional[Dict]:
         self.logger.info(f"Start processing file: {file_path}")
         
         try:
             code_content = self.read_file_content(file_path)
             
-            prompt = self.task_prompt_template.format(
-                file_path=file_path,
-                code_content=code_content
-            )
+            local_result = self._extract_locally(file_path, code_content)
+            if local_result is not None:
+                return local_result
             
-            self.logger.debug(f"Call LLM API, file: {file_path}")
+            units = self._slice(file_path, code_content)
+            if not units:
+                return self._request_kernels(file_path, code_content)
             
-            result_text = self.generator.generate(prompt, self.system_prompt)
+            with ThreadPoolExecutor(max_workers=min(len(units), SLICE_MAX_PARALLEL)) as executor:
+                unit_results = list(executor.map(
+                    lambda unit: self._request_kernels(file_path, unit[1]), units
+                ))
+            return self._merge_unit_results(file_path, units, unit_results)
+            
+        except Exception as e:
+            self.logger.error(f"✗ Extraction failed: {file_path}, error: {e}", exc_info=True)
+            return None
+    
+    async def _arequest_units(self, file_path: str, unit_codes: List[str],
+                              request_kind: str = 'file') -> List[Optional[Dict]]:
+        # The file holds one slot of the batch semaphore; like the thread pool of the sync path, its slices never
+        # have more than SLICE_MAX_PARALLEL requests in flight
+        limiter = asyncio.Semaphore(SLICE_MAX_PARALLEL)
+        
+        async def request(unit_code: str) -> Optional[Dict]:
+            async with limiter:
+                return await self._arequest_kernels(file_path, unit_code, request_kind)
+        
+        return await asyncio.gather(*[request(unit_code) for unit_code in unit_codes])
+    
+    async def aextract_kernels_from_file(self, file_path: str) -> Optional[Dict]:
+        self.logger.info(f"Start processing file: {file_path}")
+        
+        try:
+            code_content = await asyncio.to_thread(self.read_file_content, file_path)
             
-            if not result_text:
-                self.logger.error(f"✗ Empty response: {file_path}")
-                return None
+            local_result = self._extract_locally(file_path, code_content)
+            if local_result is not None:
+                return local_result
             
-            if result_text.startswith("```"):
-                lines = result_text.split('\n')
-                if lines[0].startswith("```"):
-                    lines = lines[1:]
-                if lines and lines[-1].strip() == "```":
-                    lines = lines[:-1]
-                result_text = '\n'.join(lines)
+            units = self._slice(file_path, code_content)
+            if not units:
+                return await self._arequest_kernels(file_path, code_content)
             
-            result = json.loads(result_text)
+            unit_results = await self._arequest_units(file_path, [unit_code for _, unit_code in units])
+            return self._merge_unit_results(file_path, units, unit_results)
             
-            self.logger.info(f"✓ Successfully extracted {len(result.get('kernels', []))} kernels: {file_path}")
+        except Exception as e:
+            self.logger.error(f"✗ Extraction failed: {file_path}, error: {e}", exc_info=True)
+            return None
+    
+    def _plan_repairs(self, file_path: str, result: Optional[Dict]) -> Optional[Tuple[CudaSourceAnalyzer, Dict[str, str]]]:
+        if result is None or self.validator is None or result.get('extraction_method') == 'local':
+            return None
+        
+        source = CudaSourceAnalyzer(self.read_file_content(file_path))
+        missing, broken = self.validator.validate(result, source)
+        if not missing and not broken:
+            return None
+        
+        self.logger.warning(f"Validation failed: {file_path}, missing: {missing}, "
+                            f"broken: {'; '.join(f'{name}: {issues[0]}' for name, issues in broken.items())}")
+        units = self.validator.repair_units(source, missing + list(broken))
+        for unit_code in units.values():
+            # A sliced file already asked for this exact unit; do not get the same answer back
+            self._discard_cached(self.system_prompt, unit_code, self._request_plan(unit_code)[1])
+        return source, units
+    
+    def _apply_repairs(self, file_path: str, result: Dict, source: CudaSourceAnalyzer, units: Dict[str, str],
+                       unit_results: List[Optional[Dict]]) -> Dict:
+        kernels = list(result.get('kernels', []))
+        for kernel_name, unit_result in zip(units, unit_results):
+            if unit_result is None:
+                continue
+            replacements = [
+                kernel for kernel in unit_result.get('kernels', [])
+                if kernel.get('func_name') == kernel_name and not self.validator.kernel_issues(kernel, source)
+            ]
+            if replacements:
+                kernels = [kernel for kernel in kernels if kernel.get('func_name') != kernel_name] + replacements
+        
+        result = dict(result, kernels=kernels)
+        result.pop('invalid_kernels', None)
+        missing, broken = self.validator.validate(result, source)
+        if not source.structural_issues:
+            result.pop('incomplete_kernels', None)
+        if missing:
+            result['incomplete_kernels'] = missing
+        if broken:
+            result['invalid_kernels'] = broken
+        
+        if missing or broken:
+            self.logger.warning(f"Repair incomplete: {file_path}, still missing: {missing}, still broken: {list(broken)}")
+        else:
+            self.logger.info(f"✓ Repaired {len(units)} kernels: {file_path}")
+        return result
+    
+    def _validate_result(self, file_path: str, result: Optional[Dict]) -> Optional[Dict]:
+        try:
+            plan = self._plan_repairs(file_path, result)
+        except Exception as e:
+            self.logger.warning(f"Validation crashed, keep result as is: {file_path}, error: {e}")
+            return result
+        if plan is None:
+            return result
+        
+        source, units = plan
+        unit_results = []
+        if units:
+            with ThreadPoolExecutor(max_workers=min(len(units), SLICE_MAX_PARALLEL)) as executor:
+                unit_results = list(executor.map(
+                    lambda unit_code: self._request_kernels(file_path, unit_code, 'repair'), units.values()
+                ))
+        return self._apply_repairs(file_path, result, source, units, unit_results)
+    
+    async def _avalidate_result(self, file_path: str, result: Optional[Dict]) -> Optional[Dict]:
+        try:
+            plan = await asyncio.to_thread(self._plan_repairs, file_path, result)
+        except Exception as e:
+            self.logger.warning(f"Validation crashed, keep result as is: {file_path}, error: {e}")
             return result
+        if plan is None:
+            return result
+        
+        source, units = plan
+        unit_results = await self._arequest_units(file_path, list(units.values()), 'repair')
+        return self._apply_repairs(file_path, result, source, units, unit_results)
+    
+    def _build_packed_prompt(self, file_paths: List[str], contents: Dict[str, str]) -> Tuple[str, Dict[str, str]]:
+        blocks = []
+        id_to_path = {}
+        for i, file_path in enumerate(file_paths, 1):
+            file_id = f"file_{i}"
+            id_to_path[file_id] = file_path
+            blocks.append(f"File id: {file_id}\n\n```cuda\n{contents[file_path]}\n```\n")
+        
+        prompt = self.packed_prompt_template.format(files_content='\n'.join(blocks))
+        return prompt, id_to_path
+    
+    def _parse_packed_response(self, result_text: Optional[str], id_to_path: Dict[str, str], cache_content: str,
+                               max_tokens: Optional[int] = None) -> Tuple[Dict[str, Dict], str]:
+        if not result_text:
+            self.logger.error(f"✗ Empty packed response for {len(id_to_path)} files")
+            return {}, 'parse_failed'
+        
+        packed, outcome = parse_packed_response(result_text)
+        if packed is None:
+            self.logger.error(f"✗ Packed JSON parse failed for {len(id_to_path)} files")
+            self._discard_cached(self.packed_system_prompt, cache_content, max_tokens, PACKED_RESULT_SCHEMA)
+            return {}, 'parse_failed'
+        if outcome == 'recovered':
+            # Files whose entry was lost go out on their own like any other file the pack missed
+            self._discard_cached(self.packed_system_prompt, cache_content, max_tokens, PACKED_RESULT_SCHEMA)
+        
+        results = {}
+        for entry in packed.get('results', []):
+            file_path = id_to_path.get(str(entry.get('source_file', '')).strip())
+            if file_path is None:
+                continue
+            results[file_path] = {
+                'source_file': file_path,
+                'kernels': entry.get('kernels', []),
+                'extraction_method': 'llm_packed'
+            }
+        
+        self.logger.info(f"✓ Packed request returned {len(results)}/{len(id_to_path)} files")
+        return results, outcome
+    
+    def _request_packed(self, file_paths: List[str], contents: Dict[str, str]) -> Dict[str, Dict]:
+        prompt, id_to_path = self._build_packed_prompt(file_paths, contents)
+        generator, max_tokens = self._request_plan(*(contents[file_path] for file_path in file_paths))
+        try:
+            response = generator.complete(prompt, self.packed_system_prompt, cache_content=prompt,
+                                      response_schema=PACKED_RESULT_SCHEMA, max_tokens=max_tokens)
+        except LLMProviderError as e:
+            self.logger.error(f"✗ Packed LLM request failed for {len(file_paths)} files, status: {e.status_code}, error: {e}")
+            self._record_request(','.join(file_paths), 'pack', error=e, max_tokens=max_tokens)
+            return {}
+        results, outcome = self._parse_packed_response(response.text, id_to_path, prompt, max_tokens)
+        self._record_request(','.join(file_paths), 'pack', response, outcome,
+                             sum(len(r['kernels']) for r in results.values()), max_tokens=max_tokens)
+        return results
+    
+    async def _arequest_packed(self, file_paths: List[str], contents: Dict[str, str]) -> Dict[str, Dict]:
+        prompt, id_to_path = self._build_packed_prompt(file_paths, contents)
+        generator, max_tokens = self._request_plan(*(contents[file_path] for file_path in file_paths))
+        try:
+            response = await generator.acomplete(prompt, self.packed_system_prompt, cache_content=prompt,
+                                             response_schema=PACKED_RESULT_SCHEMA, max_tokens=max_tokens)
+        except LLMProviderError as e:
+            self.logger.error(f"✗ Packed LLM request failed for {len(file_paths)} files, status: {e.status_code}, error: {e}")
+            self._record_request(','.join(file_paths), 'pack', error=e, max_tokens=max_tokens)
+            return {}
+        results, outcome = self._parse_packed_response(response.text, id_to_path, prompt, max_tokens)
+        self._record_request(','.join(file_paths), 'pack', response, outcome,
+                             sum(len(r['kernels']) for r in results.values()), max_tokens=max_tokens)
+        return results
+    
+    def _read_pack(self, file_paths: List[str]) -> Tuple[Dict[str, str], Dict[str, Dict], List[str]]:
+        contents = {}
+        results = {}
+        remaining = []
+        for file_path in file_paths:
+            try:
+                contents[file_path] = self.read_file_content(file_path)
+            except Exception as e:
+                self.logger.error(f"✗ Read failed: {file_path}, error: {e}")
+                continue
+            local_result = self._extract_locally(file_path, contents[file_path])
+            if local_result is not None:
+                results[file_path] = local_result
+            else:
+                remaining.append(file_path)
+        return contents, results, remaining
+    
+    def extract_kernels_from_pack(self, file_paths: List[str]) -> List[Tuple[str, Optional[Dict]]]:
+        self.logger.info(f"Start processing pack of {len(file_paths)} small files")
+        
+        contents, results, remaining = self._read_pack(file_paths)
+        
+        if len(remaining) > 1:
+            results.update(self._request_packed(remaining, contents))
+        
+        # Files the packed response missed (or a lone leftover) go out on their own
+        for file_path in remaining:
+            if file_path not in results:
+                results[file_path] = self._request_kernels(file_path, contents[file_path])
+        
+        return [(file_path, results.get(file_path)) for file_path in file_paths]
+    
+    async def aextract_kernels_from_pack(self, file_paths: List[str]) -> List[Tuple[str, Optional[Dict]]]:
+        self.logger.info(f"Start processing pack of {len(file_paths)} small files")
+        
+        contents, results, remaining = await asyncio.to_thread(self._read_pack, file_paths)
+        
+        if len(remaining) > 1:
+            results.update(await self._arequest_packed(remaining, contents))
+        
+        missing = [file_path for file_path in remaining if file_path not in results]
+        fallback = await asyncio.gather(*[
+            self._arequest_kernels(file_path, contents[file_path]) for file_path in missing
+        ])
+        results.update(zip(missing, fallback))
+        
+        return [(file_path, results.get(file_path)) for file_path in file_paths]
+    
+    def _record_files(self, item_results: List[Tuple[str, Optional[Dict]]], elapsed: float) -> None:
+        for file_path, result in item_results:
+            self.metrics.record(
+                'file', file=file_path, elapsed=elapsed, pack_size=len(item_results),
+                kernels=len(result.get('kernels', [])) if result else 0,
+                method=result.get('extraction_method') if result else None,
+                status='ok' if result else 'failed'
+            )
+    
+    def _run_work_item(self, file_paths: List[str]) -> List[Tuple[str, Optional[Dict]]]:
+        started_at = time.perf_counter()
+        if len(file_paths) == 1:
+            item_results = [(file_paths[0], self.extract_kernels_from_file(file_paths[0]))]
+        else:
+            item_results = self.extract_kernels_from_pack(file_paths)
+        item_results = [(file_path, self._validate_result(file_path, result)) for file_path, result in item_results]
+        self._record_files(item_results, time.perf_counter() - started_at)
+        return item_results
+    
+    async def _arun_work_item(self, file_paths: List[str]) -> List[Tuple[str, Optional[Dict]]]:
+        started_at = time.perf_counter()
+        if len(file_paths) == 1:
+            item_results = [(file_paths[0], await self.aextract_kernels_from_file(file_paths[0]))]
+        else:
+            item_results = await self.aextract_kernels_from_pack(file_paths)
+        validated = await asyncio.gather(*[self._avalidate_result(file_path, result) for file_path, result in item_results])
+        item_results = [(file_path, result) for (file_path, _), result in zip(item_results, validated)]
+        self._record_files(item_results, time.perf_counter() - started_at)
+        return item_results
+    
+    def _result_store(self, output_dir: str) -> ResultStore:
+        with self._result_stores_lock:
+            if output_dir not in self._result_stores:
+                self._result_stores[output_dir] = ResultStore(result_store_path(output_dir))
+            return self._result_stores[output_dir]
+    
+    def _store_result(self, file_path: str, content_hash: str, result: Optional[Dict],
+                      output_dir: str, error: Optional[str] = None) -> bool:
+        if result is None:
+            self.ledger.record(file_path, content_hash, self.model_id, PROMPT_TEMPLATE_VERSION,
+                               ExtractionLedger.STATUS_FAILED, error=error)
+            return False
+        
+        store = self._result_store(output_dir)
+        store.put(file_path, content_hash, result, self.model_id, PROMPT_TEMPLATE_VERSION)
+        output_path = str(store.db_path)
+        
+        # Partial results are kept but retried next run; their good slices come back from the cache
+        status = ExtractionLedger.STATUS_PARTIAL if is_partial_result(result) else ExtractionLedger.STATUS_SUCCESS
+        self.ledger.record(file_path, content_hash, self.model_id, PROMPT_TEMPLATE_VERSION,
+                           status, output_path=output_path)
+        self.logger.debug(f"Extraction result saved: {output_path}")
+        return True
+    
+    def remove_sources(self, file_paths: List[str], output_dir: str) -> int:
+        # Deleted sources: step 3 removes their kernels once their results are gone from the store
+        store = self._result_store(output_dir)
+        removed = 0
+        for file_path in file_paths:
+            removed += store.delete(file_path)
+            self.ledger.remove(file_path)
+        return removed
+    
+    def _is_done(self, file_path: str, content_hash: str, output_dir: Optional[str]) -> bool:
+        if self.ledger.is_done(file_path, content_hash, self.model_id, PROMPT_TEMPLATE_VERSION):
+            return True
+        if output_dir is None:
+            return False
+        # Results stored by other processes (distributed workers keep their own ledgers) are adopted into this ledger
+        store = self._result_store(output_dir)
+        entry = store.get_entry(file_path)
+        if (entry is None or entry['content_hash'] != content_hash or entry['model'] != self.model_id
+                or entry['template_version'] != PROMPT_TEMPLATE_VERSION or is_partial_result(entry['result'])):
+            return False
+        self.ledger.record(file_path, content_hash, self.model_id, PROMPT_TEMPLATE_VERSION,
+                           ExtractionLedger.STATUS_SUCCESS, output_path=str(store.db_path))
+        return True
+    
+    def move_results(self, renames: List[Dict], known_entries: Dict[str, Dict], output_dir: str) -> int:
+        # A renamed file whose content is unchanged takes over its old result instead of a new request
+        store = self._result_store(output_dir)
+        moved = 0
+        for rename in renames:
+            old_path, new_path = rename['from'], rename['to']
+            entry = known_entries.get(new_path)
+            if entry is None or not self._is_done(old_path, entry['sha256'], output_dir):
+                continue
+            result = store.get(old_path)
+            if result is None:
+                continue
+            result['source_file'] = new_path
+            self._store_result(new_path, entry['sha256'], result, output_dir)
+            moved += 1
+        return moved
+    
+    def _prefilter(self, file_paths: List[str], known_entries: Dict[str, Dict]) -> List[str]:
+        # Inventory entries were already filtered for __global__ by step 1
+        unknown = [p for p in file_paths if p not in known_entries]
+        if not unknown:
+            return list(file_paths)
+        kept = set(self._filter_files_with_kernels(unknown))
+        return [p for p in file_paths if p in known_entries or p in kept]
+    
+    def _content_hash(self, file_path: str, known_entries: Dict[str, Dict]) -> str:
+        entry = known_entries.get(file_path)
+        if entry is not None:
+            stat = os.stat(file_path)
+            if stat.st_size == entry.get('size') and stat.st_mtime == entry.get('mtime'):
+                return entry['sha256']
+        return file_content_hash(file_path)
+    
+    def _plan_batch(self, file_paths: List[str], resume: bool, known_entries: Dict[str, Dict],
+                    output_dir: Optional[str] = None) -> Tuple[List[str], Dict[str, str]]:
+        pending = []
+        content_hashes = {}
+        counts = Counter()
+        
+        for file_path in file_paths:
+            try:
+                content_hash = self._content_hash(file_path, known_entries)
+            except Exception as e:
+                self.logger.warning(f"Hash failed, skip: {file_path}, error: {e}")
+                continue
+            content_hashes[file_path] = content_hash
             
-        except json.JSONDecodeError as e:
-            self.logger.error(f"✗ JSON parse failed: {file_path}, error: {e}")
-            self.logger.debug(f"Raw response: {result_text[:500]}...")
+            plan = self._plan_file(file_path, content_hash, resume, output_dir)
+            counts[plan] += 1
+            if plan != 'skipped':
+                pending.append(file_path)
+        
+        self.logger.info(f"Resume plan: {counts['skipped']} up to date, {counts['retried']} retry failed, "
+                         f"{counts['changed']} changed, {counts['new']} new")
+        return pending, content_hashes
+    
+    def _plan_file(self, file_path: str, content_hash: str, resume: bool, output_dir: Optional[str] = None) -> str:
+        if not resume:
+            return 'new'
+        if self._is_done(file_path, content_hash, output_dir):
+            return 'skipped'
+        entry = self.ledger.get(file_path)
+        if entry is None:
+            return 'new'
+        if entry.get('status') != ExtractionLedger.STATUS_SUCCESS:
+            return 'retried'
+        return 'changed'
+    
+    def needs_extraction(self, file_path: str, content_hash: str, resume: bool = True,
+                         output_dir: Optional[str] = None) -> bool:
+        return self._plan_file(file_path, content_hash, resume, output_dir) != 'skipped'
+    
+    def iter_work_items(self, sized_paths: Iterable[Tuple[str, int]]) -> Iterator[List[str]]:
+        # Packs are flushed as soon as they fill up, so a streaming caller never waits for the whole list
+        pack, pack_chars = [], 0
+        for file_path, size in sized_paths:
+            if not PACKING_ENABLED or size > PACK_MAX_FILE_CHARS:
+                yield [file_path]
+                continue
+            if pack and (pack_chars + size > PACK_MAX_CHARS or len(pack) >= PACK_MAX_FILES):
+                yield pack
+                pack, pack_chars = [], 0
+            pack.append(file_path)
+            pack_chars += size
+        if pack:
+            yield pack
+    
+    def _file_cost(self, file_path: str, known_entries: Dict[str, Dict]) -> float:
+        entry = known_entries.get(file_path)
+        if entry is not None and 'kernels' in entry:
+            return TokenBudget.work_cost(entry['size'], entry['kernels'])
+        try:
+            return TokenBudget.work_cost(os.path.getsize(file_path), 1)
+        except OSError:
+            return 0.0
+    
+    def _order_longest_first(self, work_items: List[List[str]], known_entries: Dict[str, Dict]) -> List[List[str]]:
+        # Longest-processing-time first: the biggest items start early and the small ones fill the gaps
+        costs = [sum(self._file_cost(file_path, known_entries) for file_path in item) for item in work_items]
+        order = sorted(range(len(work_items)), key=lambda i: costs[i], reverse=True)
+        if order:
+            self.logger.info(f"Longest-first order: {len(order)} work items, estimated cost "
+                             f"{costs[order[0]]:.0f} (first) to {costs[order[-1]]:.0f} (last)")
+        return [work_items[i] for i in order]
+    
+    def _group_work_items(self, file_paths: List[str], known_entries: Dict[str, Dict]) -> List[List[str]]:
+        if not PACKING_ENABLED:
+            work_items = [[file_path] for file_path in file_paths]
+        else:
+            sized_paths = (
+                (file_path, known_entries[file_path]['size'] if file_path in known_entries else os.path.getsize(file_path))
+                for file_path in file_paths
+            )
+            work_items = list(self.iter_work_items(sized_paths))
+            
+            packed_files = sum(len(item) for item in work_items if len(item) > 1)
+            self.logger.info(f"Packing: {len(file_paths)} files -> {len(work_items)} work items "
+                             f"({packed_files} small files packed)")
+        
+        if LPT_SCHEDULING:
+            work_items = self._order_longest_first(work_items, known_entries)
+        return work_items
+    
+    def new_source_dedup_index(self) -> Optional[DedupIndex]:
+        return DedupIndex(SOURCE_DEDUP_THRESHOLD) if self.source_dedup else None
+    
+    def match_duplicate_source(self, dedup: Optional[DedupIndex], file_path: str) -> Optional[str]:
+        if dedup is None:
             return None
+        try:
+            match = dedup.add(file_path, self.read_file_content(file_path))
         except Exception as e:
-            self.logger.error(f"✗ Extraction failed: {file_path}, error: {e}", exc_info=True)
+            self.logger.warning(f"Dedup read failed, dispatch as is: {file_path}, error: {e}")
             return None
+        return match[0] if match else None
+    
+    def _dedup_sources(self, file_paths: List[str]) -> Tuple[List[str], Dict[str, List[str]]]:
+        dedup = self.new_source_dedup_index()
+        if dedup is None:
+            return file_paths, {}
+        
+        canonicals = []
+        duplicates = {}
+        for file_path in file_paths:
+            canonical = self.match_duplicate_source(dedup, file_path)
+            if canonical is None:
+                canonicals.append(file_path)
+            else:
+                duplicates.setdefault(canonical, []).append(file_path)
+        
+        copies = sum(len(paths) for paths in duplicates.values())
+        self.logger.info(f"Source dedup: {copies} duplicate files share the result of {len(duplicates)} canonical files")
+        return canonicals, duplicates
+    
+    def copy_duplicate_results(self, item_results: List[Tuple[str, Optional[Dict]]],
+                               duplicates: Dict[str, List[str]]) -> List[Tuple[str, Optional[Dict]]]:
+        # Duplicates inherit the canonical file's outcome, including failure, so both are retried together
+        expanded = list(item_results)
+        for file_path, result in item_results:
+            for duplicate_path in duplicates.get(file_path, ()):
+                duplicate = None
+                if result is not None:
+                    duplicate = copy.deepcopy(result)
+                    duplicate['source_file'] = duplicate_path
+                    duplicate['duplicate_of'] = file_path
+                expanded.append((duplicate_path, duplicate))
+                self.metrics.record(
+                    'file', file=duplicate_path, elapsed=0.0, pack_size=1,
+                    kernels=len(duplicate.get('kernels', [])) if duplicate else 0,
+                    method='duplicate', status='ok' if duplicate else 'failed'
+                )
+        return expanded
     
-    def extract_batch(self, file_paths: List[str], output_dir: str) -> Dict[str, Dict]:
+    def _prepare_batch(self, file_paths: List[str], output_dir: str, resume: bool,
+                       inventory_entries: Optional[List[Dict]]) -> Tuple[List[List[str]], Dict[str, str], Dict[str, List[str]]]:
         os.makedirs(output_dir, exist_ok=True)
         
-        filtered_paths = self._filter_files_with_kernels(file_paths)
+        known_entries = {entry['path']: entry for entry in inventory_entries or []}
+        filtered_paths = self._prefilter(file_paths, known_entries)
         
         self.logger.info(f"Pre-filter result: {len(filtered_paths)}/{len(file_paths)} files contain kernels")
         
+        pending_paths, content_hashes = self._plan_batch(filtered_paths, resume, known_entries, output_dir)
+        pending_paths, duplicates = self._dedup_sources(pending_paths)
+        return self._group_work_items(pending_paths, known_entries), content_hashes, duplicates
+    
+    def _handle_item_results(self, item_results: List[Tuple[str, Optional[Dict]]], content_hashes: Dict[str, str],
+                             output_dir: str, results: Dict[str, Dict]) -> Tuple[int, int]:
+        success_count = fail_count = 0
+        for file_path, result in item_results:
+            try:
+                if self._store_result(file_path, content_hashes[file_path], result, output_dir):
+                    results[file_path] = result
+                    success_count += 1
+                else:
+                    fail_count += 1
+            except Exception as e:
+                self.logger.error(f"Processing failed: {file_path}, error: {e}")
+                fail_count += 1
+        return success_count, fail_count
+    
+    async def aprocess_work_item(self, work_item: List[str], content_hashes: Dict[str, str], output_dir: str,
+                                 claim_duplicates: Optional[Callable[[List[str]], Dict[str, List[str]]]] = None
+                                 ) -> List[Tuple[str, Optional[Dict]]]:
+        try:
+            item_results = await self._arun_work_item(work_item)
+        except Exception as e:
+            self.logger.error(f"Processing failed: {work_item}, error: {e}")
+            item_results = [(file_path, None) for file_path in work_item]
+        
+        # Streaming callers keep attaching duplicates while the request is in flight, so they are claimed only now
+        if claim_duplicates is not None:
+            item_results = self.copy_duplicate_results(item_results, claim_duplicates(work_item))
+        stored = {}
+        self._handle_item_results(item_results, content_hashes, output_dir, stored)
+        return [(file_path, stored.get(file_path)) for file_path, _ in item_results]
+    
+    def extract_batch(self, file_paths: List[str], output_dir: str, resume: bool = True,
+                      inventory_entries: Optional[List[Dict]] = None,
+                      max_workers: int = MAX_WORKERS) -> Dict[str, Dict]:
+        work_items, content_hashes, duplicates = self._prepare_batch(file_paths, output_dir, resume, inventory_entries)
+        
         results = {}
         success_count = 0
         fail_count = 0
         
-        self.logger.info(f"Start batch extraction, total {len(filtered_paths)} files, max workers: {MAX_WORKERS}")
+        self.logger.info(f"Start batch extraction, total {len(work_items)} work items, max workers: {max_workers}")
         
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_file = {
-                executor.submit(self.extract_kernels_from_file, file_path): file_path
-                for file_path in filtered_paths
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_item = {
+                executor.submit(self._run_work_item, work_item): work_item
+                for work_item in work_items
             }
             
-            for future in as_completed(future_to_file):
-                file_path = future_to_file[future]
+            for future in as_completed(future_to_item):
+                work_item = future_to_item[future]
                 
                 try:
-                    result = future.result()
-                    
-                    if result is not None:
-                        results[file_path] = result
-                        success_count += 1
-                        
-                        output_filename = Path(file_path).stem + ".json"
-                        output_path = os.path.join(output_dir, output_filename)
-                        
-                        with open(output_path, 'w', encoding='utf-8') as f:
-                            json.dump(result, f, indent=2, ensure_ascii=False)
-                        
-                        self.logger.debug(f"Extraction result saved: {output_path}")
-                    else:
-                        fail_count += 1
-                        
+                    item_results = future.result()
                 except Exception as e:
-                    self.logger.error(f"Processing failed: {file_path}, error: {e}")
-                    fail_count += 1
+                    self.logger.error(f"Processing failed: {work_item}, error: {e}")
+                    item_results = [(file_path, None) for file_path in work_item]
+                
+                item_results = self.copy_duplicate_results(item_results, duplicates)
+                item_success, item_fail = self._handle_item_results(item_results, content_hashes, output_dir, results)
+                success_count += item_success
+                fail_count += item_fail
         
         self.logger.info(f"Batch extraction completed: success {success_count}, failed {fail_count}")
+        self._log_endpoint_stats()
+        return results
+    
+    def _log_endpoint_stats(self) -> None:
+        for stats in self.generator.endpoint_stats():
+            self.logger.info(f"Endpoint: {stats}")
+        if self._large_generator is not None:
+            for stats in self._large_generator.endpoint_stats():
+                self.logger.info(f"Large-context endpoint: {stats}")
+    
+    async def aextract_batch(self, file_paths: List[str], output_dir: str, resume: bool = True,
+                             inventory_entries: Optional[List[Dict]] = None,
+                             max_concurrency: int = MAX_CONCURRENT_REQUESTS) -> Dict[str, Dict]:
+        work_items, content_hashes, duplicates = self._prepare_batch(file_paths, output_dir, resume, inventory_entries)
+        
+        results = {}
+        success_count = 0
+        fail_count = 0
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        self.logger.info(f"Start async batch extraction, total {len(work_items)} work items, "
+                         f"max in-flight requests: {max_concurrency}")
+        
+        async def run_one(work_item: List[str]):
+            async with semaphore:
+                try:
+                    return await self._arun_work_item(work_item)
+                except Exception as e:
+                    self.logger.error(f"Processing failed: {work_item}, error: {e}")
+                    return [(file_path, None) for file_path in work_item]
+        
+        tasks = [asyncio.create_task(run_one(work_item)) for work_item in work_items]
+        
+        for next_done in asyncio.as_completed(tasks):
+            item_results = self.copy_duplicate_results(await next_done, duplicates)
+            item_success, item_fail = self._handle_item_results(item_results, content_hashes, output_dir, results)
+            success_count += item_success
+            fail_count += item_fail
+        
+        self.logger.info(f"Async batch extraction completed: success {success_count}, failed {fail_count}")
+        self._log_endpoint_stats()
         return results
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Extract kernels from the inventoried CUDA files with the LLM')
+    parser.add_argument('--delta', action='store_true',
+                        help='Process the delta inventory of step 1 --delta: changed files, renames and deletions')
+    
+    args = parser.parse_args()
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -150,11 +1064,12 @@ def main():
         with open("config_llm.json", "r", encoding="utf-8") as f:
             config = json.load(f)
         
-        llm_config = config["providers"]["openai"]
+        llm_config = resolve_llm_config(config, LLM_PROVIDER)
         logger.info(f"Loaded LLM config: {llm_config.get('model_id')}")
         
-        logger.info(f"Load file inventory: {FILE_INVENTORY_PATH}")
-        inventory = FileCollector.load_inventory(FILE_INVENTORY_PATH)
+        inventory_path = DELTA_INVENTORY_PATH if args.delta else FILE_INVENTORY_PATH
+        logger.info(f"Load file inventory: {inventory_path}")
+        inventory = FileCollector.load_inventory(inventory_path)
         file_paths = inventory['files']
         # TODO: remove this after testing
         # file_paths = file_paths[:3]  # only test the first 3 files
@@ -164,17 +1079,34 @@ def main():
         extractor = LLMExtractor(llm_config)
         
         start_time = time.time()
-        results = extractor.extract_batch(file_paths, EXTRACTION_RESULTS_DIR)
+        inventory_entries = inventory.get('entries')
+        if args.delta:
+            # Renames first: they need the old path's ledger entry, which removing the deleted paths drops
+            known_entries = {entry['path']: entry for entry in inventory_entries}
+            moved = extractor.move_results(inventory['renamed'], known_entries, EXTRACTION_RESULTS_DIR)
+            removed = extractor.remove_sources(inventory['deleted'], EXTRACTION_RESULTS_DIR)
+            logger.info(f"Delta: {moved} renamed files kept their results, {removed} results of deleted files removed")
+        with extractor.metrics.stage_timer("step2_extract", files=len(file_paths)):
+            if ASYNC_EXTRACTION:
+                results = asyncio.run(extractor.aextract_batch(
+                    file_paths, EXTRACTION_RESULTS_DIR, inventory_entries=inventory_entries
+                ))
+            else:
+                results = extractor.extract_batch(file_paths, EXTRACTION_RESULTS_DIR, inventory_entries=inventory_entries)
+        if args.delta:
+            # The next step 1 --delta starts a fresh delta instead of merging into this one
+            FileCollector.mark_delta_consumed(inventory_path)
         elapsed_time = time.time() - start_time
         
         total_kernels = sum(len(r.get('kernels', [])) for r in results.values())
         
         logger.info("=" * 60)
         logger.info(f"✓ Step 2 completed!")
-        logger.info(f"  - Processed files: {len(results)}/{len(file_paths)}")
+        logger.info(f"  - Extracted this run: {len(results)}/{len(file_paths)}")
         logger.info(f"  - Total extracted kernels: {total_kernels}")
         logger.info(f"  - Time elapsed: {elapsed_time:.2f} seconds")
         logger.info(f"  - Results saved to: {EXTRACTION_RESULTS_DIR}")
+        extractor.metrics.log_summary(logger)
         logger.info("=" * 60)
         
     except Exception as e:
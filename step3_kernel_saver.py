@@ -1,150 +1,258 @@
 import os
-import json
 import logging
 import re
+import hashlib
+import threading
 from pathlib import Path
-from typing import Dict, List, Set
-from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
-from config_project import EXTRACTION_RESULTS_DIR, EXTRACTED_KERNELS_DIR
+from config_project import EXTRACTION_RESULTS_DIR, EXTRACTED_KERNELS_DIR, METRICS_PATH, SAVE_WORKERS
+from kernel_index import KernelIndex
+from result_store import ResultStore, result_store_path
+from telemetry import MetricsRecorder
+from step4_clean_pytorch_headers import keep_rule_headers
+
+
+def render_kernel(func_content: str, content_filter: Optional[Callable[[str], str]] = None) -> str:
+    # Without a filter every include is dropped; a filter (see step 4) decides about the includes itself
+    if content_filter is None:
+        return re.sub(r'#include\s+.*', '', func_content, flags=re.MULTILINE)
+    return content_filter(func_content)
 
 
 class KernelSaver:
     
-    def __init__(self, extraction_dir: str, output_dir: str):
+    LOAD_CHUNK_SIZE = 256
+    
+    def __init__(self, extraction_dir: str, output_dir: str,
+                 content_filter: Optional[Callable[[str], str]] = None, max_workers: int = SAVE_WORKERS):
         self.extraction_dir = Path(extraction_dir)
         self.output_dir = Path(output_dir)
+        self.content_filter = content_filter
+        self.max_workers = max_workers
         self.logger = logging.getLogger(__name__)
         
         if not self.extraction_dir.exists():
             raise ValueError(f"Extraction results directory does not exist: {self.extraction_dir}")
         
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.index = KernelIndex(self.output_dir / "kernel_manifest.json")
+        self.store = ResultStore(result_store_path(str(self.extraction_dir)))
+        # Output files written by save_streamed_kernel that save_result has not recorded yet, per source
+        self._streamed: Dict[str, Dict[str, str]] = {}
+        self._streamed_lock = threading.Lock()
     
     def sanitize_filename(self, name: str) -> str:
         sanitized = re.sub(r'[<>:"/\\|?*]', '_', name)
         sanitized = re.sub(r'_+', '_', sanitized)
         return sanitized
     
-    def check_name_conflicts(self, extraction_results: List[Dict]) -> Dict[str, List[str]]:
-        name_to_sources = defaultdict(list)
-        
-        for result in extraction_results:
-            source_file = result.get('source_file', 'unknown')
-            for kernel in result.get('kernels', []):
-                func_name = kernel.get('func_name', '')
-                if func_name:
-                    name_to_sources[func_name].append(source_file)
-        
-        conflicts = {
-            name: sources for name, sources in name_to_sources.items()
-            if len(sources) > 1
-        }
+    def _render_kernel(self, func_content: str) -> str:
+        return render_kernel(func_content, self.content_filter)
+    
+    def _is_unchanged(self, output_path: Path, content_hash: str, previous_hash: Optional[str]) -> bool:
+        if not output_path.exists():
+            return False
+        if previous_hash is not None:
+            return previous_hash == content_hash
+        # Outputs written before the index existed are compared on disk once
+        return hashlib.sha256(output_path.read_bytes()).hexdigest() == content_hash
+    
+    def _plan_result(self, result: Dict) -> Tuple[Dict[str, Dict], List[Tuple[str, Path, str]]]:
+        source_file = result.get('source_file', 'unknown')
+        previous = (self.index.get_source(source_file) or {}).get('kernels', {})
+        invalid = result.get('invalid_kernels', {})
+        with self._streamed_lock:
+            streamed = set(self._streamed.get(source_file, {}))
+        kernels = {}
+        writes = []
         
-        if conflicts:
-            self.logger.warning(f"Found {len(conflicts)} kernel name conflicts")
-            for name, sources in conflicts.items():
-                self.logger.warning(f"  - {name}: appears in {len(sources)} files")
+        for kernel in result.get('kernels', []):
+            func_name = kernel.get('func_name', '')
+            func_content = kernel.get('func_content', '')
+            
+            if not func_name or not func_content:
+                self.logger.warning(f"Skip invalid kernel: {func_name or '(unnamed)'}")
+                continue
+            if func_name in invalid:
+                self.logger.warning(f"Skip kernel that failed validation: {func_name} ({'; '.join(invalid[func_name])})")
+                continue
+            
+            output_filename, renamed = self.index.claim_output(
+                func_name, source_file, lambda name: f"{self.sanitize_filename(name)}.cu"
+            )
+            if renamed:
+                self.logger.debug(f"Conflict detected, generate unique name: {output_filename}")
+            output_path = self.output_dir / output_filename
+            
+            processed_content = self._render_kernel(func_content)
+            content_hash = hashlib.sha256(processed_content.encode('utf-8')).hexdigest()
+            kernels[output_filename] = {'func_name': func_name, 'sha256': content_hash, 'renamed': renamed}
+            
+            previous_kernel = previous.get(output_filename, {})
+            if previous_kernel.get('duplicate_of') and previous_kernel.get('sha256') == content_hash:
+                # Pruned by dedup_index.py; stays absent until its content changes
+                kernels[output_filename]['duplicate_of'] = previous_kernel['duplicate_of']
+                continue
+            # A streamed kernel is already on disk; its file is compared as written
+            previous_hash = None if output_filename in streamed else previous_kernel.get('sha256')
+            if not self._is_unchanged(output_path, content_hash, previous_hash):
+                writes.append((output_filename, output_path, processed_content))
         
-        return conflicts
-    
-    def generate_unique_filename(self, kernel_name: str, source_file: str, 
-                                 conflicts: Dict[str, List[str]]) -> str:
-        if kernel_name in conflicts:
-            source_name = Path(source_file).stem
-            unique_name = f"{source_name}_{kernel_name}"
-            self.logger.debug(f"Conflict detected, generate unique name: {unique_name}")
-        else:
-            unique_name = kernel_name
+        return kernels, writes
+    
+    def _write_kernel(self, output_path: Path, content: str) -> None:
+        tmp_path = output_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, output_path)
+    
+    def _finish_result(self, result: Dict, kernels: Dict[str, Dict], failed: Set[str],
+                       revision: Optional[int]) -> None:
+        source_file = result.get('source_file', 'unknown')
+        previous = (self.index.get_source(source_file) or {}).get('kernels', {})
+        for output_filename in failed:
+            # Keep the old record so the next run retries instead of deleting the old output
+            if output_filename in previous:
+                kernels[output_filename] = previous[output_filename]
+            else:
+                kernels.pop(output_filename, None)
+                self.index.release_output(output_filename, source_file)
         
-        return self.sanitize_filename(unique_name)
+        stale = self.index.update_source(source_file, kernels, len(result.get('kernels', [])), revision)
+        self._remove_outputs(stale)
+        # Streamed kernels the final result dropped (failed validation, renamed) are removed again
+        self.discard_streamed(source_file, keep=kernels)
+    
+    def save_streamed_kernel(self, source_file: str, kernel: Dict) -> Optional[str]:
+        # Writes one kernel while its source is still being extracted. Only new output files are written early;
+        # a kernel that replaces an existing output waits for save_result, which records everything in the index
+        func_name = kernel.get('func_name', '')
+        func_content = kernel.get('func_content', '')
+        if not func_name or not func_content:
+            return None
+        previous = (self.index.get_source(source_file) or {}).get('kernels', {})
+        output_filename, _ = self.index.claim_output(
+            func_name, source_file, lambda name: f"{self.sanitize_filename(name)}.cu"
+        )
+        if output_filename in previous:
+            return None
+        with self._streamed_lock:
+            self._streamed.setdefault(source_file, {})[output_filename] = func_name
+        self._write_kernel(self.output_dir / output_filename, self._render_kernel(func_content))
+        self.logger.info(f"✓ Saved streamed kernel: {output_filename}")
+        return output_filename
+    
+    def discard_streamed(self, source_file: str, keep: Optional[Dict[str, Dict]] = None) -> int:
+        # Drops the streamed outputs of a source whose extraction failed (or that its final result left out)
+        with self._streamed_lock:
+            streamed = self._streamed.pop(source_file, {})
+        removed = [output_filename for output_filename in streamed if output_filename not in (keep or {})]
+        for output_filename in removed:
+            self.index.release_output(output_filename, source_file, streamed[output_filename])
+        self._remove_outputs(removed)
+        return len(removed)
+    
+    def _remove_outputs(self, output_filenames: List[str]) -> None:
+        for output_filename in output_filenames:
+            # The index's reverse map: another source may have taken the file name over
+            if output_filename not in self.index.files:
+                (self.output_dir / output_filename).unlink(missing_ok=True)
+                self.logger.info(f"✓ Removed stale kernel: {output_filename}")
     
-    def load_extraction_results(self) -> List[Dict]:
-        results = []
+    def remove_deleted_sources(self, revisions: Dict[str, int]) -> int:
+        # Sources saved from the store whose result was dropped (the source file was deleted) lose their kernels;
+        # entries from before the store existed have no revision and are left alone
+        removed = [
+            source_file for source_file, entry in self.index.sources.items()
+            if 'result_revision' in entry and source_file not in revisions
+        ]
+        for source_file in removed:
+            self._remove_outputs(self.index.remove_source(source_file))
+            self.logger.info(f"✓ Removed kernels of deleted source: {source_file}")
+        return len(removed)
+    
+    def save_result(self, result: Dict, revision: Optional[int] = None) -> List[str]:
+        if revision is None:
+            revision = self.store.revision(result.get('source_file', 'unknown'))
+        kernels, writes = self._plan_result(result)
         
-        for json_file in self.extraction_dir.glob("*.json"):
+        failed = set()
+        for output_filename, output_path, content in writes:
             try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    result = json.load(f)
-                    results.append(result)
-                    self.logger.debug(f"Load extraction result: {json_file}")
+                self._write_kernel(output_path, content)
+                self.logger.info(f"✓ Saved kernel: {output_filename}")
             except Exception as e:
-                self.logger.error(f"Failed to load extraction result: {json_file}, error: {e}")
+                self.logger.error(f"✗ Failed to save kernel: {output_filename}, error: {e}")
+                failed.add(output_filename)
         
-        self.logger.info(f"Loaded {len(results)} extraction result files")
-        return results
+        self._finish_result(result, kernels, failed, revision)
+        return [str(self.output_dir / output_filename) for output_filename in kernels]
+    
+    def _changed_sources(self, revisions: Dict[str, int]) -> Tuple[List[str], int]:
+        # Only revisions are compared here; results are loaded for changed sources alone
+        changed = sorted(
+            source_file for source_file, revision in revisions.items()
+            if not self.index.result_unchanged(source_file, revision)
+        )
+        return changed, len(revisions) - len(changed)
     
     def save_kernels(self) -> Dict[str, any]:
-        extraction_results = self.load_extraction_results()
-        
-        if not extraction_results:
-            self.logger.warning("No extraction results found, skip saving")
-            return {
-                'total_files': 0,
-                'total_kernels': 0,
-                'saved_kernels': 0,
-                'conflicts': 0
-            }
-        
-        conflicts = self.check_name_conflicts(extraction_results)
+        revisions = self.store.revisions()
+        removed_sources = self.remove_deleted_sources(revisions)
+        changed, unchanged_results = self._changed_sources(revisions)
+        self.logger.info(f"Extraction results: {len(changed)} new or changed, {unchanged_results} unchanged, "
+                         f"{removed_sources} removed")
         
-        total_files = len(extraction_results)
-        total_kernels = 0
-        saved_kernels = 0
-        saved_files = []
+        stats = {
+            'total_files': len(changed),
+            'unchanged_files': unchanged_results,
+            'removed_files': removed_sources,
+            'total_kernels': 0,
+            'saved_kernels': 0,
+            'unchanged_kernels': 0,
+            'conflicts': 0
+        }
         
-        for result in extraction_results:
-            source_file = result.get('source_file', 'unknown')
-            kernels = result.get('kernels', [])
-            total_kernels += len(kernels)
-            
-            for kernel in kernels:
-                func_name = kernel.get('func_name', '')
-                func_content = kernel.get('func_content', '')
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Results are loaded chunk by chunk so memory does not grow with the corpus
+            for i in range(0, len(changed), self.LOAD_CHUNK_SIZE):
+                chunk = changed[i:i + self.LOAD_CHUNK_SIZE]
+                planned = []
+                for _, revision, result in self.store.get_many(chunk):
+                    kernels, writes = self._plan_result(result)
+                    futures = {
+                        output_filename: executor.submit(self._write_kernel, output_path, content)
+                        for output_filename, output_path, content in writes
+                    }
+                    planned.append((revision, result, kernels, futures))
                 
-                if not func_name or not func_content:
-                    self.logger.warning(f"Skip invalid kernel: {func_name or '(unnamed)'}")
-                    continue
-                
-                try:
-                    unique_filename = self.generate_unique_filename(
-                        func_name, source_file, conflicts
-                    )
-                    output_filename = f"{unique_filename}.cu"
-                    output_path = self.output_dir / output_filename
-
-                    processed_content = re.sub(r'#include\s+.*', '', func_content, flags=re.MULTILINE)
-
-                    with open(output_path, 'w', encoding='utf-8') as f:
-                        f.write(processed_content)
-                    
-                    saved_kernels += 1
-                    saved_files.append(str(output_path))
-                    self.logger.info(f"✓ Saved kernel: {output_filename}")
+                for revision, result, kernels, futures in planned:
+                    failed = set()
+                    for output_filename, future in futures.items():
+                        try:
+                            future.result()
+                            self.logger.info(f"✓ Saved kernel: {output_filename}")
+                        except Exception as e:
+                            self.logger.error(f"✗ Failed to save kernel: {output_filename}, error: {e}")
+                            failed.add(output_filename)
                     
-                except Exception as e:
-                    self.logger.error(f"✗ Failed to save kernel: {func_name}, error: {e}")
-        
-        manifest = {
-            'total_source_files': total_files,
-            'total_kernels_extracted': total_kernels,
-            'successfully_saved': saved_kernels,
-            'conflicts_detected': len(conflicts),
-            'saved_files': saved_files
-        }
+                    stats['total_kernels'] += len(result.get('kernels', []))
+                    stats['saved_kernels'] += len(futures) - len(failed)
+                    stats['unchanged_kernels'] += len(kernels) - len(futures)
+                    self._finish_result(result, kernels, failed, revision)
         
-        manifest_path = self.output_dir / "kernel_manifest.json"
-        with open(manifest_path, 'w', encoding='utf-8') as f:
-            json.dump(manifest, f, indent=2, ensure_ascii=False)
-        
-        self.logger.info(f"Kernel manifest saved: {manifest_path}")
-        
-        return {
-            'total_files': total_files,
-            'total_kernels': total_kernels,
-            'saved_kernels': saved_kernels,
-            'conflicts': len(conflicts)
-        }
+        self.write_manifest()
+        stats['conflicts'] = sum(
+            kernel.get('renamed', False)
+            for entry in self.index.sources.values() for kernel in entry['kernels'].values()
+        )
+        return stats
+    
+    def write_manifest(self) -> Path:
+        self.index.save()
+        return self.index.manifest_path
 
 
 def main():
@@ -159,15 +267,17 @@ def main():
     logger.info("=" * 60)
     
     try:
-        saver = KernelSaver(EXTRACTION_RESULTS_DIR, EXTRACTED_KERNELS_DIR)
+        saver = KernelSaver(EXTRACTION_RESULTS_DIR, EXTRACTED_KERNELS_DIR, content_filter=keep_rule_headers)
         
-        stats = saver.save_kernels()
+        with MetricsRecorder(METRICS_PATH).stage_timer("step3_save"):
+            stats = saver.save_kernels()
         
         logger.info("=" * 60)
         logger.info(f"✓ Step 3 completed!")
-        logger.info(f"  - Processed source files: {stats['total_files']}")
+        logger.info(f"  - Processed source files: {stats['total_files']} ({stats['unchanged_files']} unchanged, skipped, "
+                    f"{stats['removed_files']} deleted)")
         logger.info(f"  - Total extracted kernels: {stats['total_kernels']}")
-        logger.info(f"  - Successfully saved: {stats['saved_kernels']}")
+        logger.info(f"  - Written: {stats['saved_kernels']}, already up to date: {stats['unchanged_kernels']}")
         logger.info(f"  - Name conflicts: {stats['conflicts']}")
         logger.info(f"  - Output directory: {EXTRACTED_KERNELS_DIR}")
         logger.info("=" * 60)
@@ -1,66 +1,108 @@
-import re
+import os
 from pathlib import Path
+from collections import Counter
+from functools import lru_cache
+from typing import List, Tuple
 import argparse
 
+from config_project import (
+    EXTRACTED_KERNELS_DIR, CUDA_EXTENSIONS, HEADER_RULES_PATH, HEADER_RULE_SETS, HEADER_REWRITE_WORKERS, METRICS_PATH
+)
+from header_rewriter import HeaderRewriter
+from telemetry import MetricsRecorder
+
+
+@lru_cache(maxsize=None)
+def _default_rewriter() -> HeaderRewriter:
+    return HeaderRewriter.from_file(HEADER_RULES_PATH, HEADER_RULE_SETS)
+
+
+@lru_cache(maxsize=None)
+def _all_rules_rewriter() -> HeaderRewriter:
+    return HeaderRewriter.from_file(HEADER_RULES_PATH)
+
+
+def clean_header_content(content: str) -> str:
+    # Kernel rendering filter (pipeline, dataset export): includes the rule sets do not mention are dropped,
+    # the others are stripped, replaced or shimmed by their rule
+    return _default_rewriter().rewrite(content, strip_unmatched=True)[0]
+
+
+def keep_rule_headers(content: str) -> str:
+    # Step 3 filter: drops every include no rule set mentions and keeps the rest for step 4 to rewrite
+    return _all_rules_rewriter().strip_unmatched(content)
+
 
 def clean_headers(file_path: Path) -> bool:
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        original_content = content
-        
-        content = re.sub(r'#include\s+<ATen/[^>]+>\s*\n?', '', content, flags=re.IGNORECASE)
-        
-        content = re.sub(r'#include\s+<c10/[^>]+>\s*\n?', '', content, flags=re.IGNORECASE)
-        
-        content = re.sub(r'#include\s+<torch/[^>]+>\s*\n?', '', content, flags=re.IGNORECASE)
-        
-        if content != original_content:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            return True
-        
-        return False
-        
-    except Exception as e:
-        print(f"Processing failed {file_path}: {e}")
+    _, applied, error = _default_rewriter().rewrite_file(str(file_path))
+    if error:
+        print(f"Processing failed {file_path}: {error}")
         return False
+    return bool(applied)
+
+
+def collect_tasks(target_dir: Path, output_dir: Path = None) -> List[Tuple[str, str]]:
+    extensions = tuple(CUDA_EXTENSIONS)
+    tasks = []
+    for root, _, files in os.walk(target_dir):
+        for name in files:
+            if name.endswith(extensions):
+                source_path = os.path.join(root, name)
+                target_path = source_path
+                if output_dir is not None:
+                    target_path = str(output_dir / os.path.relpath(source_path, target_dir))
+                tasks.append((source_path, target_path))
+    tasks.sort()
+    return tasks
 
 
 def main():
-    parser = argparse.ArgumentParser(description='Clean PyTorch-related headers in CUDA files')
-    parser.add_argument('directory', nargs='?', 
-                       default=r'E:\Python Code\pythonProject\LLM\cuda-kernel-extractor-llm\output\extracted_kernels',
-                       help='Target directory path')
-    
+    parser = argparse.ArgumentParser(description='Rewrite header includes in CUDA files with configurable rule sets')
+    parser.add_argument('directory', nargs='?', default=EXTRACTED_KERNELS_DIR, help='Target directory path (searched recursively)')
+    parser.add_argument('--rule-set', action='append', dest='rule_sets',
+                        help=f"Rule set from the rules file, repeatable (default: {', '.join(HEADER_RULE_SETS)})")
+    parser.add_argument('--rules', default=HEADER_RULES_PATH, help='Header rules JSON file')
+    parser.add_argument('--output-dir', default=None, help='Write rewritten copies here instead of in place')
+    parser.add_argument('--workers', type=int, default=HEADER_REWRITE_WORKERS, help='Worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='Only report which rule would change which file')
+
     args = parser.parse_args()
     target_dir = Path(args.directory)
-    
+    rule_sets = args.rule_sets or HEADER_RULE_SETS
+
     if not target_dir.exists():
         print(f"Error: Directory does not exist {target_dir}")
         return
-    
-    cu_files = list(target_dir.glob('*.cu'))
-    
-    if not cu_files:
-        print(f"No .cu files found: {target_dir}")
+
+    rewriter = HeaderRewriter.from_file(args.rules, rule_sets)
+    tasks = collect_tasks(target_dir, Path(args.output_dir) if args.output_dir else None)
+
+    if not tasks:
+        print(f"No CUDA files found: {target_dir}")
         return
-    
-    print(f"Found {len(cu_files)} .cu files")
-    print("Start cleaning headers...")
-    
+
+    print(f"Found {len(tasks)} CUDA files, rule sets: {', '.join(rule_sets)}")
+    print("Start rewriting headers..." + (" (dry run)" if args.dry_run else ""))
+
     modified_count = 0
-    for cu_file in cu_files:
-        if clean_headers(cu_file):
-            modified_count += 1
-            print(f"✓ {cu_file.name}")
-        else:
-            print(f"- {cu_file.name} (no modification needed)")
-    
-    print(f"\nCompleted! Modified {modified_count}/{len(cu_files)} files")
+    failed_count = 0
+    rule_counts = Counter()
+    with MetricsRecorder(METRICS_PATH).stage_timer("step4_rewrite", files=len(tasks), dry_run=args.dry_run):
+        for source_path, applied, error in rewriter.rewrite_files(tasks, dry_run=args.dry_run, workers=args.workers):
+            if error:
+                failed_count += 1
+                print(f"✗ {source_path}: {error}")
+            elif applied:
+                modified_count += 1
+                rule_counts.update(applied)
+                rules = ", ".join(f"{name} x{count}" for name, count in sorted(applied.items()))
+                print(f"✓ {os.path.relpath(source_path, target_dir)} [{rules}]")
+
+    verb = "Would modify" if args.dry_run else "Modified"
+    print(f"\nCompleted! {verb} {modified_count}/{len(tasks)} files, failed {failed_count}")
+    for name, count in rule_counts.most_common():
+        print(f"  - {name}: {count} includes")
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,162 @@
+import os
+import math
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class MetricsRecorder:
+    # Records go straight to the metrics file and are not kept in memory; a summary reads this recorder's records
+    # back from the part of the file written since it was created
+
+    def __init__(self, metrics_path: str, run_id: Optional[str] = None):
+        self.metrics_path = metrics_path
+        self.run_id = run_id or time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(metrics_path) or ".", exist_ok=True)
+        self._start_offset = os.path.getsize(metrics_path) if os.path.exists(metrics_path) else 0
+
+    def record(self, kind: str, **fields) -> Dict:
+        record = {'kind': kind, 'run_id': self.run_id, 'timestamp': time.time()}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.metrics_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        return record
+
+    @contextmanager
+    def stage_timer(self, stage: str, **fields):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record('stage', stage=stage, elapsed=time.perf_counter() - started_at, **fields)
+
+    def load(self) -> List[Dict]:
+        if not os.path.exists(self.metrics_path):
+            return []
+        return load_records(self.metrics_path, self.run_id, self._start_offset)
+
+    def summary(self) -> Dict:
+        return summarize(self.load())
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        log_summary(self.summary(), logger)
+
+
+def summarize(records: List[Dict], slowest: int = 10) -> Dict:
+    requests = [r for r in records if r['kind'] == 'request']
+    live = [r for r in requests if not r.get('cached') and not r.get('error')]
+    files = [r for r in records if r['kind'] == 'file']
+    stages = [r for r in records if r['kind'] == 'stage']
+
+    latencies = [r.get('latency', 0.0) for r in live]
+    waits = [r.get('queue_wait', 0.0) for r in live]
+    input_tokens = sum(r.get('input_tokens', 0) for r in requests)
+    output_tokens = sum(r.get('output_tokens', 0) for r in requests)
+    live_input_tokens = sum(r.get('input_tokens', 0) for r in live)
+    cached_input_tokens = sum(r.get('cached_input_tokens', 0) for r in live)
+    kernels = sum(r.get('kernels', 0) for r in files)
+
+    throughput = defaultdict(int)
+    if files:
+        start = min(r['timestamp'] for r in files)
+        for r in files:
+            throughput[int((r['timestamp'] - start) // 60)] += 1
+
+    return {
+        'requests': len(requests),
+        'cache_hits': sum(1 for r in requests if r.get('cached')),
+        'errors': sum(1 for r in requests if r.get('error')),
+        'retries': sum(r.get('retries', 0) for r in requests),
+        'hedged': sum(1 for r in requests if r.get('hedged')),
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'latency_p99': percentile(latencies, 99),
+        'queue_wait_p50': percentile(waits, 50),
+        'queue_wait_p95': percentile(waits, 95),
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cached_input_tokens': cached_input_tokens,
+        'prefix_cache_hit_rate': cached_input_tokens / live_input_tokens if live_input_tokens else 0.0,
+        'tokens_per_kernel': (input_tokens + output_tokens) / kernels if kernels else 0.0,
+        'finish_reasons': dict(Counter(r.get('finish_reason') for r in live)),
+        'parse_outcomes': dict(Counter(r.get('parse_outcome') for r in requests)),
+        'endpoints': dict(Counter(r['endpoint'] for r in live if r.get('endpoint'))),
+        'files': len(files),
+        'kernels': kernels,
+        'files_per_minute': [throughput[m] for m in range(max(throughput) + 1)] if throughput else [],
+        'slowest_files': [
+            {'file': r.get('file'), 'elapsed': round(r.get('elapsed', 0.0), 2), 'method': r.get('method')}
+            for r in sorted(files, key=lambda r: r.get('elapsed', 0.0), reverse=True)[:slowest]
+        ],
+        'stages': {r['stage']: round(r['elapsed'], 2) for r in stages}
+    }
+
+
+def log_summary(summary: Dict, logger: logging.Logger) -> None:
+    logger.info("-" * 60)
+    logger.info("Telemetry summary")
+    logger.info(f"  - Requests: {summary['requests']} (cache hits {summary['cache_hits']}, "
+                f"errors {summary['errors']}, retries {summary['retries']}, hedged {summary.get('hedged', 0)})")
+    logger.info(f"  - Latency p50/p95/p99: {summary['latency_p50']:.2f}s / {summary['latency_p95']:.2f}s / "
+                f"{summary['latency_p99']:.2f}s, queue wait p50/p95: {summary['queue_wait_p50']:.2f}s / "
+                f"{summary['queue_wait_p95']:.2f}s")
+    logger.info(f"  - Tokens in/out: {summary['input_tokens']} / {summary['output_tokens']} "
+                f"(per kernel: {summary['tokens_per_kernel']:.0f}), prefix-cached input: "
+                f"{summary.get('cached_input_tokens', 0)} ({summary.get('prefix_cache_hit_rate', 0.0):.0%})")
+    logger.info(f"  - Finish reasons: {summary['finish_reasons']}, parse outcomes: {summary['parse_outcomes']}")
+    if summary.get('endpoints'):
+        logger.info(f"  - Requests per endpoint: {summary['endpoints']}")
+    logger.info(f"  - Files per minute: {summary['files_per_minute']}")
+    for entry in summary['slowest_files']:
+        logger.info(f"  - Slow file: {entry['elapsed']}s [{entry['method']}] {entry['file']}")
+    for stage, elapsed in summary['stages'].items():
+        logger.info(f"  - Stage {stage}: {elapsed}s")
+    logger.info("-" * 60)
+
+
+def load_records(metrics_path: str, run_id: Optional[str] = None, offset: int = 0) -> List[Dict]:
+    records = []
+    with open(metrics_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if run_id is None or record.get('run_id') == run_id:
+                records.append(record)
+    return records
+
+
+def main():
+    from config_project import METRICS_PATH
+
+    parser = argparse.ArgumentParser(description='Summarize pipeline telemetry')
+    parser.add_argument('--metrics', default=METRICS_PATH, help='Metrics JSONL file')
+    parser.add_argument('--run', default=None, help='Only include records from this run id')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    log_summary(summarize(load_records(args.metrics, args.run)), logging.getLogger(__name__))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 
 
 def load_prompt(path: str, encoding: str = "utf-8") -> str:
@@ -15,3 +15,10 @@ def ensure_prompt(path: str, default_content: str = "", encoding: str = "utf-8")
     if not file_path.exists():
         file_path.write_text(default_content, encoding=encoding)
 
+
+def split_prompt(template: str, marker: str) -> Tuple[str, str]:
+    # Static instructions before the marker, the per-input template from the marker on
+    index = template.find(marker)
+    if index == -1:
+        return "", template
+    return template[:index].rstrip().format(), template[index:]
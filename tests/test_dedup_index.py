@@ -0,0 +1,144 @@
+from pathlib import Path
+
+from dedup_index import (
+    DedupIndex, code_tokens, group_kernels, minhash_signature, prune_duplicates, signature_similarity
+)
+from kernel_index import KernelIndex
+
+
+LAYER_NORM = """#include <cuda_runtime.h>
+
+// Welford reduction over one row per block
+__global__ void layer_norm_kernel(float* __restrict__ out, const float* __restrict__ in,
+                                  const float* __restrict__ gamma, const float* __restrict__ beta,
+                                  int cols, float eps) {
+    extern __shared__ float shared[];
+    const float* row = in + blockIdx.x * cols;
+    float sum = 0.0f, sq_sum = 0.0f;
+    for (int i = threadIdx.x; i < cols; i += blockDim.x) {
+        float v = row[i];
+        sum += v;
+        sq_sum += v * v;
+    }
+    shared[threadIdx.x] = sum;
+    shared[threadIdx.x + blockDim.x] = sq_sum;
+    __syncthreads();
+    for (int stride = blockDim.x / 2; stride > 0; stride >>= 1) {
+        if (threadIdx.x < stride) {
+            shared[threadIdx.x] += shared[threadIdx.x + stride];
+            shared[threadIdx.x + blockDim.x] += shared[threadIdx.x + blockDim.x + stride];
+        }
+        __syncthreads();
+    }
+    float mean = shared[0] / cols;
+    float var = shared[blockDim.x] / cols - mean * mean;
+    float inv_std = rsqrtf(var + eps);
+    for (int i = threadIdx.x; i < cols; i += blockDim.x) {
+        out[blockIdx.x * cols + i] = (row[i] - mean) * inv_std * gamma[i] + beta[i];
+    }
+}
+"""
+
+# The same kernel from another project: renamed, reformatted, different comments
+LAYER_NORM_COPY = LAYER_NORM.replace("layer_norm_kernel", "ln_fwd").replace(
+    "// Welford reduction over one row per block", "/* forward pass, copied from apex */"
+).replace("    ", "  ")
+
+# A near duplicate: a fused residual add in the first loop
+LAYER_NORM_RESIDUAL = LAYER_NORM.replace("float v = row[i];", "float v = row[i] + residual[i];").replace(
+    "int cols, float eps)", "const float* __restrict__ residual, int cols, float eps)"
+).replace("layer_norm_kernel", "layer_norm_residual_kernel")
+
+SOFTMAX = """__global__ void softmax_kernel(float* out, const float* in, int n) {
+    __shared__ float max_val;
+    if (threadIdx.x == 0) {
+        max_val = -INFINITY;
+        for (int i = 0; i < n; ++i) max_val = fmaxf(max_val, in[i]);
+    }
+    __syncthreads();
+    float denom = 0.0f;
+    for (int i = 0; i < n; ++i) denom += __expf(in[i] - max_val);
+    for (int i = threadIdx.x; i < n; i += blockDim.x) out[i] = __expf(in[i] - max_val) / denom;
+}
+"""
+
+
+def test_code_tokens_ignore_comments_layout_and_own_name():
+    assert code_tokens(LAYER_NORM, "layer_norm_kernel") == code_tokens(LAYER_NORM_COPY, "ln_fwd")
+    # String literals are code, comments are not
+    assert code_tokens('printf("a // b"); // c') == ['printf', '(', '"', 'a', '/', '/', 'b', '"', ')', ';']
+
+
+def test_minhash_similarity_tracks_overlap():
+    full = minhash_signature(code_tokens(LAYER_NORM))
+    near = minhash_signature(code_tokens(LAYER_NORM_RESIDUAL))
+    other = minhash_signature(code_tokens(SOFTMAX))
+
+    assert len(full) == 64
+    assert signature_similarity(full, full) == 1.0
+    assert signature_similarity(full, near) > 0.85
+    assert signature_similarity(full, other) < 0.3
+
+
+def test_short_inputs_still_get_comparable_signatures():
+    tokens = code_tokens("__global__ void k(int* p) { p[0] = 1; }")
+    signature = minhash_signature(tokens)
+
+    assert len(tokens) - 4 < 64
+    assert max(signature) < (1 << 64) - 1
+    assert signature == minhash_signature(list(tokens))
+
+
+def test_index_groups_exact_and_near_duplicates_under_first_entry():
+    index = DedupIndex(threshold=0.85)
+
+    assert index.add("apex/layer_norm.cu", LAYER_NORM, "layer_norm_kernel") is None
+    assert index.add("fairseq/ln.cu", LAYER_NORM_COPY, "ln_fwd") == ("apex/layer_norm.cu", 1.0)
+    canonical, similarity = index.add("fused/ln_residual.cu", LAYER_NORM_RESIDUAL, "layer_norm_residual_kernel")
+    assert canonical == "apex/layer_norm.cu" and 0.85 <= similarity < 1.0
+    assert index.add("ops/softmax.cu", SOFTMAX, "softmax_kernel") is None
+
+
+def test_exact_threshold_only_matches_identical_tokens():
+    # Step 2 source dedup runs with threshold 1.0
+    index = DedupIndex(threshold=1.0)
+
+    assert index.add("a.cu", LAYER_NORM) is None
+    assert index.add("b.cu", LAYER_NORM.replace("    ", "\t")) == ("a.cu", 1.0)
+    assert index.add("c.cu", LAYER_NORM_RESIDUAL) is None
+
+
+def _save_kernel(index: KernelIndex, kernels_dir: Path, source_file: str, filename: str, func_name: str,
+                 code: str, renamed: bool = False) -> None:
+    (kernels_dir / filename).write_text(code, encoding='utf-8')
+    index.update_source(source_file, {filename: {'func_name': func_name, 'renamed': renamed}}, 1)
+
+
+def test_group_and_prune_keep_the_kernel_that_owns_its_name(tmp_path):
+    index = KernelIndex(tmp_path / "kernel_manifest.json")
+    # Saved first, but renamed for a name conflict: a copy that owns its name becomes canonical
+    _save_kernel(index, tmp_path, "fairseq/ln.cu", "ln_layer_norm_kernel.cu", "layer_norm_kernel",
+                 LAYER_NORM_COPY.replace("ln_fwd", "layer_norm_kernel"), renamed=True)
+    _save_kernel(index, tmp_path, "apex/layer_norm.cu", "layer_norm_kernel.cu", "layer_norm_kernel", LAYER_NORM)
+    _save_kernel(index, tmp_path, "fused/ln_residual.cu", "layer_norm_residual_kernel.cu", "layer_norm_residual_kernel",
+                 LAYER_NORM_RESIDUAL)
+    _save_kernel(index, tmp_path, "ops/softmax.cu", "softmax_kernel.cu", "softmax_kernel", SOFTMAX)
+    index.save()
+
+    groups = group_kernels(str(tmp_path), threshold=0.85)
+    assert sorted(groups) == ["layer_norm_kernel.cu", "softmax_kernel.cu"]
+    assert [member['file'] for member in groups["layer_norm_kernel.cu"]] == [
+        "layer_norm_kernel.cu", "layer_norm_residual_kernel.cu", "ln_layer_norm_kernel.cu"
+    ]
+
+    assert prune_duplicates(str(tmp_path), groups) == 2
+    assert not (tmp_path / "layer_norm_residual_kernel.cu").exists()
+    assert (tmp_path / "layer_norm_kernel.cu").exists()
+    pruned = KernelIndex(tmp_path / "kernel_manifest.json")
+    residual = pruned.sources["fused/ln_residual.cu"]['kernels']["layer_norm_residual_kernel.cu"]
+    assert residual['duplicate_of'] == "layer_norm_kernel.cu"
+    assert pruned.summary(tmp_path)['duplicates_pruned'] == 2
+
+    # Pruned copies stay out of the next grouping
+    regrouped = group_kernels(str(tmp_path))
+    assert [member['file'] for member in regrouped["layer_norm_kernel.cu"]] == ["layer_norm_kernel.cu"]
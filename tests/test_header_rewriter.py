@@ -0,0 +1,52 @@
+from config_project import HEADER_RULES_PATH
+from header_rewriter import HeaderRewriter
+from step3_kernel_saver import render_kernel
+from step4_clean_pytorch_headers import clean_header_content, keep_rule_headers
+
+
+KERNEL = """#include <cuda_runtime.h>
+#include <cuda_fp16.h>
+#include <ATen/ATen.h>
+#include "my_helpers.h"
+
+__global__ void scale_kernel(half* out, const half* in, float alpha, int n) {
+    int i = blockIdx.x * blockDim.x + threadIdx.x;
+    if (i < n) out[i] = __float2half(alpha * __half2float(in[i]));
+}
+"""
+
+
+def test_hip_replace_rules_change_rendered_kernel():
+    hip = HeaderRewriter.from_file(HEADER_RULES_PATH, ["hip"])
+    rendered = render_kernel(KERNEL, lambda content: hip.rewrite(content, strip_unmatched=True)[0])
+
+    assert "#include <hip/hip_runtime.h>" in rendered
+    assert "#include <hip/hip_fp16.h>" in rendered
+    assert "cuda_runtime.h" not in rendered
+    # Includes no hip rule mentions are dropped like the blanket strip did
+    assert "ATen" not in rendered and "my_helpers.h" not in rendered
+    assert "__global__ void scale_kernel" in rendered
+
+
+def test_shim_rule_injects_into_rendered_kernel():
+    shim = HeaderRewriter.from_file(HEADER_RULES_PATH, ["pytorch_shim"])
+    rendered = render_kernel(KERNEL, lambda content: shim.rewrite(content, strip_unmatched=True)[0])
+
+    assert rendered.startswith('#include "torch_shim.h"\n')
+    assert "ATen/ATen.h" not in rendered
+
+
+def test_step3_keeps_rule_headers_for_step4():
+    saved = render_kernel(KERNEL, keep_rule_headers)
+    assert "#include <cuda_runtime.h>" in saved and "#include <ATen/ATen.h>" in saved
+    assert "my_helpers.h" not in saved
+
+    hip, applied = HeaderRewriter.from_file(HEADER_RULES_PATH, ["hip"]).rewrite(saved)
+    assert applied == {"hip_runtime": 1, "hip_fp16": 1}
+    assert "#include <hip/hip_runtime.h>" in hip
+
+
+def test_default_pipeline_filter_strips_pytorch_headers():
+    rendered = render_kernel(KERNEL, clean_header_content)
+    assert "#include" not in rendered
+    assert "__global__ void scale_kernel" in rendered
@@ -0,0 +1,155 @@
+from local_kernel_extractor import CudaSourceAnalyzer, LocalKernelExtractor, mask_source
+
+
+SAXPY = """#include <cuda_runtime.h>
+#include "common.h"
+
+#define BLOCK_SIZE 256
+#define CLAMP(x, lo, hi) ((x) < (lo) ? (lo) : ((x) > (hi) ? (hi) : (x)))
+
+struct Params {
+    float alpha;
+    int n;
+};
+
+__device__ __forceinline__ float scaled(float x, const Params& p) {
+    return CLAMP(p.alpha * x, -1.0f, 1.0f);
+}
+
+// A "}" in a comment and a '{' in a literal must not end the kernel early
+__global__ void __launch_bounds__(BLOCK_SIZE) saxpy_kernel(float* y, const float* x, Params p) {
+    const char* tag = "saxpy { }";
+    int i = blockIdx.x * blockDim.x + threadIdx.x;
+    if (i < p.n) {
+        y[i] = scaled(x[i], p) + y[i];  /* } */
+    }
+}
+
+void launch_saxpy(float* y, const float* x, Params p, cudaStream_t stream) {
+    saxpy_kernel<<<(p.n + BLOCK_SIZE - 1) / BLOCK_SIZE, BLOCK_SIZE, 0, stream>>>(y, x, p);
+}
+"""
+
+NAMESPACED_TEMPLATE = """#include <cstdint>
+
+namespace ops {
+namespace {
+
+template <typename T>
+__device__ T relu(T v) { return v > T(0) ? v : T(0); }
+
+}  // namespace
+
+template <typename T, int kVec>
+__global__ void relu_kernel(T* __restrict__ out, const T* __restrict__ in, int64_t n) {
+    for (int64_t i = blockIdx.x * blockDim.x + threadIdx.x; i < n; i += gridDim.x * blockDim.x) {
+        out[i] = relu(in[i]);
+    }
+}
+
+template __global__ void relu_kernel<float, 4>(float*, const float*, int64_t);
+
+}  // namespace ops
+"""
+
+CONDITIONAL = """#include <cuda_fp16.h>
+
+#if __CUDA_ARCH__ >= 800
+__device__ half fast_exp(half x) { return hexp(x); }
+#else
+__device__ half fast_exp(half x) { return __float2half(expf(__half2float(x))); }
+#endif
+
+__global__ void softmax_kernel(half* out, const half* in, int n) {
+    int i = threadIdx.x;
+    if (i < n) out[i] = fast_exp(in[i]);
+}
+"""
+
+MACRO_KERNELS = """#define DEFINE_FILL(T) \\
+    __global__ void fill_##T(T* out, T value, int n) { \\
+        int i = threadIdx.x; if (i < n) out[i] = value; \\
+    }
+
+DEFINE_FILL(float)
+DEFINE_FILL(int)
+"""
+
+
+def test_mask_source_blanks_comments_and_literals():
+    source = 'int a = 1; // }\nconst char* s = "{";\n/* { */ char c = \'}\';\n'
+    masked = mask_source(source)
+
+    assert len(masked) == len(source)
+    assert masked.count('\n') == source.count('\n')
+    assert '{' not in masked and '}' not in masked
+    assert 'int a = 1;' in masked and 'char c =' in masked
+
+
+def test_kernel_span_ignores_braces_in_comments_and_strings():
+    analyzer = CudaSourceAnalyzer(SAXPY)
+
+    assert analyzer.issues == []
+    assert [kernel.name for kernel in analyzer.kernels] == ['saxpy_kernel']
+    kernel = analyzer.kernels[0]
+    assert kernel.text.startswith('__global__ void __launch_bounds__(BLOCK_SIZE) saxpy_kernel(')
+    assert kernel.text.rstrip().endswith('}')
+    assert 'launch_saxpy' not in kernel.text
+    assert kernel.signature == ('__global__ void __launch_bounds__(BLOCK_SIZE) saxpy_kernel('
+                                'float* y, const float* x, Params p)')
+
+
+def test_unit_carries_dependency_closure_but_not_host_code():
+    result, issues = LocalKernelExtractor().extract('saxpy.cu', SAXPY)
+
+    assert issues == []
+    assert result['extraction_method'] == 'local'
+    unit = result['kernels'][0]['func_content']
+    # The device helper pulls in CLAMP and Params; the launch bound pulls in BLOCK_SIZE
+    for needed in ('#include <cuda_runtime.h>', '#define BLOCK_SIZE 256', '#define CLAMP(', 'struct Params',
+                   'float scaled(', 'saxpy_kernel('):
+        assert needed in unit
+    assert '"common.h"' not in unit
+    assert 'launch_saxpy' not in unit
+    assert unit.index('struct Params') < unit.index('float scaled(') < unit.index('saxpy_kernel(')
+
+
+def test_templates_inside_namespaces_and_explicit_instantiations():
+    analyzer = CudaSourceAnalyzer(NAMESPACED_TEMPLATE)
+
+    assert analyzer.issues == []
+    assert [kernel.name for kernel in analyzer.kernels] == ['relu_kernel']
+    # The explicit instantiation is a declaration, not a second kernel
+    assert analyzer.global_declarations == 1
+    unit = analyzer.render_unit(analyzer.kernels[0], analyzer.dependency_closure(analyzer.kernels[0]))
+    assert 'T relu(T v)' in unit and 'relu_kernel(' in unit
+
+
+def test_conditional_dependencies_are_reported():
+    result, issues = LocalKernelExtractor().extract('softmax.cu', CONDITIONAL)
+
+    assert result is None
+    assert "fast_exp is under a preprocessor conditional" in issues
+
+
+def test_macro_generated_kernels_are_left_to_the_llm():
+    result, issues = LocalKernelExtractor().extract('fill.cu', MACRO_KERNELS)
+
+    assert result is None
+    assert 'macro DEFINE_FILL defines CUDA functions' in issues
+
+
+def test_unbalanced_preprocessor_and_braces_are_structural():
+    analyzer = CudaSourceAnalyzer("#ifdef USE_FAST\n__global__ void k(int* p) { p[0] = 1; }\n")
+    assert "unbalanced #if/#endif" in analyzer.structural_issues
+
+    analyzer = CudaSourceAnalyzer("__global__ void k(int* p) { if (p) { p[0] = 1; }\n")
+    assert "unbalanced braces" in analyzer.structural_issues
+
+
+def test_include_guard_does_not_mark_everything_conditional():
+    source = "#ifndef KERNELS_CUH\n#define KERNELS_CUH\n" + SAXPY + "#endif  // KERNELS_CUH\n"
+    result, issues = LocalKernelExtractor().extract('kernels.cuh', source)
+
+    assert issues == []
+    assert [kernel['func_name'] for kernel in result['kernels']] == ['saxpy_kernel']
@@ -0,0 +1,121 @@
+import json
+
+from json_stream import IncrementalKernelParser, KernelStream, loads_lenient, repair_json
+from response_parser import parse_kernel_response, parse_packed_response
+
+
+RELU = {
+    'func_name': 'relu_kernel',
+    'func_signature': '__global__ void relu_kernel(float* out, const float* in, int n)',
+    'func_content': ('#include <cuda_runtime.h>\n\n'
+                     '__global__ void relu_kernel(float* out, const float* in, int n) {\n'
+                     '    int i = blockIdx.x * blockDim.x + threadIdx.x;\n'
+                     '    if (i < n) out[i] = in[i] > 0.0f ? in[i] : 0.0f;\n'
+                     '}\n')
+}
+ADD = {
+    'func_name': 'add_kernel',
+    'func_signature': '__global__ void add_kernel(float* c, const float* a, const float* b, int n)',
+    'func_content': ('__global__ void add_kernel(float* c, const float* a, const float* b, int n) {\n'
+                     '    int i = threadIdx.x; if (i < n) c[i] = a[i] + b[i];\n'
+                     '}\n')
+}
+RESPONSE = json.dumps({'kernels': [RELU, ADD]}, indent=2)
+
+
+def test_repair_escapes_raw_code_in_strings():
+    # What models send: raw newlines, a macro line continuation and an unescaped include quote
+    broken = ('{"func_name": "k", "func_content": "#include "helpers.cuh"\n'
+              '#define IDX(i, j) \\\n    ((i) * 32 + (j))\n'
+              '__global__ void k(float* p) {\tp[IDX(0, 1)] = 1; }",}')
+    loaded = json.loads(repair_json(broken))
+
+    assert loaded['func_content'] == ('#include "helpers.cuh"\n#define IDX(i, j) \\\n    ((i) * 32 + (j))\n'
+                                      '__global__ void k(float* p) {\tp[IDX(0, 1)] = 1; }')
+
+
+def test_repair_keeps_valid_escapes_and_drops_trailing_commas():
+    text = '{"kernels": [{"func_name": "k", "func_content": "printf(\\"%d\\\\n\\", x);\\u00e9"},],}'
+    assert loads_lenient(text) == {'kernels': [{'func_name': 'k', 'func_content': 'printf("%d\\n", x);é'}]}
+
+
+def test_parse_plain_fenced_and_wrapped_responses():
+    assert parse_kernel_response(RESPONSE) == ({'kernels': [RELU, ADD]}, 'ok')
+
+    fenced = f"Here are the kernels:\n```json\n{RESPONSE}\n```\nLet me know if you need more."
+    assert parse_kernel_response(fenced) == ({'kernels': [RELU, ADD]}, 'ok')
+
+    # A bare array is accepted as the kernel list
+    assert parse_kernel_response(json.dumps([RELU])) == ({'kernels': [RELU]}, 'ok')
+    assert parse_kernel_response(f"```\n{json.dumps([RELU, ADD])}\n```") == ({'kernels': [RELU, ADD]}, 'ok')
+    # Brackets in the prose before the object are not mistaken for one
+    assert parse_kernel_response(f"Found [2] kernels:\n{RESPONSE}") == ({'kernels': [RELU, ADD]}, 'ok')
+
+
+def test_parse_repairs_raw_newlines():
+    raw = '{"kernels": [{"func_name": "relu_kernel", "func_content": "__global__ void relu_kernel() {\n}\n"}]}'
+    result, outcome = parse_kernel_response(raw)
+
+    assert outcome == 'repaired'
+    assert result['kernels'][0]['func_content'] == '__global__ void relu_kernel() {\n}\n'
+
+
+def test_truncated_response_recovers_complete_kernels():
+    truncated = RESPONSE[:RESPONSE.index('add_kernel(float* c') + 10]
+    result, outcome = parse_kernel_response(truncated)
+
+    assert outcome == 'recovered'
+    assert result == {'kernels': [RELU], 'recovered': True}
+
+
+def test_unparseable_responses_fail():
+    assert parse_kernel_response(None) == (None, 'failed')
+    assert parse_kernel_response("I could not find any kernels in this file.") == (None, 'failed')
+    assert parse_kernel_response('{"kernels": [{"func_content": "no name"') == (None, 'failed')
+
+
+def test_packed_response_recovers_results_by_source_file():
+    first = {'source_file': 'F1', 'kernels': [RELU]}
+    packed = json.dumps({'results': [first, {'source_file': 'F2', 'kernels': [ADD]}]})
+    assert parse_packed_response(packed) == (json.loads(packed), 'ok')
+
+    result, outcome = parse_packed_response(packed[:packed.index('"F2"')])
+    assert outcome == 'recovered'
+    assert result == {'results': [first]}
+
+
+def test_incremental_parser_emits_each_kernel_once_it_is_complete():
+    parser = IncrementalKernelParser()
+    emitted = []
+    for i in range(0, len(RESPONSE), 7):
+        emitted.append([kernel['func_name'] for kernel in parser.feed(RESPONSE[i:i + 7])])
+
+    flat = [name for names in emitted for name in names]
+    assert flat == ['relu_kernel', 'add_kernel']
+    # relu_kernel is handed out while add_kernel is still arriving
+    assert emitted.index(['relu_kernel']) < emitted.index(['add_kernel'])
+    assert parser.array_closed
+    assert parser.text == RESPONSE
+
+
+def test_incremental_parser_is_not_fooled_by_braces_in_code():
+    tricky = dict(RELU, func_content='__global__ void k() { const char* s = "}]\\"{"; }\n')
+    text = json.dumps({'kernels': [tricky, ADD]})
+    parser = IncrementalKernelParser()
+    for ch in text:
+        parser.feed(ch)
+
+    assert parser.kernels == [tricky, ADD]
+
+
+def test_kernel_stream_deduplicates_across_resets():
+    seen = []
+    stream = KernelStream(on_kernel=lambda kernel: seen.append(kernel['func_name']))
+
+    # A retried or hedged attempt replays the kernels of the first one
+    stream.feed(RESPONSE[:RESPONSE.index('add_kernel')])
+    stream.reset()
+    stream.feed(RESPONSE)
+
+    assert seen == ['relu_kernel', 'add_kernel']
+    assert stream.kernels == [RELU, ADD]
@@ -0,0 +1,118 @@
+import pytest
+
+import work_queue
+from work_queue import WorkQueue
+
+
+ENTRIES = [
+    {'path': 'src/apex/csrc/layer_norm_cuda_kernel.cu', 'sha256': 'a1', 'size': 48000, 'kernels': 6},
+    {'path': 'src/vllm/csrc/activation_kernels.cu', 'sha256': 'b1', 'size': 9000, 'kernels': 3},
+    {'path': 'src/mmcv/ops/csrc/nms_cuda.cu', 'sha256': 'c1', 'size': 2000, 'kernels': 1},
+]
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(work_queue.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = WorkQueue(str(tmp_path / "work_queue.db"), lease_seconds=60, max_attempts=2)
+    queue.load_inventory(ENTRIES, 'inventory-1', 'model-a/v1')
+    yield queue
+    queue.close()
+
+
+def test_claims_largest_first_and_loads_once(queue):
+    assert queue.load_inventory(ENTRIES, 'inventory-1', 'model-a/v1') is None
+
+    lease_id, entries = queue.claim('worker-1', 2)
+    assert lease_id is not None
+    assert [entry['path'] for entry in entries] == [ENTRIES[0]['path'], ENTRIES[1]['path']]
+
+    _, rest = queue.claim('worker-2', 2)
+    assert [entry['path'] for entry in rest] == [ENTRIES[2]['path']]
+    assert queue.claim('worker-3', 2) == (None, [])
+    assert queue.counts()['leased'] == 3
+
+
+def test_expired_lease_is_reclaimed_and_stale_holder_cannot_complete(queue, clock):
+    lease_1, entries = queue.claim('worker-1', 1)
+    clock.now += 30
+    # Still leased: nothing left to hand out but the two smaller entries
+    assert [entry['path'] for entry in queue.claim('worker-2', 3)[1]] == [ENTRIES[1]['path'], ENTRIES[2]['path']]
+
+    clock.now += 31
+    lease_2, reclaimed = queue.claim('worker-3', 3)
+    assert [entry['path'] for entry in reclaimed] == [ENTRIES[0]['path']]
+
+    # worker-1 crashed or stalled; its late result must not finish the entry worker-3 now holds
+    assert queue.complete(lease_1, [entries[0]['path']], {}) == 1
+    assert queue.counts()['done'] == 0
+    assert queue.complete(lease_2, [ENTRIES[0]['path']], {}) == 0
+    assert queue.counts()['done'] == 1
+
+
+def test_heartbeat_keeps_the_lease(queue, clock):
+    lease_id, _ = queue.claim('worker-1', 1)
+    for _ in range(3):
+        clock.now += 50
+        assert queue.heartbeat([lease_id]) == 1
+    assert [entry['path'] for entry in queue.claim('worker-2', 3)[1]] == [ENTRIES[1]['path'], ENTRIES[2]['path']]
+
+
+def test_entries_fail_after_max_attempts(queue, clock):
+    lease_id, _ = queue.claim('worker-1', 1)
+    assert queue.complete(lease_id, [], {ENTRIES[0]['path']: 'parse failed'}) == 0
+    assert queue.counts()['pending'] == 3
+
+    lease_id, entries = queue.claim('worker-1', 1)
+    assert entries[0]['path'] == ENTRIES[0]['path']
+    queue.complete(lease_id, [], {ENTRIES[0]['path']: 'parse failed'})
+    assert queue.failures() == [(ENTRIES[0]['path'], 'parse failed')]
+
+    # A lease that expires on its last attempt fails the entry at the next claim
+    queue.claim('worker-1', 1)
+    queue.claim('worker-1', 1)
+    clock.now += 61
+    queue.claim('worker-2', 1)
+    clock.now += 61
+    _, entries = queue.claim('worker-2', 3)
+    assert [entry['path'] for entry in entries] == [ENTRIES[2]['path']]
+    assert dict(queue.failures())[ENTRIES[1]['path']] == 'lease expired'
+
+    assert queue.requeue_failed() == 2
+    assert queue.counts()['pending'] == 2
+
+
+def test_release_returns_entries_without_spending_an_attempt(queue):
+    for _ in range(3):
+        lease_id, entries = queue.claim('worker-1', 3)
+        assert len(entries) == 3
+        assert queue.release([lease_id]) == 3
+    assert queue.counts() == {'pending': 3, 'leased': 0, 'done': 0, 'failed': 0}
+
+
+def test_reload_restarts_changed_entries_and_drops_deleted_ones(queue):
+    lease_id, _ = queue.claim('worker-1', 3)
+    queue.complete(lease_id, [entry['path'] for entry in ENTRIES], {})
+
+    changed = [dict(ENTRIES[0], sha256='a2'), ENTRIES[1]]
+    assert queue.load_inventory(changed, 'inventory-2', 'model-a/v1') == {'added': 0, 'changed': 1, 'dropped': 1}
+    assert queue.counts() == {'pending': 1, 'leased': 0, 'done': 1, 'failed': 0}
+
+    # A new model or prompt version starts every entry over
+    queue.load_inventory(changed, 'inventory-2', 'model-b/v1')
+    assert queue.counts()['pending'] == 2
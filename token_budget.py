@@ -0,0 +1,54 @@
+import math
+from typing import Iterable, Tuple
+
+from local_kernel_extractor import CudaSourceAnalyzer
+
+
+CHARS_PER_TOKEN = 4
+# JSON keys, signature and escaping around each kernel's code, and around the whole answer
+KERNEL_OVERHEAD_TOKENS = 64
+RESPONSE_OVERHEAD_TOKENS = 32
+# Prefill is far cheaper per token than decoding, which dominates a request's latency
+INPUT_TOKEN_WEIGHT = 0.05
+
+
+def rough_output_tokens(code_tokens: int, kernels: int) -> int:
+    # Without a parse: each extra kernel repeats about half of the file's shared helpers and macros
+    kernels = max(1, kernels)
+    return int(code_tokens * (1 + 0.5 * (kernels - 1))) + KERNEL_OVERHEAD_TOKENS * kernels + RESPONSE_OVERHEAD_TOKENS
+
+
+class TokenBudget:
+    # Local estimates of a request's input and output tokens. The answer holds one self-contained unit
+    # per kernel, so its size is estimated by rendering those units the way the local extractor does.
+
+    def __init__(self, headroom: float = 1.5, min_output_tokens: int = 1024):
+        self.headroom = headroom
+        self.min_output_tokens = min_output_tokens
+
+    def estimate(self, code: str) -> Tuple[int, int]:
+        input_tokens = len(code) // CHARS_PER_TOKEN
+        analyzer = CudaSourceAnalyzer(code)
+        if not analyzer.kernels or analyzer.structural_issues:
+            return input_tokens, rough_output_tokens(input_tokens, code.count('__global__'))
+
+        output_chars = sum(
+            len(analyzer.render_unit(kernel, analyzer.dependency_closure(kernel))) + len(kernel.signature)
+            for kernel in analyzer.kernels
+        )
+        output_tokens = output_chars // CHARS_PER_TOKEN + KERNEL_OVERHEAD_TOKENS * len(analyzer.kernels)
+        return input_tokens, output_tokens + RESPONSE_OVERHEAD_TOKENS
+
+    def estimate_all(self, codes: Iterable[str]) -> Tuple[int, int]:
+        estimates = [self.estimate(code) for code in codes]
+        return sum(e[0] for e in estimates), sum(e[1] for e in estimates)
+
+    def max_tokens(self, output_tokens: int, limit: int) -> int:
+        # Never above the endpoint's own max_tokens; truncated answers still get continuations
+        return min(limit, max(self.min_output_tokens, math.ceil(output_tokens * self.headroom)))
+
+    @staticmethod
+    def work_cost(size: int, kernels: int) -> float:
+        # Cheap ordering key from the inventory alone (file size and __global__ count)
+        code_tokens = size // CHARS_PER_TOKEN
+        return code_tokens * INPUT_TOKEN_WEIGHT + rough_output_tokens(code_tokens, kernels)
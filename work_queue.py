@@ -0,0 +1,254 @@
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config_project import WORK_QUEUE_PATH, WORK_LEASE_SECONDS, WORK_MAX_ATTEMPTS, SHARED_JOURNAL_MODE
+from result_store import init_journal_mode
+from token_budget import TokenBudget
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    source_path TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    cost REAL NOT NULL,
+    entry TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_id TEXT,
+    worker TEXT,
+    lease_expires REAL,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_state_cost ON items (state, cost);
+CREATE INDEX IF NOT EXISTS items_lease ON items (lease_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class WorkQueue:
+    # Step 2 inventory entries shared by any number of worker processes through one SQLite database. A claim
+    # leases a batch of entries (largest first) to one worker until lease_expires; the worker's heartbeat pushes
+    # the expiry forward, and entries whose lease ran out are claimed again by whoever asks next. Completing with
+    # a lease that was lost in the meantime changes nothing, so an entry is only ever finished by its current holder.
+
+    STATE_PENDING = "pending"
+    STATE_LEASED = "leased"
+    STATE_DONE = "done"
+    STATE_FAILED = "failed"
+
+    BUSY_TIMEOUT_SECONDS = 120
+
+    def __init__(self, db_path: str, lease_seconds: float = WORK_LEASE_SECONDS,
+                 max_attempts: int = WORK_MAX_ATTEMPTS, journal_mode: str = SHARED_JOURNAL_MODE):
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        init_journal_mode(conn, journal_mode, self.logger)
+        conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @contextmanager
+    def _write(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _meta(self, conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def inventory_loaded(self, inventory_key: str, extraction_key: str) -> bool:
+        conn = self._connection()
+        return (self._meta(conn, 'inventory') == inventory_key
+                and self._meta(conn, 'extraction') == extraction_key)
+
+    def load_inventory(self, entries: Iterable[Dict], inventory_key: str, extraction_key: str) -> Optional[Dict[str, int]]:
+        # Idempotent: the first worker to get here loads the inventory, the others see its key and return None.
+        # Entries whose content changed, and every entry when the model or prompt version changed, start over;
+        # entries gone from the inventory are dropped unless a worker holds them
+        now = time.time()
+        rows = {
+            entry['path']: (entry['path'], entry['sha256'],
+                            TokenBudget.work_cost(entry['size'], entry.get('kernels', 1)),
+                            json.dumps(entry, ensure_ascii=False), self.STATE_PENDING, now)
+            for entry in entries
+        }
+        with self._write() as conn:
+            if self._meta(conn, 'inventory') == inventory_key and self._meta(conn, 'extraction') == extraction_key:
+                return None
+            if self._meta(conn, 'extraction') != extraction_key:
+                conn.execute("UPDATE items SET state = ?, attempts = 0, error = NULL WHERE state != ?",
+                             (self.STATE_PENDING, self.STATE_LEASED))
+            known = {source_path: content_hash for source_path, content_hash
+                     in conn.execute("SELECT source_path, content_hash FROM items")}
+            dropped = [(source_path, self.STATE_LEASED) for source_path in known if source_path not in rows]
+            conn.executemany("DELETE FROM items WHERE source_path = ? AND state != ?", dropped)
+            conn.executemany(
+                "INSERT INTO items (source_path, content_hash, cost, entry, state, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (source_path) DO UPDATE SET content_hash = excluded.content_hash, cost = excluded.cost, "
+                "entry = excluded.entry, state = ?, attempts = 0, lease_id = NULL, lease_expires = NULL, error = NULL, "
+                "updated_at = excluded.updated_at",
+                [row + (self.STATE_PENDING,) for path, row in rows.items() if known.get(path) != row[1]]
+            )
+            for key, value in (('inventory', inventory_key), ('extraction', extraction_key)):
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        changed = sum(1 for path, row in rows.items() if path in known and known[path] != row[1])
+        return {'added': sum(1 for path in rows if path not in known), 'changed': changed, 'dropped': len(dropped)}
+
+    def claim(self, worker: str, limit: int) -> Tuple[Optional[str], List[Dict]]:
+        # Returns (lease_id, inventory entries); an empty list once nothing is pending or expired
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE items SET state = ?, lease_id = NULL, error = 'lease expired', updated_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (self.STATE_FAILED, now, self.STATE_LEASED, now, self.max_attempts)
+            )
+            rows = conn.execute(
+                "SELECT source_path, entry FROM items WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY cost DESC LIMIT ?",
+                (self.STATE_PENDING, self.STATE_LEASED, now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE items SET state = ?, lease_id = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE source_path = ?",
+                [(self.STATE_LEASED, lease_id, worker, now + self.lease_seconds, now, source_path)
+                 for source_path, _ in rows]
+            )
+        if not rows:
+            return None, []
+        return lease_id, [json.loads(entry) for _, entry in rows]
+
+    def heartbeat(self, lease_ids: Iterable[str]) -> int:
+        lease_ids = list(lease_ids)
+        if not lease_ids:
+            return 0
+        now = time.time()
+        with self._write() as conn:
+            return conn.executemany(
+                "UPDATE items SET lease_expires = ?, updated_at = ? WHERE lease_id = ? AND state = ?",
+                [(now + self.lease_seconds, now, lease_id, self.STATE_LEASED) for lease_id in lease_ids]
+            ).rowcount
+
+    def complete(self, lease_id: str, done: Iterable[str], failed: Dict[str, str]) -> int:
+        # Failed entries go back to pending until they run out of attempts; returns how many entries this lease
+        # no longer held (expired and claimed by another worker)
+        now = time.time()
+        done = list(done)
+        with self._write() as conn:
+            updated = conn.executemany(
+                "UPDATE items SET state = ?, lease_id = NULL, lease_expires = NULL, error = NULL, updated_at = ? "
+                "WHERE source_path = ? AND lease_id = ?",
+                [(self.STATE_DONE, now, source_path, lease_id) for source_path in done]
+            ).rowcount if done else 0
+            if failed:
+                updated += conn.executemany(
+                    "UPDATE items SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_id = NULL, "
+                    "lease_expires = NULL, error = ?, updated_at = ? WHERE source_path = ? AND lease_id = ?",
+                    [(self.max_attempts, self.STATE_FAILED, self.STATE_PENDING, error, now, source_path, lease_id)
+                     for source_path, error in failed.items()]
+                ).rowcount
+        return len(done) + len(failed) - updated
+
+    def release(self, lease_ids: Iterable[str]) -> int:
+        # Hands unfinished entries back on shutdown without spending an attempt
+        lease_ids = list(lease_ids)
+        if not lease_ids:
+            return 0
+        with self._write() as conn:
+            return conn.executemany(
+                "UPDATE items SET state = ?, lease_id = NULL, lease_expires = NULL, attempts = attempts - 1, "
+                "updated_at = ? WHERE lease_id = ? AND state = ?",
+                [(self.STATE_PENDING, time.time(), lease_id, self.STATE_LEASED) for lease_id in lease_ids]
+            ).rowcount
+
+    def requeue_failed(self) -> int:
+        with self._write() as conn:
+            return conn.execute(
+                "UPDATE items SET state = ?, attempts = 0, error = NULL, updated_at = ? WHERE state = ?",
+                (self.STATE_PENDING, time.time(), self.STATE_FAILED)
+            ).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        counts = {state: 0 for state in (self.STATE_PENDING, self.STATE_LEASED, self.STATE_DONE, self.STATE_FAILED)}
+        counts.update(self._connection().execute("SELECT state, COUNT(*) FROM items GROUP BY state"))
+        return counts
+
+    def workers(self) -> List[Tuple[str, int, float]]:
+        # (worker, leased entries, seconds until its latest lease expires)
+        now = time.time()
+        return [
+            (worker, count, expires - now) for worker, count, expires in self._connection().execute(
+                "SELECT worker, COUNT(*), MAX(lease_expires) FROM items WHERE state = ? GROUP BY worker ORDER BY worker",
+                (self.STATE_LEASED,)
+            )
+        ]
+
+    def failures(self, limit: int = 20) -> List[Tuple[str, str]]:
+        return self._connection().execute(
+            "SELECT source_path, error FROM items WHERE state = ? ORDER BY source_path LIMIT ?",
+            (self.STATE_FAILED, limit)
+        ).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect the distributed step 2 work queue')
+    parser.add_argument('--queue', default=WORK_QUEUE_PATH, help='Work queue database')
+    parser.add_argument('--requeue-failed', action='store_true', help='Give failed entries a fresh set of attempts')
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    logger = logging.getLogger(__name__)
+
+    queue = WorkQueue(args.queue)
+    if args.requeue_failed:
+        logger.info(f"✓ Requeued {queue.requeue_failed()} failed entries")
+
+    counts = queue.counts()
+    logger.info(f"Work queue {queue.db_path}: " + ", ".join(f"{count} {state}" for state, count in counts.items()))
+    for worker, count, expires_in in queue.workers():
+        logger.info(f"  - {worker}: {count} entries leased, lease expires in {expires_in:.0f}s")
+    for source_path, error in queue.failures():
+        logger.info(f"  ✗ {source_path}: {error}")
+
+
+if __name__ == "__main__":
+    main()